@@ -39,6 +39,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "store.middleware.AnonymousPageCacheMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -56,13 +57,20 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "store.context_processors.cache_versions",
+            ],
+            # Compiled templates are kept in memory per process (APP_DIRS is replaced by the app loader)
+            "loaders": [
+                ("django.template.loaders.cached.Loader", [
+                    "django.template.loaders.filesystem.Loader",
+                    "django.template.loaders.app_directories.Loader",
+                ]),
             ],
         },
     },
@@ -90,6 +98,77 @@ else:
         )
     }
 
+# Cache (file-based so version stamps and cached pages are shared by all gunicorn workers)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", "/tmp/agromart_cache"),
+        "TIMEOUT": 300,
+    },
+    # Template fragments are keyed by row timestamps and version stamps, so a per-process cache is safe
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "template-fragments",
+        "TIMEOUT": 3600,
+    },
+}
+PAGE_CACHE_TIMEOUT = int(os.getenv("PAGE_CACHE_TIMEOUT", "600"))
+
+# Seconds a started checkout keeps its cart lines reserved
+STOCK_HOLD_TTL = int(os.getenv("STOCK_HOLD_TTL", "900"))
+
+# Reorder points: sales per day over the window, covering lead time plus safety days
+REORDER_WINDOW_DAYS = int(os.getenv("REORDER_WINDOW_DAYS", "28"))
+REORDER_LEAD_TIME_DAYS = int(os.getenv("REORDER_LEAD_TIME_DAYS", "7"))
+REORDER_SAFETY_DAYS = int(os.getenv("REORDER_SAFETY_DAYS", "3"))
+REORDER_MIN_POINT = int(os.getenv("REORDER_MIN_POINT", "10"))
+# Days of forecast demand a replenishment order covers beyond the reorder level
+REPLENISHMENT_COVER_DAYS = int(os.getenv("REPLENISHMENT_COVER_DAYS", "14"))
+
+# Outbox events are retried after OUTBOX_RETRY_DELAY seconds, doubling per attempt, up to the maximum
+OUTBOX_RETRY_DELAY = int(os.getenv("OUTBOX_RETRY_DELAY", "30"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+# Background jobs: retry backoff base (seconds, doubling per attempt), seconds after which a running
+# job is assumed lost, and days finished jobs are kept for metrics
+JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", "10"))
+JOB_TIMEOUT = int(os.getenv("JOB_TIMEOUT", "600"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+# Periodic tasks: seconds the scheduling process holds its lease between renewals, and seconds after
+# which a started run that never reported back stops blocking its task
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "60"))
+SCHEDULER_RUN_TIMEOUT = int(os.getenv("SCHEDULER_RUN_TIMEOUT", "3600"))
+# Read notifications older than this are purged
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+
+# Days an idempotency key and its stored result are kept for replaying resubmitted forms
+IDEMPOTENCY_KEY_DAYS = int(os.getenv("IDEMPOTENCY_KEY_DAYS", "7"))
+
+# Payment gateway adapter per payment method (or "default"). Without PAYMENT_GATEWAY_URL payments are
+# simulated in process; with it they are sent to an HTTP gateway such as run_gateway_simulator.
+PAYMENT_GATEWAYS = {
+    "default": {"BACKEND": "store.gateways.LocalGateway"},
+}
+if os.getenv("PAYMENT_GATEWAY_URL"):
+    PAYMENT_GATEWAYS["default"] = {
+        "BACKEND": "store.gateways.HTTPGateway",
+        "OPTIONS": {
+            "url": os.getenv("PAYMENT_GATEWAY_URL"),
+            "timeout": float(os.getenv("PAYMENT_GATEWAY_TIMEOUT", "10")),
+        },
+    }
+# Authorizations in flight per worker, and requests without a decision before a payment fails
+PAYMENT_GATEWAY_CONCURRENCY = int(os.getenv("PAYMENT_GATEWAY_CONCURRENCY", "20"))
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "5"))
+# Webhook signing secret per gateway (stripe, paypal, bank_transfer), from "name:secret,name:secret";
+# a gateway posts its events to /webhooks/payments/<name>/ signed no more than PAYMENT_WEBHOOK_TOLERANCE
+# seconds earlier, and they only apply to that gateway's payments
+PAYMENT_WEBHOOK_SECRETS = dict(
+    entry.split(":", 1) for entry in os.getenv("PAYMENT_WEBHOOK_SECRETS", "").split(",") if ":" in entry
+)
+PAYMENT_WEBHOOK_TOLERANCE = int(os.getenv("PAYMENT_WEBHOOK_TOLERANCE", "300"))
+
 # Authentication
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
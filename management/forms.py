@@ -1,12 +1,38 @@
 from django import forms
+from django.db import transaction
+from django.urls import reverse
+from store.images import schedule_derivatives
 from store.models import Product, Order, FarmTool, Staff, Inventory
 
+# Select that only renders the current value and loads further options from the autocomplete endpoint
+class LazySelect(forms.Select):
+    def __init__(self, source, attrs=None):
+        self.source = source
+        super().__init__(attrs)
+
+    class Media:
+        js = ['management/js/autocomplete.js']
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = reverse('management:autocomplete', args=[self.source])
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [v for v in value if v not in ('', None)]
+        groups = [(None, [self.create_option(name, '', '---------', not selected, 0)], 0)]
+        if selected:
+            for index, obj in enumerate(self.choices.queryset.filter(pk__in=selected), start=1):
+                option = self.create_option(name, obj.pk, self.choices.field.label_from_instance(obj), True, index)
+                groups.append((None, [option], index))
+        return groups
+
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
         fields = ['category', 'name', 'description', 'price', 'stock', 'image', 'weight', 'is_active']
         widgets = {
-            'category': forms.Select(attrs={'class': 'form-control'}),
+            'category': LazySelect('category', attrs={'class': 'form-control'}),
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Product Name'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 4}),
             'price': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
@@ -26,6 +52,12 @@ class ProductForm(forms.ModelForm):
             raise forms.ValidationError("Stock cannot be negative.")
         return cleaned_data
 
+    def save(self, commit=True):
+        product = super().save(commit)
+        if commit and 'image' in self.changed_data:
+            transaction.on_commit(lambda: schedule_derivatives(product.image))
+        return product
+
 class OrderForm(forms.ModelForm):
     class Meta:
         model = Order
@@ -47,7 +79,7 @@ class FarmToolForm(forms.ModelForm):
             'tool_type': forms.Select(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 4}),
             'serial_number': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Serial Number'}),
-            'location': forms.Select(attrs={'class': 'form-control'}),
+            'location': LazySelect('location', attrs={'class': 'form-control'}),
             'purchase_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'cost': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'is_operational': forms.CheckboxInput(attrs={'class': 'form-checkbox'}),
@@ -64,7 +96,7 @@ class StaffForm(forms.ModelForm):
         model = Staff
         fields = ['user', 'date_of_birth', 'state', 'country', 'address', 'phone', 'certification', 'hire_date', 'job_title', 'location', 'is_active']
         widgets = {
-            'user': forms.Select(attrs={'class': 'form-control'}),
+            'user': LazySelect('user', attrs={'class': 'form-control'}),
             'date_of_birth': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'state': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'State'}),
             'country': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Country'}),
@@ -73,7 +105,7 @@ class StaffForm(forms.ModelForm):
             'certification': forms.Textarea(attrs={'class': 'form-control', 'rows': 4}),
             'hire_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'job_title': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Job Title'}),
-            'location': forms.Select(attrs={'class': 'form-control'}),
+            'location': LazySelect('location', attrs={'class': 'form-control'}),
             'is_active': forms.CheckboxInput(attrs={'class': 'form-checkbox'}),
         }
 
@@ -82,13 +114,19 @@ class InventoryForm(forms.ModelForm):
         model = Inventory
         fields = ['product', 'farm_tool', 'location', 'quantity', 'unit']
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control'}),
-            'farm_tool': forms.Select(attrs={'class': 'form-control'}),
-            'location': forms.Select(attrs={'class': 'form-control'}),
+            'product': LazySelect('product', attrs={'class': 'form-control'}),
+            'farm_tool': LazySelect('farm_tool', attrs={'class': 'form-control'}),
+            'location': LazySelect('location', attrs={'class': 'form-control'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control'}),
             'unit': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Unit (e.g., kg, units)'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Exactly one of the two is chosen, which clean() enforces
+        self.fields['product'].required = False
+        self.fields['farm_tool'].required = False
+
     def clean(self):
         cleaned_data = super().clean()
         product = cleaned_data.get('product')
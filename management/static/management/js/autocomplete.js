@@ -0,0 +1,31 @@
+// Lazy-loading selects: fetch matching options from the autocomplete endpoint as the user types
+document.querySelectorAll('select[data-autocomplete-url]').forEach((select) => {
+    const search = document.createElement('input');
+    search.type = 'search';
+    search.placeholder = 'Type to search...';
+    search.className = select.className;
+    select.parentNode.insertBefore(search, select);
+
+    let timer = null;
+    search.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(() => {
+            const url = `${select.dataset.autocompleteUrl}?term=${encodeURIComponent(search.value)}`;
+            fetch(url, { headers: { 'Accept': 'application/json' } })
+                .then((response) => response.json())
+                .then((data) => {
+                    const current = select.value;
+                    select.querySelectorAll('option').forEach((option) => {
+                        if (option.value && option.value !== current) {
+                            option.remove();
+                        }
+                    });
+                    data.results.forEach((result) => {
+                        if (String(result.id) !== current) {
+                            select.add(new Option(result.text, result.id));
+                        }
+                    });
+                });
+        }, 250);
+    });
+});
@@ -2,7 +2,8 @@ from django.urls import path
 from .views import (
     StaffDashboardView, ProductCreateView, ProductUpdateView,
     OrderUpdateView, FarmToolCreateView, FarmToolUpdateView,
-    StaffCreateView, StaffUpdateView, InventoryCreateView, InventoryUpdateView
+    StaffCreateView, StaffUpdateView, InventoryCreateView, InventoryUpdateView,
+    AutocompleteView
 )
 
 app_name = 'management'
@@ -18,4 +19,5 @@ urlpatterns = [
     path('staff/<int:pk>/edit/', StaffUpdateView.as_view(), name='staff_edit'),
     path('inventory/add/', InventoryCreateView.as_view(), name='inventory_add'),
     path('inventory/<int:pk>/edit/', InventoryUpdateView.as_view(), name='inventory_edit'),
+    path('autocomplete/<str:source>/', AutocompleteView.as_view(), name='autocomplete'),
 ]
\ No newline at end of file
@@ -1,10 +1,19 @@
-from django.views.generic import TemplateView, CreateView, UpdateView
+from django.views.generic import TemplateView, CreateView, UpdateView, View
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib import messages
+from django.core.cache import cache
+from django.http import JsonResponse, Http404
+from django.db import IntegrityError, transaction
 from django.urls import reverse_lazy
-from store.models import Product, Order, FarmTool, Staff, Inventory, User
+from store.alerts import refresh_stock_alerts
+from store.ledger import adjust_inventory, adjust_product_stock, record_movements
+from store.models import (
+    Product, Order, FarmTool, Staff, Inventory, User, Category, BusinessLocation, StockMovement, StockAlert,
+    ReplenishmentSuggestion,
+)
 from .forms import ProductForm, OrderForm, FarmToolForm, StaffForm, InventoryForm
-from django.db.models import Count, Sum, F
+from django.db.models import Count, Sum, F, Q
+import hashlib
 
 class StaffDashboardView(UserPassesTestMixin, TemplateView):
     template_name = 'management/staff_dashboard.html'
@@ -19,12 +28,15 @@ class StaffDashboardView(UserPassesTestMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['total_products'] = Product.objects.filter(is_active=True).count()
-        context['low_stock_products'] = Product.objects.filter(is_active=True, stock__lte=10).count()
+        # Low stock comes from the precomputed alert set, kept current by every stock write
+        context['low_stock_products'] = StockAlert.objects.count()
         context['total_orders'] = Order.objects.count()
         context['pending_orders'] = Order.objects.filter(status='pending').count()
         context['total_staff'] = Staff.objects.filter(is_active=True).count()
         context['recent_orders'] = Order.objects.select_related('user').order_by('-ordered_at')[:5]
-        context['low_stock_list'] = Product.objects.filter(is_active=True, stock__lte=10).select_related('category')[:5]
+        context['low_stock_list'] = StockAlert.objects.select_related('product__category').order_by('stock', 'product_id')[:5]
+        context['replenishment_list'] = (ReplenishmentSuggestion.objects.select_related('product', 'location')
+                                         .order_by('reorder_date', '-quantity')[:10])
         context['top_customers'] = User.objects.filter(customer_profile__isnull=False).annotate(
             order_count=Count('orders'),
             total_spent=Sum(F('orders__total_price'))
@@ -43,8 +55,13 @@ class ProductCreateView(UserPassesTestMixin, CreateView):
         return self.request.user.is_staff
 
     def form_valid(self, form):
+        with transaction.atomic():
+            response = super().form_valid(form)
+            record_movements([StockMovement(product=self.object, kind='restock', quantity=self.object.stock,
+                                            created_by=self.request.user, reference='product created')])
+            refresh_stock_alerts([self.object.pk])
         messages.success(self.request, f"Product '{form.instance.name}' created successfully.")
-        return super().form_valid(form)
+        return response
 
 class ProductUpdateView(UserPassesTestMixin, UpdateView):
     model = Product
@@ -56,8 +73,13 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
         return self.request.user.is_staff
 
     def form_valid(self, form):
+        # The stock field is a stock count: the ledger records its difference from the live total
+        with transaction.atomic():
+            adjust_product_stock(form.instance, form.cleaned_data['stock'], user=self.request.user, reference='product edited')
+            response = super().form_valid(form)
+            refresh_stock_alerts([self.object.pk])
         messages.success(self.request, f"Product '{form.instance.name}' updated successfully.")
-        return super().form_valid(form)
+        return response
 
 class OrderUpdateView(UserPassesTestMixin, UpdateView):
     model = Order
@@ -135,8 +157,11 @@ class InventoryCreateView(UserPassesTestMixin, CreateView):
 
     def form_valid(self, form):
         item = form.instance.product or form.instance.farm_tool
+        with transaction.atomic():
+            response = super().form_valid(form)
+            adjust_inventory(None, self.object, user=self.request.user, reference=f'inventory #{self.object.pk}')
         messages.success(self.request, f"Inventory for '{item}' created successfully.")
-        return super().form_valid(form)
+        return response
 
 class InventoryUpdateView(UserPassesTestMixin, UpdateView):
     model = Inventory
@@ -149,5 +174,54 @@ class InventoryUpdateView(UserPassesTestMixin, UpdateView):
 
     def form_valid(self, form):
         item = form.instance.product or form.instance.farm_tool
+        try:
+            with transaction.atomic():
+                previous = Inventory.objects.select_for_update().filter(pk=self.object.pk).values_list(
+                    'product_id', 'location_id', 'quantity').get()
+                response = super().form_valid(form)
+                adjust_inventory(previous, self.object, user=self.request.user, reference=f'inventory #{self.object.pk}')
+        except IntegrityError:
+            # Lowering a location's quantity below what the product's total allows
+            form.add_error('quantity', "This change would make the product's total stock negative.")
+            return self.form_invalid(form)
         messages.success(self.request, f"Inventory for '{item}' updated successfully.")
-        return super().form_valid(form)
\ No newline at end of file
+        return response
+
+# Prefix-search JSON endpoint backing the lazy-loading selects in the management forms
+class AutocompleteView(UserPassesTestMixin, View):
+    # source -> (model, indexed field searched by prefix)
+    sources = {
+        'user': (User, 'username'),
+        'product': (Product, 'name'),
+        'farm_tool': (FarmTool, 'name'),
+        'location': (BusinessLocation, 'name'),
+        'category': (Category, 'name'),
+    }
+    limit = 10
+    cache_timeout = 60
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, source):
+        if source not in self.sources:
+            raise Http404("Unknown autocomplete source.")
+        term = request.GET.get('term', '').strip()[:100]
+        key = f"autocomplete:{source}:{hashlib.md5(term.encode()).hexdigest()}"
+        results = cache.get(key)
+        if results is None:
+            results = self.search(source, term)
+            cache.set(key, results, self.cache_timeout)
+        return JsonResponse({'results': results})
+
+    def search(self, source, term):
+        model, field = self.sources[source]
+        queryset = model.objects.order_by(field)
+        if term:
+            # Range lookups keep the prefix match on the b-tree index for both SQLite and PostgreSQL
+            prefixes = {term, term[:1].upper() + term[1:]}
+            condition = Q()
+            for prefix in prefixes:
+                condition |= Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\uffff'})
+            queryset = queryset.filter(condition)
+        return [{'id': obj.pk, 'text': str(obj)} for obj in queryset[:self.limit]]
@@ -0,0 +1,11 @@
+#!/bin/sh
+# Web service entry point: the job workers and gunicorn run in the same instance, so the workers
+# see the web processes' MEDIA_ROOT and file-based cache (see Deployment in README.md).
+(
+    while true; do
+        python manage.py run_workers --threads 2
+        echo "run_workers exited with status $?; restarting in 5s" >&2
+        sleep 5
+    done
+) &
+exec gunicorn --workers 3 --timeout 120 agric_website.wsgi:application
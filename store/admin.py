@@ -1,305 +1,482 @@
 from django.contrib import admin
-from django.contrib.contenttypes.admin import GenericTabularInline
+from django.contrib.admin.utils import unquote
+from django.contrib.auth import get_permission_codename
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections, transaction
 from django.http import HttpResponse
-import csv
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
+from .alerts import refresh_stock_alerts
+from .exports import write_csv, write_pdf
+from .images import schedule_derivatives
+from .jobs import enqueue
 from .models import (
     Category, Product, FarmingProduct, Farm, BusinessLocation, UserProfile, Customer,
     Order, OrderItem, DeliveryTracking, SalesRecord, AnnualProduction, ProfitLoss,
     PaymentTransaction, Review, Tax, Discount, Notification, AuditLog, FarmTool,
     ToolMaintenance, Management, Staff, StaffSalary, StaffPerformance, StaffPromotion,
-    RelationshipRecord, Supplier, Inventory, Contract, Expense, Report, ReportExport
+    RelationshipRecord, Supplier, Inventory, Contract, Expense, Report, ReportExport, StockHold,
+    OrderAllocation, StockMovement, StockSnapshot, StockAlert, ReplenishmentSuggestion,
+    OutboxEvent, Job, WebhookEvent
 )
 
-# Generic Inline for ReportExport
-class ReportExportInline(GenericTabularInline):
-    model = ReportExport
-    extra = 1
-    fields = ['title', 'export_format', 'status', 'file', 'created_at']
-    readonly_fields = ['created_at', 'file']
+# Export history for any admin object, rendered as a collapsed panel and fetched only when opened
+class ReportExportHistoryMixin:
+    change_form_template = 'admin/store/report_export_change_form.html'
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path('<path:object_id>/exports/', self.admin_site.admin_view(self.report_exports_view),
+                 name='%s_%s_report_exports' % info),
+        ] + super().get_urls()
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        extra_context = {**(extra_context or {}), 'show_report_exports': self.has_export_view_permission(request)}
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def report_exports_view(self, request, object_id):
+        # The history lists exports and links their files, so it needs view access to both models
+        if not self.has_view_permission(request) or not self.has_export_view_permission(request):
+            raise PermissionDenied
+        object_id = unquote(object_id)
+        # get_for_model is served from the ContentType manager's per-process cache
+        content_type = ContentType.objects.get_for_model(self.model)
+        exports = ReportExport.objects.filter(
+            content_type=content_type, object_id=object_id
+        ).select_related('user').order_by('status', '-created_at')
+        add_url = reverse('admin:store_reportexport_add') + '?' + urlencode({
+            'content_type': content_type.pk, 'object_id': object_id,
+        })
+        return TemplateResponse(request, 'admin/store/report_export_history.html', {
+            'exports': exports,
+            'add_url': add_url,
+        })
+
+    def has_export_view_permission(self, request):
+        opts = ReportExport._meta
+        return any(
+            request.user.has_perm(f"{opts.app_label}.{get_permission_codename(action, opts)}")
+            for action in ('view', 'change')
+        )
 
 # Export action mixin for CSV/PDF
 class ExportReportMixin:
     def export_as_csv(self, request, queryset):
         meta = self.model._meta
-        field_names = [field.name for field in meta.fields]
         response = HttpResponse(content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename={meta}.csv'
-        writer = csv.writer(response)
-        writer.writerow(field_names)
-        for obj in queryset:
-            writer.writerow([getattr(obj, field) for field in field_names])
+        write_csv(self.model, queryset, response)
         return response
 
     def export_as_pdf(self, request, queryset):
         meta = self.model._meta
-        field_names = [field.name for field in meta.fields]
         response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename={meta}.pdf'
-        p = canvas.Canvas(response, pagesize=letter)
-        y = 750
-        p.drawString(100, y, f"{meta.verbose_name_plural} Report")
-        y -= 30
-        p.drawString(100, y, ", ".join(field_names))
-        y -= 20
-        for obj in queryset:
-            row = ", ".join([str(getattr(obj, field)) for field in field_names])
-            p.drawString(100, y, row)
-            y -= 20
-            if y < 50:
-                p.showPage()
-                y = 750
-        p.showPage()
-        p.save()
+        write_pdf(self.model, queryset, response)
         return response
 
     export_as_csv.short_description = "Export selected as CSV"
     export_as_pdf.short_description = "Export selected as PDF"
 
+# Paginator that trusts the planner's row estimate for unfiltered changelists on large tables
+class EstimatedCountPaginator(Paginator):
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimated_count(queryset)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return super().count
+
+    def estimated_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row and row[0] >= 0 else None
+
+# Changelist performance for large tables: estimated counts and autocomplete widgets for every
+# foreign key whose target admin is searchable. Each admin lists in list_select_related the
+# relations its columns render, including those their __str__ follows (e.g. staff__user).
+class ChangelistPerformanceMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_autocomplete_fields(self, request):
+        if self.autocomplete_fields:
+            return self.autocomplete_fields
+        fields = []
+        for field in self.model._meta.get_fields():
+            if not field.concrete or not (field.many_to_one or field.one_to_one):
+                continue
+            if (self.admin_site.is_registered(field.related_model)
+                    and self.admin_site.get_model_admin(field.related_model).search_fields):
+                fields.append(field.name)
+        return fields
+
+# Base admin for record-tracking models: changelist performance plus lazy export history
+class StoreModelAdmin(ReportExportHistoryMixin, ChangelistPerformanceMixin, admin.ModelAdmin):
+    pass
+
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(ChangelistPerformanceMixin, admin.ModelAdmin):
     list_display = ['name', 'slug', 'created_at']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'stock', 'is_active', 'created_at']
+class ProductAdmin(StoreModelAdmin):
+    list_display = ['name', 'category', 'price', 'stock', 'reorder_point', 'is_active', 'created_at']
+    list_select_related = ['category']
     list_filter = ['category', 'is_active']
     search_fields = ['name', 'description']
-    inlines = [ReportExportInline]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if {'stock', 'reorder_point', 'is_active'} & set(form.changed_data):
+            refresh_stock_alerts([obj.pk])
+        if 'image' in form.changed_data:
+            transaction.on_commit(lambda: schedule_derivatives(obj.image))
 
 @admin.register(FarmingProduct)
-class FarmingProductAdmin(admin.ModelAdmin):
+class FarmingProductAdmin(StoreModelAdmin):
     list_display = ['product', 'crop_type', 'farm', 'organic', 'created_at']
+    list_select_related = ['product', 'farm']
     list_filter = ['organic', 'farm']
     search_fields = ['product__name', 'crop_type']
-    inlines = [ReportExportInline]
 
 @admin.register(Farm)
-class FarmAdmin(admin.ModelAdmin):
+class FarmAdmin(StoreModelAdmin):
     list_display = ['name', 'location', 'farm_type', 'size_hectares', 'is_active']
+    list_select_related = ['location']
     list_filter = ['farm_type', 'is_active']
     search_fields = ['name', 'location__name']
-    inlines = [ReportExportInline]
 
 @admin.register(BusinessLocation)
-class BusinessLocationAdmin(admin.ModelAdmin):
+class BusinessLocationAdmin(StoreModelAdmin):
     list_display = ['name', 'city', 'country', 'is_active']
     list_filter = ['country', 'is_active']
     search_fields = ['name', 'city', 'country']
-    inlines = [ReportExportInline]
 
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(StoreModelAdmin):
     list_display = ['user', 'phone', 'city', 'country', 'is_verified']
+    list_select_related = ['user']
     list_filter = ['is_verified', 'country']
     search_fields = ['user__username', 'phone', 'address']
-    inlines = [ReportExportInline]
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(StoreModelAdmin):
     list_display = ['user', 'loyalty_points', 'last_purchase']
+    list_select_related = ['user']
     search_fields = ['user__username', 'preferred_payment_method']
-    inlines = [ReportExportInline]
 
 @admin.register(Order)
-class OrderAdmin(ExportReportMixin, admin.ModelAdmin):
+class OrderAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['id', 'user', 'total_price', 'status', 'ordered_at']
+    list_select_related = ['user']
     list_filter = ['status', 'ordered_at']
     search_fields = ['user__username', 'shipping_address']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
+
+@admin.register(OrderAllocation)
+class OrderAllocationAdmin(StoreModelAdmin):
+    list_display = ['order', 'order_item', 'location', 'quantity', 'created_at']
+    list_select_related = ['order__user', 'order_item__product', 'order_item__order', 'location']
+    list_filter = ['location']
+    search_fields = ['order__id', 'order_item__product__name']
 
 @admin.register(OrderItem)
-class OrderItemAdmin(ExportReportMixin, admin.ModelAdmin):
+class OrderItemAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['order', 'product', 'quantity', 'subtotal']
+    list_select_related = ['order__user', 'product']
     search_fields = ['product__name']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(DeliveryTracking)
-class DeliveryTrackingAdmin(ExportReportMixin, admin.ModelAdmin):
-    list_display = ['order', 'tracking_number', 'status', 'last_updated']
+class DeliveryTrackingAdmin(ExportReportMixin, StoreModelAdmin):
+    list_display = ['order', 'tracking_number', 'carrier', 'status', 'status_at', 'estimated_delivery', 'last_updated']
+    list_select_related = ['order__user']
     list_filter = ['status']
     search_fields = ['tracking_number', 'carrier']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(SalesRecord)
-class SalesRecordAdmin(ExportReportMixin, admin.ModelAdmin):
+class SalesRecordAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['product', 'quantity_sold', 'sale_price', 'sale_date']
+    list_select_related = ['product']
     list_filter = ['sale_date', 'location']
     search_fields = ['product__name']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(AnnualProduction)
-class AnnualProductionAdmin(ExportReportMixin, admin.ModelAdmin):
+class AnnualProductionAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['farm', 'product', 'year', 'quantity_produced', 'unit', 'revenue']
+    list_select_related = ['farm', 'product__product']
     list_filter = ['year', 'farm']
     search_fields = ['product__product__name']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(ProfitLoss)
-class ProfitLossAdmin(ExportReportMixin, admin.ModelAdmin):
+class ProfitLossAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['product', 'order', 'revenue', 'cost', 'profit', 'period_start']
+    list_select_related = ['product', 'order__user']
     list_filter = ['period_start', 'period_end']
     search_fields = ['product__name']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(PaymentTransaction)
-class PaymentTransactionAdmin(ExportReportMixin, admin.ModelAdmin):
-    list_display = ['transaction_id', 'order', 'amount', 'status', 'gateway', 'created_at']
+class PaymentTransactionAdmin(ExportReportMixin, StoreModelAdmin):
+    list_display = ['transaction_id', 'order', 'amount', 'status', 'gateway', 'attempts', 'created_at']
+    list_select_related = ['order__user']
     list_filter = ['status', 'gateway']
-    search_fields = ['transaction_id', 'order__id']
+    search_fields = ['transaction_id', 'gateway_reference', 'order__id']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(Review)
-class ReviewAdmin(ExportReportMixin, admin.ModelAdmin):
+class ReviewAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['product', 'user', 'rating', 'is_approved', 'created_at']
+    list_select_related = ['product', 'user']
     list_filter = ['is_approved', 'rating']
     search_fields = ['product__name', 'user__username']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(Tax)
-class TaxAdmin(admin.ModelAdmin):
+class TaxAdmin(StoreModelAdmin):
     list_display = ['name', 'country', 'rate', 'is_active']
     list_filter = ['country', 'is_active']
     search_fields = ['name', 'country']
-    inlines = [ReportExportInline]
 
 @admin.register(Discount)
-class DiscountAdmin(admin.ModelAdmin):
+class DiscountAdmin(StoreModelAdmin):
     list_display = ['code', 'discount_type', 'value', 'is_active', 'start_date', 'end_date']
     list_filter = ['is_active', 'discount_type']
     search_fields = ['code', 'description']
-    inlines = [ReportExportInline]
 
 @admin.register(Notification)
-class NotificationAdmin(ExportReportMixin, admin.ModelAdmin):
+class NotificationAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['user', 'type', 'is_read', 'created_at']
+    list_select_related = ['user']
     list_filter = ['type', 'is_read']
     search_fields = ['user__username', 'message']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(AuditLog)
-class AuditLogAdmin(ExportReportMixin, admin.ModelAdmin):
+class AuditLogAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['action', 'user', 'model_name', 'object_id', 'timestamp']
+    list_select_related = ['user']
     list_filter = ['model_name', 'timestamp']
     search_fields = ['action', 'user__username', 'details']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(FarmTool)
-class FarmToolAdmin(admin.ModelAdmin):
+class FarmToolAdmin(StoreModelAdmin):
     list_display = ['name', 'tool_type', 'location', 'is_operational', 'created_at']
+    list_select_related = ['location']
     list_filter = ['tool_type', 'is_operational']
     search_fields = ['name', 'serial_number']
-    inlines = [ReportExportInline]
 
 @admin.register(ToolMaintenance)
-class ToolMaintenanceAdmin(ExportReportMixin, admin.ModelAdmin):
+class ToolMaintenanceAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['farm_tool', 'maintenance_date', 'cost', 'performed_by']
+    list_select_related = ['farm_tool']
     list_filter = ['maintenance_date']
     search_fields = ['farm_tool__name', 'description']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(Management)
-class ManagementAdmin(admin.ModelAdmin):
+class ManagementAdmin(StoreModelAdmin):
     list_display = ['user', 'role', 'department', 'location', 'is_active']
+    list_select_related = ['user', 'location']
     list_filter = ['role', 'is_active']
     search_fields = ['user__username', 'department']
-    inlines = [ReportExportInline]
 
 @admin.register(Staff)
-class StaffAdmin(admin.ModelAdmin):
+class StaffAdmin(StoreModelAdmin):
     list_display = ['user', 'job_title', 'location', 'hire_date', 'is_active']
+    list_select_related = ['user', 'location']
     list_filter = ['is_active', 'location']
     search_fields = ['user__username', 'job_title']
-    inlines = [ReportExportInline]
 
 @admin.register(StaffSalary)
-class StaffSalaryAdmin(ExportReportMixin, admin.ModelAdmin):
+class StaffSalaryAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['staff', 'base_salary', 'net_salary', 'payment_date', 'status']
+    list_select_related = ['staff__user']
     list_filter = ['status', 'payment_frequency']
     search_fields = ['staff__user__username']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(StaffPerformance)
-class StaffPerformanceAdmin(ExportReportMixin, admin.ModelAdmin):
+class StaffPerformanceAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['staff', 'performance_score', 'evaluation_date', 'evaluated_by']
+    list_select_related = ['staff__user', 'evaluated_by']
     list_filter = ['evaluation_date']
     search_fields = ['staff__user__username', 'metrics']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(StaffPromotion)
-class StaffPromotionAdmin(ExportReportMixin, admin.ModelAdmin):
+class StaffPromotionAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['staff', 'new_role', 'promotion_date', 'approved_by']
+    list_select_related = ['staff__user', 'approved_by']
     list_filter = ['promotion_date']
     search_fields = ['staff__user__username', 'new_role']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(RelationshipRecord)
-class RelationshipRecordAdmin(ExportReportMixin, admin.ModelAdmin):
+class RelationshipRecordAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['relationship_type', 'primary_entity', 'secondary_entity', 'start_date']
     list_filter = ['relationship_type']
     search_fields = ['primary_entity', 'secondary_entity']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(Supplier)
-class SupplierAdmin(admin.ModelAdmin):
+class SupplierAdmin(StoreModelAdmin):
     list_display = ['name', 'contact_person', 'phone', 'is_active']
     list_filter = ['is_active']
     search_fields = ['name', 'contact_person', 'email']
-    inlines = [ReportExportInline]
 
 @admin.register(Inventory)
-class InventoryAdmin(ExportReportMixin, admin.ModelAdmin):
+class InventoryAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['product', 'farm_tool', 'location', 'quantity', 'unit']
+    list_select_related = ['product', 'farm_tool', 'location']
     list_filter = ['location']
     search_fields = ['product__name', 'farm_tool__name']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
+
+@admin.register(StockHold)
+class StockHoldAdmin(StoreModelAdmin):
+    list_display = ['product', 'user', 'quantity', 'expires_at']
+    list_select_related = ['product', 'user']
+    search_fields = ['product__name', 'user__username']
+    date_hierarchy = 'expires_at'
+
+@admin.register(StockMovement)
+class StockMovementAdmin(StoreModelAdmin):
+    list_display = ['created_at', 'product', 'location', 'kind', 'quantity', 'order', 'created_by']
+    list_select_related = ['product', 'location', 'order__user', 'created_by']
+    list_filter = ['kind', 'location']
+    search_fields = ['product__name', 'reference']
+    date_hierarchy = 'created_at'
+
+    # The ledger is append-only; corrections are recorded as new adjustment rows
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(StoreModelAdmin):
+    list_display = ['product', 'location', 'on_hand', 'last_movement_id', 'taken_at']
+    list_select_related = ['product', 'location']
+    list_filter = ['location']
+    search_fields = ['product__name']
+
+@admin.register(StockAlert)
+class StockAlertAdmin(StoreModelAdmin):
+    list_display = ['product', 'stock', 'reorder_point', 'raised_at', 'notified_at']
+    list_select_related = ['product']
+    search_fields = ['product__name']
+
+@admin.register(ReplenishmentSuggestion)
+class ReplenishmentSuggestionAdmin(StoreModelAdmin):
+    list_display = ['product', 'location', 'daily_demand', 'on_hand', 'quantity', 'reorder_date', 'computed_at']
+    list_select_related = ['product', 'location']
+    list_filter = ['location']
+    search_fields = ['product__name']
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(StoreModelAdmin):
+    list_display = ['id', 'topic', 'attempts', 'available_at', 'created_at', 'processed_at']
+    list_filter = ['topic', 'processed_at']
+    search_fields = ['last_error']
+    readonly_fields = ['topic', 'payload', 'attempts', 'last_error', 'available_at', 'created_at', 'processed_at']
+    actions = ['retry_events']
+
+    def retry_events(self, request, queryset):
+        updated = queryset.filter(processed_at__isnull=True).update(attempts=0, available_at=timezone.now())
+        self.message_user(request, f"{updated} event(s) queued for retry.")
+
+    retry_events.short_description = "Retry selected events now"
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(StoreModelAdmin):
+    list_display = ['event_id', 'gateway', 'event_type', 'transaction_id', 'occurred_at', 'received_at', 'outcome']
+    list_filter = ['gateway', 'event_type', 'outcome']
+    search_fields = ['event_id', 'transaction_id']
+    readonly_fields = ['gateway', 'event_id', 'event_type', 'transaction_id', 'occurred_at', 'payload', 'received_at', 'processed_at', 'outcome']
+    actions = ['reprocess_events']
+
+    def reprocess_events(self, request, queryset):
+        # Applying an event again is harmless: it only takes effect if it still moves its payment forward
+        updated = queryset.update(processed_at=None, outcome='')
+        enqueue('payments.webhooks', unique=True)
+        self.message_user(request, f"{updated} event(s) queued for processing.")
+
+    reprocess_events.short_description = "Process selected events again"
+
+@admin.register(Job)
+class JobAdmin(StoreModelAdmin):
+    list_display = ['id', 'name', 'status', 'priority', 'attempts', 'run_at', 'started_at', 'finished_at', 'claimed_by']
+    list_filter = ['status', 'name']
+    search_fields = ['name', 'last_error']
+    readonly_fields = ['name', 'kwargs', 'attempts', 'claimed_by', 'last_error', 'created_at', 'started_at', 'finished_at']
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        updated = queryset.filter(status='failed').update(status='queued', attempts=0, run_at=timezone.now(), finished_at=None)
+        self.message_user(request, f"{updated} job(s) queued for retry.")
+
+    retry_jobs.short_description = "Retry selected failed jobs now"
 
 @admin.register(Contract)
-class ContractAdmin(ExportReportMixin, admin.ModelAdmin):
+class ContractAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['title', 'contract_type', 'start_date', 'is_active']
     list_filter = ['contract_type', 'is_active']
     search_fields = ['title', 'description']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(Expense)
-class ExpenseAdmin(ExportReportMixin, admin.ModelAdmin):
+class ExpenseAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['description', 'expense_type', 'amount', 'date_incurred']
     list_filter = ['expense_type', 'date_incurred']
     search_fields = ['description']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(Report)
-class ReportAdmin(ExportReportMixin, admin.ModelAdmin):
+class ReportAdmin(ExportReportMixin, StoreModelAdmin):
     list_display = ['title', 'report_type', 'generated_at', 'generated_by']
+    list_select_related = ['generated_by']
     list_filter = ['report_type', 'generated_at']
     search_fields = ['title']
     actions = ['export_as_csv', 'export_as_pdf']
-    inlines = [ReportExportInline]
 
 @admin.register(ReportExport)
-class ReportExportAdmin(admin.ModelAdmin):
+class ReportExportAdmin(ChangelistPerformanceMixin, admin.ModelAdmin):
     list_display = ['title', 'export_format', 'status', 'created_at', 'user']
+    list_select_related = ['user']
     list_filter = ['export_format', 'status']
     search_fields = ['title', 'user__username']
     readonly_fields = ['file', 'created_at', 'updated_at']
+
+    def save_model(self, request, obj, form, change):
+        if not change and obj.user_id is None:
+            obj.user = request.user
+        super().save_model(request, obj, form, change)
+        # The file is rendered by a worker; the export stays pending until it is ready
+        if obj.status == 'pending':
+            enqueue('reports.export', export_id=obj.pk)
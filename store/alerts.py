@@ -0,0 +1,93 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+from .caching import bump_user_version
+from .models import Inventory, Management, Notification, Product, StockAlert, StockMovement
+
+# Low-stock alerting. StockAlert holds one row per active product at or below its reorder point and
+# is refreshed by every code path that changes stock; a newly raised alert is a threshold-crossing
+# event. notify_stock_alerts later batches pending events into one Notification per manager,
+# addressed to managers at the locations that stock the product and to company-wide managers.
+
+def refresh_stock_alerts(product_ids=None):
+    # Raises, updates and clears alerts for product_ids (all products if None, which is read
+    # through the partial low-stock index); returns the newly raised alerts
+    products = Product.objects.filter(is_active=True, stock__lte=F('reorder_point'))
+    alerts = StockAlert.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        alerts = alerts.filter(product_id__in=product_ids)
+    low = {pk: (stock, point) for pk, stock, point in products.values_list('pk', 'stock', 'reorder_point')}
+    existing = {alert.product_id: alert for alert in alerts}
+
+    StockAlert.objects.filter(product_id__in=[pk for pk in existing if pk not in low]).delete()
+    changed = []
+    for pk, alert in existing.items():
+        if pk in low and (alert.stock, alert.reorder_point) != low[pk]:
+            alert.stock, alert.reorder_point = low[pk]
+            changed.append(alert)
+    StockAlert.objects.bulk_update(changed, ['stock', 'reorder_point'])
+    # A concurrent writer may raise the same alert first; the one-to-one key keeps a single row
+    return StockAlert.objects.bulk_create([
+        StockAlert(product_id=pk, stock=stock, reorder_point=point)
+        for pk, (stock, point) in low.items() if pk not in existing
+    ], ignore_conflicts=True)
+
+def recompute_reorder_points(batch_size=500):
+    # Reorder point = units sold per day over the window x (lead time + safety days), with a floor.
+    # Returns the number of products whose point changed.
+    window = settings.REORDER_WINDOW_DAYS
+    cover_days = settings.REORDER_LEAD_TIME_DAYS + settings.REORDER_SAFETY_DAYS
+    since = timezone.now() - timedelta(days=window)
+    sales = (StockMovement.objects.filter(kind='sale', created_at__gte=since)
+             .values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units'))
+    sold = {product_id: -units for product_id, units in sales}
+
+    changed = []
+    for product in Product.objects.only('pk', 'reorder_point').iterator(chunk_size=batch_size):
+        point = max(math.ceil(sold.get(product.pk, 0) / window * cover_days), settings.REORDER_MIN_POINT)
+        if point != product.reorder_point:
+            product.reorder_point = point
+            changed.append(product)
+    Product.objects.bulk_update(changed, ['reorder_point'], batch_size=batch_size)
+    refresh_stock_alerts()
+    return len(changed)
+
+def notify_stock_alerts(batch_size=500):
+    # Turns pending alerts into Notification rows; returns the number of alerts sent
+    sent = 0
+    while True:
+        pending = list(StockAlert.objects.filter(notified_at__isnull=True).select_related('product')
+                       .order_by('raised_at')[:batch_size])
+        if not pending:
+            return sent
+        stocked_at = defaultdict(set)
+        inventory = Inventory.objects.filter(product_id__in=[alert.product_id for alert in pending], location__isnull=False)
+        for product_id, location_id in inventory.values_list('product_id', 'location_id').distinct():
+            stocked_at[product_id].add(location_id)
+        managers_at = defaultdict(set)
+        for user_id, location_id in Management.objects.filter(is_active=True).values_list('user_id', 'location_id'):
+            managers_at[location_id].add(user_id)
+        everyone = set().union(*managers_at.values())
+
+        alerts_for = defaultdict(list)
+        for alert in pending:
+            recipients = set(managers_at[None])
+            for location_id in stocked_at[alert.product_id]:
+                recipients |= managers_at[location_id]
+            for user_id in recipients or everyone:
+                alerts_for[user_id].append(alert)
+        Notification.objects.bulk_create([
+            Notification(user_id=user_id, type='system', message="Low stock: " + "; ".join(
+                f"{alert.product.name} ({alert.stock} left, reorder at {alert.reorder_point})" for alert in alerts
+            ))
+            for user_id, alerts in alerts_for.items()
+        ])
+        # Bulk inserts skip the signals that refresh each recipient's cached pages
+        for user_id in alerts_for:
+            bump_user_version(user_id)
+        StockAlert.objects.filter(pk__in=[alert.pk for alert in pending]).update(notified_at=timezone.now())
+        sent += len(pending)
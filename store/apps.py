@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Modules that register background jobs and periodic tasks, so every process can enqueue and run them
+        from . import exports, images, maintenance, outbox, payments, webhooks  # noqa: F401
@@ -0,0 +1,40 @@
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.core.cache import cache
+from django.db import transaction
+
+# Version stamps (nanosecond timestamps) kept in the shared cache and bumped by store.signals.
+# A missing stamp is recreated as "now", which only ever causes a cache miss, never a stale hit.
+# Bumps made inside a transaction wait for it to commit: a request that read the new stamp before
+# the writes were visible would cache the old page under the new stamp.
+CATALOG_VERSION_KEY = 'version:catalog'
+USER_VERSION_KEY = 'version:user:{}'
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key) or time.time_ns()
+    return version
+
+def _bump(key):
+    transaction.on_commit(lambda: cache.set(key, time.time_ns(), None))
+
+def catalog_version():
+    return _version(CATALOG_VERSION_KEY)
+
+def bump_catalog_version():
+    _bump(CATALOG_VERSION_KEY)
+
+def user_version(user_id):
+    return _version(USER_VERSION_KEY.format(user_id))
+
+def bump_user_version(user_id):
+    _bump(USER_VERSION_KEY.format(user_id))
+
+def version_datetime(version):
+    return datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc)
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
@@ -0,0 +1,186 @@
+import csv
+import json
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .caching import bump_user_version
+from .models import DeliveryTracking, Notification, Order
+
+# Carrier feed ingestion. A feed (CSV with a header row, or one JSON object per line) is read
+# CHUNK_SIZE events at a time; each chunk is reduced to the latest event per tracking number and
+# matched against DeliveryTracking through its unique tracking_number index in one query. An event
+# takes effect if it is newer (by carrier time) than the event behind the parcel's current status,
+# and a delivered parcel stays delivered. Changed parcels are written with one prepared statement
+# per chunk, their orders move to shipped or delivered, and customers get one notification per
+# status change.
+
+FeedEvent = namedtuple('FeedEvent', ['tracking_number', 'status', 'occurred_at', 'estimated_delivery', 'carrier', 'note'])
+
+CHUNK_SIZE = 5000
+
+# Carrier status codes accepted in feeds, by the DeliveryTracking status they mean
+STATUS_CODES = {
+    'preparing': 'preparing',
+    'label_created': 'preparing',
+    'pre_transit': 'preparing',
+    'picked_up': 'in_transit',
+    'in_transit': 'in_transit',
+    'departed': 'in_transit',
+    'arrived': 'in_transit',
+    'out_for_delivery': 'out_for_delivery',
+    'delivered': 'delivered',
+    'failed': 'failed',
+    'failed_attempt': 'failed',
+    'exception': 'failed',
+    'returned': 'failed',
+}
+
+ORDER_STATUSES = {
+    'in_transit': 'shipped',
+    'out_for_delivery': 'shipped',
+    'delivered': 'delivered',
+}
+
+UPDATE_SQL = (
+    "UPDATE {table} SET status = %s, status_at = %s, estimated_delivery = %s, carrier = %s, notes = %s, "
+    "last_updated = %s WHERE id = %s"
+)
+
+def parse_time(value):
+    # Unix time or ISO 8601; naive times are in TIME_ZONE. Returns None when missing or unreadable.
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)) or str(value).replace('.', '', 1).isdigit():
+        try:
+            return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            # e.g. millisecond timestamps, which are out of datetime's range
+            return None
+    try:
+        moment = parse_datetime(str(value))
+    except ValueError:
+        return None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+def feed_event(row):
+    # A FeedEvent for a CSV row or JSON object, or None if it lacks a tracking number, a known
+    # status or its time
+    status = STATUS_CODES.get(str(row.get('status') or '').strip().lower().replace(' ', '_').replace('-', '_'))
+    occurred_at = parse_time(row.get('occurred_at') or row.get('timestamp'))
+    tracking_number = str(row.get('tracking_number') or '').strip()
+    if not tracking_number or status is None or occurred_at is None:
+        return None
+    return FeedEvent(
+        tracking_number,
+        status,
+        occurred_at,
+        parse_time(row.get('estimated_delivery')),
+        str(row.get('carrier') or '').strip(),
+        str(row.get('note') or row.get('description') or '').strip(),
+    )
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield feed_event(row)
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield feed_event(row) if isinstance(row, dict) else None
+
+def status_message(order_id, status, note=''):
+    if status == 'in_transit':
+        return f"Order #{order_id} has shipped and is in transit."
+    if status == 'out_for_delivery':
+        return f"Order #{order_id} is out for delivery."
+    if status == 'delivered':
+        return f"Order #{order_id} has been delivered."
+    if status == 'failed':
+        return f"Delivery of Order #{order_id} failed{': ' + note if note else ''}. The carrier will be in touch."
+    return f"Order #{order_id} is being prepared for shipment."
+
+def apply_chunk(events, counts):
+    # Applies one chunk of events (None for unreadable lines) and adds to counts
+    latest = {}
+    for event in events:
+        if event is None:
+            counts['invalid'] += 1
+            continue
+        counts['events'] += 1
+        current = latest.get(event.tracking_number)
+        if current is None or event.occurred_at >= current.occurred_at:
+            # An estimate from an older event still counts when the newer one has none
+            if current is not None and event.estimated_delivery is None:
+                event = event._replace(estimated_delivery=current.estimated_delivery)
+            latest[event.tracking_number] = event
+        elif current.estimated_delivery is None and event.estimated_delivery is not None:
+            latest[event.tracking_number] = current._replace(estimated_delivery=event.estimated_delivery)
+    if not latest:
+        return
+    now = timezone.now()
+    rows = []
+    notifications = []
+    orders = {}
+    with transaction.atomic():
+        parcels = (DeliveryTracking.objects.select_for_update().filter(tracking_number__in=list(latest))
+                   .values_list('pk', 'tracking_number', 'status', 'status_at', 'estimated_delivery', 'carrier', 'notes',
+                                'order_id', 'order__user_id'))
+        found = 0
+        for pk, tracking_number, status, status_at, estimated, carrier, notes, order_id, user_id in parcels:
+            found += 1
+            event = latest[tracking_number]
+            if status_at is not None and event.occurred_at <= status_at:
+                counts['stale'] += 1
+                continue
+            moves = status != 'delivered' and event.status != status
+            new_estimate = event.estimated_delivery or estimated
+            if not moves and new_estimate == estimated:
+                counts['unchanged'] += 1
+                continue
+            rows.append((
+                event.status if moves else status,
+                event.occurred_at if moves else status_at,
+                new_estimate,
+                event.carrier or carrier,
+                (event.note or notes) if moves else notes,
+                now,
+                pk,
+            ))
+            counts['updated'] += 1
+            if moves:
+                notifications.append(Notification(user_id=user_id, order_id=order_id, type='order_update',
+                                                  message=status_message(order_id, event.status, event.note)))
+                if event.status in ORDER_STATUSES:
+                    orders.setdefault(ORDER_STATUSES[event.status], []).append(order_id)
+        counts['unknown'] += len(latest) - found
+        with connection.cursor() as cursor:
+            cursor.executemany(UPDATE_SQL.format(table=DeliveryTracking._meta.db_table), rows)
+        for status, order_ids in orders.items():
+            # Orders only move forward, and cancelled ones are left alone
+            earlier = ['pending', 'processing'] if status == 'shipped' else ['pending', 'processing', 'shipped']
+            Order.objects.filter(pk__in=order_ids, status__in=earlier).update(status=status, updated_at=now)
+        Notification.objects.bulk_create(notifications, batch_size=1000)
+    counts['notified'] += len(notifications)
+    # Bulk writes skip the signals that refresh each customer's cached pages
+    for user_id in {notification.user_id for notification in notifications}:
+        bump_user_version(user_id)
+
+def ingest(events, chunk_size=CHUNK_SIZE):
+    # Applies a stream of feed events chunk by chunk; returns counts by outcome
+    counts = dict.fromkeys(['events', 'invalid', 'updated', 'unchanged', 'stale', 'unknown', 'notified'], 0)
+    events = iter(events)
+    while True:
+        chunk = list(islice(events, chunk_size))
+        if not chunk:
+            return counts
+        apply_chunk(chunk, counts)
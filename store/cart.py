@@ -0,0 +1,192 @@
+import json
+from collections import Counter
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .caching import bump_user_version
+from .models import Cart, Product
+from .stock import release_holds
+
+# Cart lines are added with a single INSERT ... ON CONFLICT DO UPDATE statement, so concurrent
+# submits (a double-click, two tabs) increment the same row instead of racing a read-modify-write.
+# Both branches are guarded by the product's stock: a line that would exceed it is either left
+# untouched and reported back as rejected, or (when merging a guest cart) clamped to the stock.
+# Raw statements bypass model signals, so the per-user page version is bumped here explicitly.
+UPSERT_SQL = """
+    INSERT INTO {cart} (user_id, product_id, quantity, created_at)
+    SELECT %s, p.id, {insert_quantity}, %s
+    FROM {product} p JOIN (VALUES {values}) AS v ON v.column1 = p.id
+    WHERE p.is_active AND {insert_guard}
+    ON CONFLICT (user_id, product_id) DO UPDATE
+    SET quantity = {update_quantity}
+    WHERE {update_guard}
+    RETURNING product_id, quantity
+"""
+STOCK_SQL = "(SELECT stock FROM {product} WHERE id = excluded.product_id)"
+ADDED_SQL = "{cart}.quantity + excluded.quantity"
+
+def add_lines(user, quantities, clamp=False):
+    # quantities maps product id -> quantity to add; returns {product id: new line quantity}
+    # for the lines that were written. Products missing from the result were rejected.
+    totals = Counter()
+    for product_id, quantity in quantities.items():
+        if quantity > 0:
+            totals[int(product_id)] += int(quantity)
+    if not totals:
+        return {}
+    names = {
+        'cart': connection.ops.quote_name(Cart._meta.db_table),
+        'product': connection.ops.quote_name(Product._meta.db_table),
+    }
+    stock = STOCK_SQL.format(**names)
+    added = ADDED_SQL.format(**names)
+    if clamp:
+        parts = {
+            'insert_quantity': 'CASE WHEN v.column2 > p.stock THEN p.stock ELSE v.column2 END',
+            'insert_guard': 'p.stock > 0',
+            'update_quantity': f'CASE WHEN {added} > {stock} THEN {stock} ELSE {added} END',
+            'update_guard': f'{names["cart"]}.quantity < {stock}',
+        }
+    else:
+        parts = {
+            'insert_quantity': 'v.column2',
+            'insert_guard': 'p.stock >= v.column2',
+            'update_quantity': added,
+            'update_guard': f'{added} <= {stock}',
+        }
+    sql = UPSERT_SQL.format(values=', '.join(['(%s, %s)'] * len(totals)), **names, **parts)
+    params = [user.pk, timezone.now()]
+    for product_id, quantity in totals.items():
+        params.extend([product_id, quantity])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        written = dict(cursor.fetchall())
+    if written:
+        # Editing the cart abandons any started checkout and its stock holds
+        release_holds(user)
+        bump_user_version(user.pk)
+    return written
+
+def add_line(user, product, quantity):
+    # Returns the new line quantity, or None if stock does not cover it
+    return add_lines(user, {product.pk: quantity}).get(product.pk)
+
+def remove_lines(user, line_ids):
+    # Returns the names of the removed products; ids that are not integers match nothing
+    ids = []
+    for line_id in line_ids:
+        try:
+            ids.append(int(line_id))
+        except (TypeError, ValueError):
+            continue
+    lines = Cart.objects.filter(user=user, pk__in=ids)
+    names = list(lines.values_list('product__name', flat=True))
+    if names:
+        lines.delete()
+        release_holds(user)
+    return names
+
+def cart_lines(user):
+    # One query for the lines; subtotals and the total are computed from the fetched rows
+    lines = list(Cart.objects.filter(user=user).select_related('product__category').order_by('created_at', 'pk'))
+    for line in lines:
+        line.subtotal = line.product.price * line.quantity
+    return lines
+
+def cart_total(lines):
+    return sum((line.subtotal for line in lines), Decimal('0.00'))
+
+# Cart for visitors who are not logged in, kept in a signed cookie as {product id: quantity}.
+# Browsing and editing it never writes to the database; stock is only read to validate adds.
+# On login or registration it is merged into the user's Cart rows with one clamping upsert.
+class GuestCart:
+    cookie_name = 'guest_cart'
+    salt = 'store.cart.guest'
+    max_age = 60 * 60 * 24 * 30
+    max_lines = 50
+
+    def __init__(self, request):
+        self.request = request
+        self.quantities = self.load()
+        self.changed = False
+
+    def __len__(self):
+        return len(self.quantities)
+
+    def load(self):
+        value = self.request.get_signed_cookie(self.cookie_name, default=None, salt=self.salt, max_age=self.max_age)
+        try:
+            data = json.loads(value) if value else {}
+            return {int(product_id): int(quantity) for product_id, quantity in data.items() if int(quantity) > 0}
+        except (ValueError, TypeError, AttributeError):
+            return {}
+
+    def add_lines(self, quantities):
+        # Same contract as add_lines(): returns {product id: new line quantity} for accepted lines
+        requested = {int(product_id): int(quantity) for product_id, quantity in quantities.items() if quantity > 0}
+        stock = dict(Product.objects.filter(pk__in=requested, is_active=True).values_list('pk', 'stock'))
+        written = {}
+        for product_id, quantity in requested.items():
+            new_quantity = self.quantities.get(product_id, 0) + quantity
+            if product_id not in stock or new_quantity > stock[product_id]:
+                continue
+            if product_id not in self.quantities and len(self.quantities) >= self.max_lines:
+                continue
+            self.quantities[product_id] = written[product_id] = new_quantity
+        self.changed = self.changed or bool(written)
+        return written
+
+    def add_line(self, product, quantity):
+        return self.add_lines({product.pk: quantity}).get(product.pk)
+
+    def remove_lines(self, product_ids):
+        removed = []
+        for product_id in product_ids:
+            try:
+                product_id = int(product_id)
+            except (TypeError, ValueError):
+                continue
+            if self.quantities.pop(product_id, None) is not None:
+                removed.append(product_id)
+        if not removed:
+            return []
+        self.changed = True
+        return list(Product.objects.filter(pk__in=removed).values_list('name', flat=True))
+
+    def lines(self):
+        # Unsaved Cart instances so templates can treat guest and saved carts alike
+        products = Product.objects.filter(pk__in=self.quantities, is_active=True).select_related('category').in_bulk()
+        lines = []
+        for product_id, quantity in self.quantities.items():
+            if product_id in products:
+                line = Cart(product=products[product_id], quantity=quantity)
+                line.subtotal = line.product.price * quantity
+                lines.append(line)
+        return lines
+
+    def merge_into(self, user):
+        # Returns the ids of products whose quantity was reduced or dropped for lack of stock
+        if not self.quantities:
+            return []
+        existing = dict(Cart.objects.filter(user=user, product_id__in=self.quantities).values_list('product_id', 'quantity'))
+        written = add_lines(user, self.quantities, clamp=True)
+        adjusted = [
+            product_id for product_id, quantity in self.quantities.items()
+            if written.get(product_id, existing.get(product_id, 0)) < existing.get(product_id, 0) + quantity
+        ]
+        self.quantities = {}
+        self.changed = True
+        return adjusted
+
+    def save(self, response):
+        if not self.changed:
+            return response
+        if self.quantities:
+            response.set_signed_cookie(
+                self.cookie_name, json.dumps(self.quantities), salt=self.salt, max_age=self.max_age,
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(self.cookie_name, samesite='Lax')
+        return response
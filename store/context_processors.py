@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+from .caching import catalog_version
+
+# Version stamps for template fragment cache keys; only read when a template uses them
+def cache_versions(request):
+    return {
+        'catalog_version': SimpleLazyObject(catalog_version),
+    }
@@ -0,0 +1,60 @@
+import csv
+import io
+from django.core.files.base import ContentFile
+from django.utils.text import slugify
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from .jobs import job
+from .models import ReportExport
+
+# CSV/PDF rendering of model rows, shared by the admin export actions and ReportExport jobs
+
+def write_csv(model, objects, out):
+    field_names = [field.name for field in model._meta.fields]
+    writer = csv.writer(out)
+    writer.writerow(field_names)
+    for obj in objects:
+        writer.writerow([getattr(obj, field) for field in field_names])
+
+def write_pdf(model, objects, out):
+    meta = model._meta
+    field_names = [field.name for field in meta.fields]
+    p = canvas.Canvas(out, pagesize=letter)
+    y = 750
+    p.drawString(100, y, f"{meta.verbose_name_plural} Report")
+    y -= 30
+    p.drawString(100, y, ", ".join(field_names))
+    y -= 20
+    for obj in objects:
+        row = ", ".join([str(getattr(obj, field)) for field in field_names])
+        p.drawString(100, y, row)
+        y -= 20
+        if y < 50:
+            p.showPage()
+            y = 750
+    p.showPage()
+    p.save()
+
+@job('reports.export')
+def generate_report_export(export_id):
+    # Renders the export's object into its file; a failed attempt leaves it marked failed until a
+    # retry succeeds
+    export = ReportExport.objects.select_related('content_type').get(pk=export_id)
+    try:
+        obj = export.content_object
+        if obj is None:
+            raise LookupError(f"{export.content_type} {export.object_id} no longer exists.")
+        if export.export_format == 'csv':
+            out = io.StringIO()
+            write_csv(type(obj), [obj], out)
+            content = out.getvalue().encode()
+        else:
+            out = io.BytesIO()
+            write_pdf(type(obj), [obj], out)
+            content = out.getvalue()
+    except Exception:
+        ReportExport.objects.filter(pk=export.pk).update(status='failed')
+        raise
+    export.file.save(f"{slugify(export.title) or 'export'}.{export.export_format}", ContentFile(content), save=False)
+    export.status = 'completed'
+    export.save(update_fields=['file', 'status', 'updated_at'])
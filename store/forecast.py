@@ -0,0 +1,112 @@
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Inventory, OrderItem, Product, ReplenishmentSuggestion, SalesRecord
+
+# Replenishment forecasting. Daily demand per (product, location) series is aggregated in the
+# database, laid out as one dense series x day matrix, and forecast for every series at once:
+# exponential smoothing is a single matrix-vector product with the smoothing weights, a moving
+# average a single mean over the trailing window. Location None is stock not assigned to a
+# location, matching the stock ledger.
+
+def demand_history(start):
+    # (product ids, location ids with 0 for none, day ordinals, units) arrays of daily demand since
+    # start. Sales records are used for the order lines that have them, the order lines otherwise.
+    sales = (SalesRecord.objects.filter(sale_date__gte=start, product__isnull=False)
+             .values('product_id', 'location_id', day=TruncDate('sale_date'))
+             .annotate(units=Sum('quantity_sold')).order_by()
+             .values_list('product_id', 'location_id', 'day', 'units'))
+    lines = (OrderItem.objects.filter(order__ordered_at__gte=start, product__isnull=False, sales_records__isnull=True)
+             .exclude(order__status='cancelled')
+             .values('product_id', 'order__location_id', day=TruncDate('order__ordered_at'))
+             .annotate(units=Sum('quantity')).order_by()
+             .values_list('product_id', 'order__location_id', 'day', 'units'))
+    rows = list(sales) + list(lines)
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([row[1] or 0 for row in rows], dtype=np.int64),
+        np.array([row[2].toordinal() for row in rows], dtype=np.int64),
+        np.array([row[3] for row in rows], dtype=np.float64),
+    )
+
+def demand_matrix(product_ids, location_ids, days, units, first_day, n_days):
+    # Returns (series keys as (product id, location id) pairs, series x day demand matrix)
+    stride = int(location_ids.max(initial=0)) + 1
+    keys, series = np.unique(product_ids * stride + location_ids, return_inverse=True)
+    # float32 keeps two years of daily demand for 10k products in about 30 MB per location
+    matrix = np.zeros((len(keys), n_days), dtype=np.float32)
+    np.add.at(matrix, (series, days - first_day), units)
+    return np.column_stack((keys // stride, keys % stride)), matrix
+
+def smoothed_demand(matrix, alpha):
+    # Simple exponential smoothing seeded with the first day: the final level is a weighted sum
+    # whose weights decay by (1 - alpha) per day back from the last one
+    n_days = matrix.shape[1]
+    weights = alpha * (1 - alpha) ** np.arange(n_days - 1, -1, -1, dtype=np.float32)
+    weights[0] = (1 - alpha) ** (n_days - 1)
+    return matrix @ weights
+
+def moving_average_demand(matrix, window):
+    return matrix[:, -window:].mean(axis=1)
+
+def stock_on_hand(keys):
+    # On-hand units per series: located Inventory quantities, and for location None the product's
+    # stock not assigned to any location
+    located = {}
+    for product_id, location_id, quantity in (Inventory.objects.filter(product__isnull=False, location__isnull=False)
+                                              .values('product_id', 'location_id').annotate(quantity=Sum('quantity'))
+                                              .order_by().values_list('product_id', 'location_id', 'quantity')):
+        located[(product_id, location_id)] = quantity
+    assigned = {}
+    for (product_id, location_id), quantity in located.items():
+        assigned[product_id] = assigned.get(product_id, 0) + quantity
+    stock = dict(Product.objects.filter(pk__in=np.unique(keys[:, 0]).tolist()).values_list('pk', 'stock'))
+    on_hand = np.array([
+        located.get((product_id, location_id), 0) if location_id else stock.get(product_id, 0) - assigned.get(product_id, 0)
+        for product_id, location_id in keys.tolist()
+    ], dtype=np.float64)
+    # Totals that drifted below what the locations hold are reported by reconcile_stock, not reordered
+    return np.clip(on_hand, 0, None)
+
+def forecast_replenishment(history_days=730, method='smoothing', alpha=0.2, window=None):
+    # Rewrites the suggestion table; returns the number of suggestions written. A series is
+    # reordered when its stock would fall to lead time plus safety days of forecast demand, up to
+    # that plus REPLENISHMENT_COVER_DAYS.
+    now = timezone.now()
+    today = timezone.localdate(now)
+    first_day = (today - timedelta(days=history_days - 1)).toordinal()
+    start = now - timedelta(days=history_days)
+    product_ids, location_ids, days, units = demand_history(start)
+    keep = days >= first_day
+    keys, matrix = demand_matrix(product_ids[keep], location_ids[keep], days[keep], units[keep], first_day, history_days)
+
+    if method == 'smoothing':
+        demand = smoothed_demand(matrix, alpha)
+    else:
+        demand = moving_average_demand(matrix, window or settings.REORDER_WINDOW_DAYS)
+    # Sales long enough ago decay to a trace; below a thousandth of a unit a day counts as none
+    demand = np.round(demand.astype(np.float64), 3)
+    on_hand = stock_on_hand(keys)
+    reorder_level = demand * (settings.REORDER_LEAD_TIME_DAYS + settings.REORDER_SAFETY_DAYS)
+    quantity = np.ceil(reorder_level + demand * settings.REPLENISHMENT_COVER_DAYS - on_hand)
+    wanted = (demand > 0) & (quantity > 0)
+    lead_days = np.floor(np.clip((on_hand - reorder_level) / np.where(demand > 0, demand, 1), 0, None))
+
+    suggestions = [
+        ReplenishmentSuggestion(
+            product_id=product_id, location_id=location_id or None, daily_demand=daily,
+            on_hand=int(stock), quantity=int(units), reorder_date=today + timedelta(days=int(lead)), computed_at=now,
+        )
+        for (product_id, location_id), daily, stock, units, lead in zip(
+            keys[wanted].tolist(), demand[wanted].tolist(), on_hand[wanted].tolist(),
+            quantity[wanted].tolist(), lead_days[wanted].tolist(),
+        )
+    ]
+    with transaction.atomic():
+        ReplenishmentSuggestion.objects.all().delete()
+        ReplenishmentSuggestion.objects.bulk_create(suggestions, batch_size=1000)
+    return len(suggestions)
@@ -2,6 +2,8 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.core.files.uploadedfile import UploadedFile
+from .images import schedule_profile_picture
 from .models import UserProfile, Review, Category, Product, Order, Cart
 from django.core.exceptions import ValidationError
 
@@ -27,7 +29,7 @@ class RegisterForm(UserCreationForm):
         user = super().save(commit=False)
         if commit:
             user.save()
-            UserProfile.objects.get_or_create(
+            profile, created = UserProfile.objects.get_or_create(
                 user=user,
                 defaults={
                     'phone': self.cleaned_data['phone'],
@@ -35,10 +37,12 @@ class RegisterForm(UserCreationForm):
                     'city': self.cleaned_data['city'],
                     'country': self.cleaned_data['country'],
                     'postal_code': self.cleaned_data['postal_code'],
-                    'profile_picture': self.cleaned_data['profile_picture'],
                     'bio': self.cleaned_data['bio']
                 }
             )
+            # The picture is downscaled and stored off the request
+            if created and self.cleaned_data['profile_picture']:
+                schedule_profile_picture(profile, self.cleaned_data['profile_picture'])
         return user
 
 # Login Form
@@ -95,13 +99,22 @@ class UserProfileForm(forms.ModelForm):
             self.fields['username'].initial = self.instance.user.username
             self.fields['email'].initial = self.instance.user.email
 
+    @property
+    def has_new_picture(self):
+        return isinstance(self.cleaned_data.get('profile_picture'), UploadedFile)
+
     def save(self, commit=True):
         user = self.instance.user
         user.username = self.cleaned_data['username']
         user.email = self.cleaned_data['email']
+        if self.has_new_picture:
+            # Keep the current picture until the background step has processed the upload
+            self.instance.profile_picture = self.initial.get('profile_picture')
         if commit:
             user.save()
             super().save(commit)
+            if self.has_new_picture:
+                schedule_profile_picture(self.instance, self.cleaned_data['profile_picture'])
         return self.instance
 
 # Password Change Form
@@ -211,6 +224,8 @@ class PaymentForm(forms.Form):
         card_cvc = forms.CharField(max_length=4, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'CVC'}))
         iban = forms.CharField(max_length=34, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'IBAN'}))
         sdd_mandate = forms.BooleanField(required=False, label="I authorize the SEPA Direct Debit mandate")
+        # Issued with each rendered form; a resubmission with the same key replays the first result
+        idempotency_key = forms.CharField(max_length=64, widget=forms.HiddenInput)
 
         def __init__(self, *args, **kwargs):
             user = kwargs.pop('user', None)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Payment gateway adapters. Each payment method is authorized by the gateway configured for it in
+# PAYMENT_GATEWAYS (or the 'default' one). Adapters are asynchronous so one worker can have many
+# authorizations in flight; they never touch the database, which lets callers run them outside any
+# transaction. An authorization request is a dict of transaction_id, amount, currency and method;
+# transaction_id doubles as the gateway idempotency key, so a repeated request is answered with
+# the first decision.
+
+# status is one of AUTHORIZATION_STATUSES: 'pending' means the gateway confirms later
+Authorization = namedtuple('Authorization', ['status', 'reference', 'message'])
+
+AUTHORIZATION_STATUSES = {'completed', 'pending', 'failed'}
+
+class GatewayError(Exception):
+    # The gateway could not be reached or had an internal error; the authorization may be retried
+    pass
+
+class Gateway(ABC):
+    # Returns an Authorization, or raises GatewayError when no decision was made
+    @abstractmethod
+    async def authorize(self, request):
+        pass
+
+class LocalGateway(Gateway):
+    # In-process stand-in: card payments are approved at once, bank transfers and SEPA Direct Debit
+    # wait for the bank's confirmation
+    async def authorize(self, request):
+        status = 'completed' if request['method'] in ('stripe', 'paypal') else 'pending'
+        return Authorization(status, f"local_{request['transaction_id']}", '')
+
+class HTTPGateway(Gateway):
+    # Gateway speaking JSON over HTTP: POST {url}/authorizations with an Idempotency-Key header,
+    # answered with {"status", "reference", "message"}, or {"error"} and a 4xx status when declined
+    def __init__(self, url, timeout=10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    async def authorize(self, request):
+        try:
+            status, body = await asyncio.wait_for(post_json(
+                f"{self.url}/authorizations", request, {'Idempotency-Key': request['transaction_id']},
+            ), self.timeout)
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            raise GatewayError(f"{type(e).__name__}: {e}") from e
+        if not isinstance(body, dict):
+            raise GatewayError(f"HTTP {status}: the reply is not a JSON object.")
+        if status >= 500 or status == 429:
+            raise GatewayError(f"HTTP {status}: {body.get('error', '')}")
+        if status >= 400:
+            return Authorization('failed', '', str(body.get('error') or f"Declined (HTTP {status})."))
+        if body.get('status') not in AUTHORIZATION_STATUSES:
+            raise GatewayError(f"Unexpected authorization status {body.get('status')!r}.")
+        return Authorization(body['status'], str(body.get('reference') or ''), str(body.get('message') or ''))
+
+async def post(url, body, headers):
+    # Minimal HTTP/1.1 client on asyncio streams, one request per connection; returns (status, content)
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    lines = [
+        f"POST {parts.path or '/'}{'?' + parts.query if parts.query else ''} HTTP/1.1",
+        f"Host: {parts.netloc}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        "Connection: close",
+    ] + [f"{name}: {value}" for name, value in headers.items()]
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or (443 if secure else 80), ssl=secure or None)
+    try:
+        writer.write('\r\n'.join(lines).encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    response_headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in header_lines)}
+    if 'chunked' in response_headers.get('transfer-encoding', '').lower():
+        content = decode_chunked(content)
+    return int(status_line.split(None, 2)[1]), content
+
+def decode_chunked(data):
+    # The body of a Transfer-Encoding: chunked response; raises ValueError if it is malformed
+    body = bytearray()
+    while True:
+        size_line, separator, data = data.partition(b'\r\n')
+        if not separator:
+            raise ValueError("Truncated chunked response.")
+        size = int(size_line.split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            return bytes(body)
+        if len(data) < size + 2 or data[size:size + 2] != b'\r\n':
+            raise ValueError("Truncated chunked response.")
+        body += data[:size]
+        data = data[size + 2:]
+
+async def post_json(url, payload, headers):
+    status, content = await post(url, json.dumps(payload).encode(), headers)
+    return status, json.loads(content) if content.strip() else {}
+
+_gateways = {}
+
+def get_gateway(method):
+    # The configured adapter for a payment method, created once per process
+    if method not in _gateways:
+        config = settings.PAYMENT_GATEWAYS.get(method) or settings.PAYMENT_GATEWAYS['default']
+        _gateways[method] = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _gateways[method]
+
+async def authorize_all(requests, concurrency=None):
+    # Authorizes requests concurrently; returns an Authorization or the GatewayError per request
+    limit = asyncio.Semaphore(concurrency or settings.PAYMENT_GATEWAY_CONCURRENCY)
+
+    async def authorize(request):
+        async with limit:
+            try:
+                authorization = await get_gateway(request['method']).authorize(request)
+            except GatewayError as e:
+                return e
+            except Exception as e:
+                # An adapter bug or malformed reply must not abort the other authorizations
+                return GatewayError(f"{type(e).__name__}: {e}")
+            # Only these statuses can be stored; anything else would break STATUS_RANK later
+            if authorization.status not in AUTHORIZATION_STATUSES:
+                return GatewayError(f"Unexpected authorization status {authorization.status!r}.")
+            return authorization
+
+    return await asyncio.gather(*(authorize(request) for request in requests))
+
+class SimulatorServer(ThreadingHTTPServer):
+    # Local gateway for development and tests, served to HTTPGateway. Every authorization takes
+    # latency plus up to jitter seconds; failure_rate of them fail with HTTP 503 and decline_rate
+    # are declined. Card payments are approved, bank transfers and SEPA Direct Debit left pending.
+    # Decisions are remembered per Idempotency-Key. With chunked, replies use
+    # Transfer-Encoding: chunked, as some gateways' do.
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.2, jitter=0.0, failure_rate=0.0, decline_rate=0.0, seed=None, chunked=False):
+        super().__init__(address, SimulatorHandler)
+        self.latency, self.jitter, self.chunked = latency, jitter, chunked
+        self.failure_rate, self.decline_rate = failure_rate, decline_rate
+        self.random = random.Random(seed)
+        self.decisions = {}
+        self.lock = threading.Lock()
+
+    def decide(self, key, request):
+        # Returns (HTTP status, body), the same one for a repeated key
+        with self.lock:
+            if key in self.decisions:
+                return self.decisions[key]
+            roll = self.random.random()
+        if roll < self.failure_rate:
+            # Failures are not remembered, so a retry gets a fresh decision
+            return 503, {'error': "Simulated gateway failure."}
+        if roll < self.failure_rate + self.decline_rate:
+            decision = 402, {'error': "Simulated decline."}
+        else:
+            status = 'completed' if request.get('method') in ('stripe', 'paypal') else 'pending'
+            decision = 200, {'status': status, 'reference': f"sim_{uuid.uuid4().hex[:16]}", 'message': ''}
+        with self.lock:
+            return self.decisions.setdefault(key, decision)
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/authorizations':
+            return self.reply(404, {'error': "Not found."})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            return self.reply(400, {'error': "Invalid JSON."})
+        server = self.server
+        time.sleep(server.latency + server.random.random() * server.jitter)
+        key = self.headers.get('Idempotency-Key') or request.get('transaction_id') or uuid.uuid4().hex
+        self.reply(*server.decide(key, request))
+
+    def reply(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.server.chunked:
+            # Two chunks, so a client has to join them
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            half = len(content) // 2
+            for chunk in (content[:half], content[half:]):
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
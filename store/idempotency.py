@@ -0,0 +1,51 @@
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import IdempotencyKey
+
+# Idempotency keys. A key is issued with a form and claimed, inside the transaction that does the
+# work, by the request that submits it; the result is stored with the key in that transaction and
+# copied to the cache once it commits. A resubmission gets the stored result back, from the cache
+# while it lasts, without repeating the work. A concurrent duplicate waits on the unique key (or on
+# SQLite's write lock) until the first request commits and then replays its result. A request that
+# fails rolls its claim back, so the same key can be submitted again.
+
+CACHE_KEY = 'idempotency:{}:{}:{}'
+
+class DuplicateRequest(Exception):
+    def __init__(self, result):
+        super().__init__("This request has already been processed.")
+        self.result = result
+
+def issue_key():
+    return uuid.uuid4().hex
+
+def stored_result(user_id, scope, key):
+    # The result recorded for key, or None if it has not been used
+    result = cache.get(CACHE_KEY.format(user_id, scope, key))
+    if result is None:
+        result = IdempotencyKey.objects.filter(user_id=user_id, scope=scope, key=key).values_list('result', flat=True).first()
+    return result
+
+def claim_key(user, scope, key):
+    # Call inside transaction.atomic(); raises DuplicateRequest if another request committed key first
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, scope=scope, key=key)
+    except IntegrityError:
+        raise DuplicateRequest(stored_result(user.pk, scope, key))
+
+def record_result(entry, result):
+    entry.result = result
+    entry.save(update_fields=['result'])
+    cache_key = CACHE_KEY.format(entry.user_id, entry.scope, entry.key)
+    timeout = settings.IDEMPOTENCY_KEY_DAYS * 86400
+    transaction.on_commit(lambda: cache.set(cache_key, result, timeout))
+
+def purge_keys():
+    # Deletes keys older than IDEMPOTENCY_KEY_DAYS; returns the number removed
+    cutoff = timezone.now() - timedelta(days=settings.IDEMPOTENCY_KEY_DAYS)
+    return IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()[0]
@@ -0,0 +1,121 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .jobs import enqueue, job
+from .storage import media_storage
+
+logger = logging.getLogger(__name__)
+
+# Fixed derivative sizes for product images; every size is rendered at 1x and 2x
+DERIVATIVE_SIZES = {
+    'grid': (400, 300),
+    'detail': (800, 600),
+}
+DERIVATIVE_DENSITIES = (1, 2)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Profile pictures are downscaled to fit this box and re-encoded as JPEG without metadata
+PROFILE_PICTURE_SIZE = (512, 512)
+
+derivative_storage = FileSystemStorage(allow_overwrite=True)
+
+def derivative_name(source_name, size, density, extension):
+    # Sources are content addressed, so derivatives keyed by the source name never go stale
+    base = os.path.splitext(source_name)[0]
+    suffix = '' if density == 1 else f'_{density}x'
+    return f"derivatives/{base}/{size}{suffix}.{extension}"
+
+def derivative_names(source_name, size):
+    return {
+        (density, extension): derivative_name(source_name, size, density, extension)
+        for density in DERIVATIVE_DENSITIES
+        for extension in DERIVATIVE_FORMATS
+    }
+
+def generate_derivatives(source_name, storage, force=False):
+    # Render every size/density/format of source_name; returns the number of files written
+    written = 0
+    with storage.open(source_name, 'rb') as source:
+        image = Image.open(source)
+        largest = max(DERIVATIVE_SIZES.values())
+        # Let the JPEG decoder downscale while decoding, which bounds memory for large photos
+        image.draft('RGB', (largest[0] * max(DERIVATIVE_DENSITIES), largest[1] * max(DERIVATIVE_DENSITIES)))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size, (width, height) in DERIVATIVE_SIZES.items():
+            for (density, extension), name in derivative_names(source_name, size).items():
+                if not force and derivative_storage.exists(name):
+                    continue
+                target = (width * density, height * density)
+                resized = ImageOps.fit(image, target, Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                image_format, options = DERIVATIVE_FORMATS[extension]
+                resized.save(buffer, image_format, **options)
+                derivative_storage.save(name, ContentFile(buffer.getvalue()))
+                written += 1
+    return written
+
+def mark_derivatives_ready(source_names):
+    # Rendered product cards and cached pages embed the image markup, so they must be refreshed
+    from .caching import bump_catalog_version
+    from .models import Product
+    Product.objects.filter(image__in=source_names).update(updated_at=timezone.now())
+    bump_catalog_version()
+
+@job('images.derivatives', priority=5)
+def derivatives_job(source_name):
+    if generate_derivatives(source_name, media_storage):
+        mark_derivatives_ready([source_name])
+
+def schedule_derivatives(field_file):
+    # Queue derivative generation for the workers so the upload request returns immediately
+    if field_file:
+        enqueue('images.derivatives', source_name=field_file.name)
+
+def stage_upload(upload, staging_dir):
+    # Move the raw upload out of the request's temp space; large uploads are already on disk
+    os.makedirs(staging_dir, exist_ok=True)
+    fd, staged_path = tempfile.mkstemp(dir=staging_dir, prefix='upload-')
+    os.close(fd)
+    if hasattr(upload, 'temporary_file_path'):
+        shutil.move(upload.temporary_file_path(), staged_path)
+    else:
+        with open(staged_path, 'wb') as staged:
+            for chunk in upload.chunks():
+                staged.write(chunk)
+    return staged_path
+
+# A single attempt: the staged upload is removed whether or not it could be processed
+@job('images.profile_picture', priority=10, max_attempts=1)
+def process_profile_picture(profile_id, staged_path):
+    from .models import UserProfile
+    try:
+        with Image.open(staged_path) as image:
+            image.draft('RGB', PROFILE_PICTURE_SIZE)
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail(PROFILE_PICTURE_SIZE, Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            # Saving without exif= drops EXIF, GPS and maker notes from the re-encoded file
+            image.save(buffer, 'JPEG', quality=85, optimize=True)
+        profile = UserProfile.objects.filter(pk=profile_id).first()
+        if profile is not None:
+            profile.profile_picture.save('avatar.jpg', ContentFile(buffer.getvalue()), save=False)
+            profile.save(update_fields=['profile_picture'])
+    except Exception:
+        logger.exception("Failed to process profile picture for profile %s", profile_id)
+    finally:
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+
+def schedule_profile_picture(profile, upload):
+    # The current picture (or the default placeholder) keeps being served until processing finishes
+    staged_path = stage_upload(upload, profile.profile_picture.storage.path('tmp'))
+    enqueue('images.profile_picture', profile_id=profile.pk, staged_path=staged_path)
@@ -0,0 +1,187 @@
+import logging
+import math
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Database-backed job queue. enqueue() adds a Job row, inside the caller's transaction when there
+# is one, so a job exists exactly when the change that needs it commits. Workers claim due jobs
+# highest priority first: with SELECT ... FOR UPDATE SKIP LOCKED where the database supports it
+# (PostgreSQL), otherwise with a single UPDATE over a limited subquery, which SQLite runs while
+# holding its database write lock. A failed attempt is requeued with exponential backoff from
+# JOB_RETRY_DELAY; a job still running after JOB_TIMEOUT seconds is assumed lost with its worker
+# and requeued the same way.
+
+JobType = namedtuple('JobType', ['func', 'priority', 'max_attempts'])
+
+JOBS = {}
+
+def job(name, priority=0, max_attempts=3):
+    # Registers the decorated function as the job name; it is called with the job's kwargs
+    def register(func):
+        JOBS[name] = JobType(func, priority, max_attempts)
+        return func
+    return register
+
+def enqueue(name, priority=None, delay=0, unique=False, **kwargs):
+    # Queues a call of job name with kwargs. With unique, nothing is queued while an identical
+    # call is still waiting.
+    job_type = JOBS[name]
+    if unique and Job.objects.filter(name=name, kwargs=kwargs, status='queued').exists():
+        return None
+    return Job.objects.create(
+        name=name,
+        kwargs=kwargs,
+        priority=job_type.priority if priority is None else priority,
+        max_attempts=job_type.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (attempts - 1))
+
+def claim_jobs(worker, limit=1, names=None):
+    # Marks up to limit due jobs as running under a fresh claim token and returns them
+    token = f"{worker}:{uuid.uuid4().hex[:8]}"
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).order_by('-priority', 'run_at', 'id')
+    if names:
+        due = due.filter(name__in=names)
+    claim = {'status': 'running', 'claimed_by': token, 'started_at': now, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**claim)
+    else:
+        Job.objects.filter(pk__in=due.values('pk')[:limit], status='queued').update(**claim)
+    return list(Job.objects.filter(status='running', started_at=now, claimed_by=token))
+
+def finish_job(job, error=None):
+    # Records the outcome of a claimed job; a job requeued or reclaimed meanwhile is left alone
+    now = timezone.now()
+    if error is None:
+        update = {'status': 'done', 'finished_at': now, 'last_error': ''}
+    elif job.attempts < job.max_attempts:
+        update = {'status': 'queued', 'run_at': now + retry_delay(job.attempts), 'last_error': error}
+    else:
+        update = {'status': 'failed', 'finished_at': now, 'last_error': error}
+    Job.objects.filter(pk=job.pk, claimed_by=job.claimed_by, status='running').update(**update)
+
+def run_job(job):
+    job_type = JOBS.get(job.name)
+    try:
+        if job_type is None:
+            raise LookupError(f"No job is registered as {job.name!r}.")
+        job_type.func(**job.kwargs)
+    except Exception as e:
+        logger.exception("Job %s #%s failed (attempt %s of %s)", job.name, job.pk, job.attempts, job.max_attempts)
+        finish_job(job, f"{type(e).__name__}: {e}")
+    else:
+        finish_job(job)
+
+def requeue_stale_jobs():
+    # Returns the number of jobs taken back from workers that stopped reporting
+    stale = Job.objects.filter(status='running', started_at__lt=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT))
+    requeued = 0
+    for job in stale:
+        finish_job(job, f"Timed out after {settings.JOB_TIMEOUT}s on {job.claimed_by}.")
+        requeued += 1
+    return requeued
+
+def prune_jobs():
+    # Deletes finished jobs older than JOB_RETENTION_DAYS; returns the number removed
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    return Job.objects.filter(status__in=['done', 'failed'], finished_at__lt=cutoff).delete()[0]
+
+def work(worker, stop, names=None, poll_interval=1.0, burst=False):
+    # Claims and runs jobs one at a time until stop is set, or with burst until none is due
+    try:
+        while not stop.is_set():
+            try:
+                jobs = claim_jobs(worker, 1, names)
+                for job in jobs:
+                    run_job(job)
+            except DatabaseError:
+                # A dropped connection, or on SQLite a write lock held past the busy timeout; a job
+                # left running is requeued once it goes stale
+                logger.exception("Worker %s lost its database connection", worker)
+                connection.close()
+                jobs = []
+            if not jobs:
+                if burst:
+                    return
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+
+def run_pool(threads=2, names=None, poll_interval=1.0, burst=False, housekeeping=True, periodic=None):
+    # Runs a pool of worker threads in this process until SIGTERM/SIGINT lets them finish their
+    # current job. With housekeeping it also requeues stale jobs and prunes old ones every minute,
+    # and calls periodic (e.g. the scheduler's tick) every 15 seconds.
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    pool = [
+        threading.Thread(target=work, args=(f"{worker}:{index}", stop, names, poll_interval, burst), name=f"job-worker-{index}")
+        for index in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    next_housekeeping = next_periodic = 0
+    while any(thread.is_alive() for thread in pool):
+        if housekeeping and time.monotonic() >= next_housekeeping:
+            requeue_stale_jobs()
+            prune_jobs()
+            connection.close()
+            next_housekeeping = time.monotonic() + 60
+        if housekeeping and periodic and not stop.is_set() and time.monotonic() >= next_periodic:
+            try:
+                periodic()
+            except DatabaseError:
+                logger.exception("Periodic call %s failed", periodic.__name__)
+            connection.close()
+            next_periodic = time.monotonic() + 15
+        for thread in pool:
+            thread.join(1 / len(pool))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(math.ceil(fraction * len(ordered)) - 1, len(ordered) - 1)] if ordered else None
+
+def job_metrics(since):
+    # Per job name: jobs finished and failed since, throughput per minute, queue wait (run_at to
+    # start) and run time in seconds as (mean, p95), and the jobs currently queued
+    seconds = max((timezone.now() - since).total_seconds(), 1)
+    finished = Job.objects.filter(finished_at__gte=since).values_list('name', 'status', 'run_at', 'started_at', 'finished_at')
+    stats = defaultdict(lambda: {'done': 0, 'failed': 0, 'waits': [], 'runs': [], 'queued': 0})
+    for name, status, run_at, started_at, finished_at in finished.iterator():
+        entry = stats[name]
+        entry[status] += 1
+        entry['waits'].append(max((started_at - run_at).total_seconds(), 0))
+        entry['runs'].append((finished_at - started_at).total_seconds())
+    for name in Job.objects.filter(status='queued').values_list('name', flat=True):
+        stats[name]['queued'] += 1
+    return {
+        name: {
+            'done': entry['done'],
+            'failed': entry['failed'],
+            'queued': entry['queued'],
+            'per_minute': (entry['done'] + entry['failed']) * 60 / seconds,
+            'wait': (sum(entry['waits']) / len(entry['waits']), percentile(entry['waits'], 0.95)) if entry['waits'] else None,
+            'run': (sum(entry['runs']) / len(entry['runs']), percentile(entry['runs'], 0.95)) if entry['runs'] else None,
+        }
+        for name, entry in sorted(stats.items())
+    }
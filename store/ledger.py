@@ -0,0 +1,197 @@
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+from .alerts import refresh_stock_alerts
+from .caching import bump_catalog_version
+from .models import Inventory, Product, StockMovement, StockSnapshot
+
+# StockMovement is the source of truth for on-hand stock; Product.stock (all locations plus
+# unassigned stock) and Inventory.quantity are running totals kept in step with it by every
+# writer, inside the same transaction. Snapshots are taken in runs that all share one ledger
+# watermark, so on-hand stock is the latest run plus the ledger rows after its watermark, and
+# reconciliation compares that against the running totals in a single set-based query.
+
+LEDGER_SQL = """
+    WITH watermark AS (
+        SELECT COALESCE(MAX(last_movement_id), 0) AS id FROM {snapshot}
+    ),
+    ledger AS (
+        SELECT product_id, location_id, on_hand AS quantity FROM {snapshot}
+        WHERE last_movement_id = (SELECT id FROM watermark)
+        UNION ALL
+        SELECT product_id, location_id, quantity FROM {movement}
+        WHERE id > (SELECT id FROM watermark) AND id <= %s
+    )
+"""
+
+DRIFT_SQL = LEDGER_SQL + """,
+    buckets AS (
+        SELECT product_id, location_id, SUM(quantity) AS on_hand FROM ledger GROUP BY product_id, location_id
+    ),
+    combined AS (
+        SELECT product_id, location_id, on_hand AS ledger, 0 AS recorded FROM buckets
+        WHERE location_id IS NOT NULL
+        UNION ALL
+        SELECT product_id, location_id, 0, quantity FROM {inventory}
+        WHERE product_id IS NOT NULL AND location_id IS NOT NULL
+        UNION ALL
+        SELECT product_id, NULL, on_hand, 0 FROM buckets
+        UNION ALL
+        SELECT id, NULL, 0, stock FROM {product}
+    )
+    SELECT product_id, location_id, SUM(ledger), SUM(recorded) FROM combined
+    GROUP BY product_id, location_id
+    HAVING SUM(ledger) <> SUM(recorded)
+    ORDER BY product_id, location_id
+"""
+
+SNAPSHOT_SQL = LEDGER_SQL + """
+    INSERT INTO {snapshot} (product_id, location_id, on_hand, last_movement_id, taken_at)
+    SELECT product_id, location_id, SUM(quantity), %s, %s FROM ledger
+    GROUP BY product_id, location_id
+    HAVING SUM(quantity) <> 0
+"""
+
+def _tables():
+    quote = connection.ops.quote_name
+    return {
+        'snapshot': quote(StockSnapshot._meta.db_table),
+        'movement': quote(StockMovement._meta.db_table),
+        'inventory': quote(Inventory._meta.db_table),
+        'product': quote(Product._meta.db_table),
+    }
+
+def ledger_position():
+    return StockMovement.objects.aggregate(position=Max('id'))['position'] or 0
+
+def lock_ledger():
+    # Call inside transaction.atomic(); returns a position below which no movement can still
+    # appear. Ids are taken at insert but rows only become visible at commit, so on PostgreSQL a
+    # writer that has not committed yet could otherwise land below the position later. The SHARE
+    # lock waits for every transaction that inserted movements to end and keeps new inserts out
+    # until the caller's transaction ends. SQLite runs one write transaction at a time already.
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {_tables()['movement']} IN SHARE MODE")
+    return ledger_position()
+
+def record_movements(movements):
+    # Appends unsaved StockMovement rows; callers update the running totals themselves
+    return StockMovement.objects.bulk_create([movement for movement in movements if movement.quantity])
+
+def adjust_product_stock(product, new_stock, kind='adjustment', user=None, reference=''):
+    # Records the difference between new_stock and the product's current total. Must run inside
+    # the transaction that saves new_stock; the product row stays locked until it commits.
+    delta = new_stock - Product.objects.select_for_update().filter(pk=product.pk).values_list('stock', flat=True).get()
+    record_movements([StockMovement(product=product, kind=kind, quantity=delta, created_by=user, reference=reference)])
+    return delta
+
+def adjust_inventory(previous, inventory, user=None, reference=''):
+    # Records an Inventory edit as ledger rows and applies the net change to Product.stock.
+    # previous is (product id, location id, quantity) before the edit, or None for a new row.
+    deltas = defaultdict(int)
+    if previous and previous[0] and previous[1]:
+        deltas[previous[:2]] -= previous[2]
+    if inventory.product_id and inventory.location_id:
+        deltas[(inventory.product_id, inventory.location_id)] += inventory.quantity
+    kind = 'adjustment' if previous else 'restock'
+    record_movements([
+        StockMovement(product_id=product_id, location_id=location_id, kind=kind, quantity=quantity,
+                      created_by=user, reference=reference)
+        for (product_id, location_id), quantity in deltas.items()
+    ])
+    per_product = defaultdict(int)
+    for (product_id, location_id), quantity in deltas.items():
+        per_product[product_id] += quantity
+    for product_id, quantity in per_product.items():
+        if quantity:
+            Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity, updated_at=timezone.now())
+    if any(per_product.values()):
+        bump_catalog_version()
+        refresh_stock_alerts(per_product)
+
+@transaction.atomic
+def transfer_stock(product, quantity, source=None, destination=None, user=None, reference=''):
+    # Moves units between locations (None is unassigned stock); Product.stock is unchanged.
+    # Raises ValueError if the source holds fewer than quantity units.
+    rows = {}
+    for location in (source, destination):
+        if location is not None:
+            row = Inventory.objects.select_for_update().filter(product=product, location=location, farm_tool=None).first()
+            rows[location.pk] = row or Inventory(product=product, location=location, quantity=0)
+    if source is not None:
+        available = rows[source.pk].quantity
+    else:
+        # Unassigned stock is whatever of Product.stock no location holds
+        stock = Product.objects.select_for_update().values_list('stock', flat=True).get(pk=product.pk)
+        located = (Inventory.objects.filter(product=product, location__isnull=False)
+                   .aggregate(total=Sum('quantity'))['total'] or 0)
+        available = stock - located
+    if quantity > available:
+        raise ValueError(f"{source or 'Unassigned stock'} holds {max(available, 0)} unit(s) of {product}, not {quantity}.")
+    if source is not None:
+        rows[source.pk].quantity -= quantity
+    if destination is not None:
+        rows[destination.pk].quantity += quantity
+    for row in rows.values():
+        row.save()
+    return record_movements([
+        StockMovement(product=product, location=source, kind='transfer', quantity=-quantity, created_by=user, reference=reference),
+        StockMovement(product=product, location=destination, kind='transfer', quantity=quantity, created_by=user, reference=reference),
+    ])
+
+def ledger_on_hand(product_ids):
+    # {(product id, location id): on-hand units} from the latest snapshot run plus the ledger tail
+    on_hand = defaultdict(int)
+    watermark = StockSnapshot.objects.aggregate(position=Max('last_movement_id'))['position'] or 0
+    snapshots = StockSnapshot.objects.filter(last_movement_id=watermark, product_id__in=product_ids)
+    tail = StockMovement.objects.filter(id__gt=watermark, product_id__in=product_ids)
+    for product_id, location_id, quantity in snapshots.values_list('product_id', 'location_id', 'on_hand'):
+        on_hand[(product_id, location_id)] += quantity
+    for product_id, location_id, quantity in tail.values_list('product_id', 'location_id', 'quantity'):
+        on_hand[(product_id, location_id)] += quantity
+    return dict(on_hand)
+
+@transaction.atomic
+def stock_drift():
+    # Rows of (product id, location id or None for the product total, ledger units, recorded units)
+    position = lock_ledger()
+    with connection.cursor() as cursor:
+        cursor.execute(DRIFT_SQL.format(**_tables()), [position])
+        return cursor.fetchall()
+
+@transaction.atomic
+def take_snapshot(keep=None):
+    # Writes a snapshot run at the current ledger position; returns the number of rows written
+    latest = StockSnapshot.objects.aggregate(position=Max('last_movement_id'))['position']
+    position = lock_ledger()
+    if latest is not None and latest >= position:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(SNAPSHOT_SQL.format(**_tables()), [position, position, timezone.now()])
+    written = StockSnapshot.objects.filter(last_movement_id=position).count()
+    if keep:
+        runs = StockSnapshot.objects.values_list('last_movement_id', flat=True).distinct().order_by('-last_movement_id')
+        runs = list(runs[:keep])
+        if len(runs) == keep:
+            StockSnapshot.objects.filter(last_movement_id__lt=runs[-1]).delete()
+    return written
+
+@transaction.atomic
+def take_baseline(user=None):
+    # Opens the ledger from the current running totals: one restock row per located Inventory
+    # quantity and one for each product's unassigned remainder. Only valid on an empty ledger.
+    if StockMovement.objects.exists():
+        raise ValueError("The stock ledger already has movements; use reconcile_stock instead.")
+    located = defaultdict(int)
+    movements = []
+    for product_id, location_id, quantity in (Inventory.objects.filter(product__isnull=False, location__isnull=False)
+                                              .values_list('product_id', 'location_id', 'quantity')):
+        movements.append(StockMovement(product_id=product_id, location_id=location_id, kind='restock',
+                                       quantity=quantity, created_by=user, reference='baseline'))
+        located[product_id] += quantity
+    for product_id, stock in Product.objects.values_list('pk', 'stock'):
+        movements.append(StockMovement(product_id=product_id, kind='restock', quantity=stock - located[product_id],
+                                       created_by=user, reference='baseline'))
+    return record_movements(movements)
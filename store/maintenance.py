@@ -0,0 +1,147 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+from .alerts import notify_stock_alerts, recompute_reorder_points
+from .caching import bump_user_version
+from .idempotency import purge_keys
+from .ledger import take_snapshot
+from .models import (
+    Discount, Expense, Management, Notification, OrderItem, ProfitLoss, Report, ToolMaintenance,
+)
+from .outbox import drain_outbox
+from .payments import authorize_payments
+from .webhooks import apply_webhook_events, prune_events
+from .scheduler import periodic, prune_runs
+from .stock import expire_holds
+
+# Scheduled maintenance. Every task here is registered with the scheduler and can also be called
+# directly; all of them are safe to rerun for the same period.
+
+periodic('stock.expire_holds', '*/5 * * * *')(expire_holds)
+periodic('stock.notify_alerts', '*/15 * * * *')(notify_stock_alerts)
+periodic('stock.reorder_points', '0 2 * * *')(recompute_reorder_points)
+periodic('scheduler.prune', '15 2 * * *')(prune_runs)
+periodic('idempotency.purge', '20 2 * * *')(purge_keys)
+periodic('payments.authorize', '* * * * *')(authorize_payments)
+periodic('payments.webhooks', '* * * * *')(apply_webhook_events)
+periodic('payments.prune_webhooks', '25 2 * * *')(prune_events)
+
+@periodic('outbox.retry', '* * * * *')
+def retry_outbox():
+    # Events are drained as they are published; this picks up the ones rescheduled after a failure
+    drain_outbox()
+
+@periodic('stock.snapshot', '0 3 * * *')
+def take_daily_snapshot():
+    take_snapshot(keep=7)
+
+@periodic('stock.forecast', '30 4 * * *')
+def run_forecast():
+    # Imported here so web processes do not load NumPy
+    from .forecast import forecast_replenishment
+    forecast_replenishment()
+
+@periodic('discounts.expire', '*/10 * * * *')
+def expire_discounts():
+    # Deactivates discounts past their end date or out of uses; returns the number deactivated
+    used_up = Q(max_uses__isnull=False, used_count__gte=F('max_uses'))
+    return Discount.objects.filter(Q(end_date__lte=timezone.now()) | used_up, is_active=True).update(is_active=False)
+
+@periodic('notifications.purge', '30 3 * * *')
+def purge_notifications(batch_size=1000):
+    # Deletes read notifications older than NOTIFICATION_RETENTION_DAYS; returns the number removed
+    cutoff = timezone.now() - timedelta(days=settings.NOTIFICATION_RETENTION_DAYS)
+    removed = 0
+    while True:
+        batch = list(Notification.objects.filter(is_read=True, created_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return removed
+        removed += Notification.objects.filter(pk__in=batch).delete()[0]
+
+def previous_month(now=None):
+    # (start, end) of the calendar month before now's, in TIME_ZONE
+    end = timezone.localtime(now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    start = (end - timedelta(days=1)).replace(day=1)
+    return start, end
+
+def current_month(now=None):
+    start = timezone.localtime(now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def sold_items(start, end):
+    return OrderItem.objects.filter(order__ordered_at__gte=start, order__ordered_at__lt=end).exclude(order__status='cancelled')
+
+@periodic('profit_loss.monthly', '15 1 1 * *')
+def compute_profit_loss(start=None, end=None):
+    # Company-wide P&L for a period (the previous month by default): order revenue against expenses
+    if start is None:
+        start, end = previous_month()
+    revenue = sold_items(start, end).aggregate(total=Sum('subtotal'))['total'] or 0
+    cost = Expense.objects.filter(date_incurred__gte=start.date(), date_incurred__lt=end.date()).aggregate(total=Sum('amount'))['total'] or 0
+    entry = ProfitLoss.objects.filter(product=None, order=None, period_start=start, period_end=end).first()
+    entry = entry or ProfitLoss(period_start=start, period_end=end)
+    entry.revenue, entry.cost = revenue, cost
+    entry.save()
+    return entry
+
+def sales_report_data(start, end):
+    items = sold_items(start, end)
+    totals = items.aggregate(orders=Count('order', distinct=True), units=Sum('quantity'), revenue=Sum('subtotal'))
+    top = (items.values('product__name').annotate(units=Sum('quantity'), revenue=Sum('subtotal'))
+           .order_by('-revenue')[:5])
+    revenue = totals['revenue'] or 0
+    return {
+        'summary': f"{totals['orders']} orders, {totals['units'] or 0} units, ${revenue:.2f} revenue.",
+        'orders': totals['orders'],
+        'units': totals['units'] or 0,
+        'revenue': str(revenue),
+        'top_products': [
+            {'name': row['product__name'], 'units': row['units'], 'revenue': str(row['revenue'])} for row in top
+        ],
+    }
+
+@periodic('reports.rebuild', '45 1 * * *')
+def rebuild_reports():
+    # Rebuilds the sales report for the previous and current month and the previous month's P&L report
+    for start, end in (previous_month(), current_month()):
+        Report.objects.update_or_create(report_type='sales', period_start=start, period_end=end, defaults={
+            'title': f"Sales {start:%B %Y}",
+            'data': sales_report_data(start, end),
+        })
+    start, end = previous_month()
+    entry = compute_profit_loss(start, end)
+    Report.objects.update_or_create(report_type='profit_loss', period_start=start, period_end=end, defaults={
+        'title': f"Profit & Loss {start:%B %Y}",
+        'data': {
+            'summary': f"${entry.revenue:.2f} revenue, ${entry.cost:.2f} expenses, ${entry.profit:.2f} profit.",
+            'revenue': str(entry.revenue),
+            'cost': str(entry.cost),
+            'profit': str(entry.profit),
+        },
+    })
+
+@periodic('tools.flag_overdue', '0 7 * * *')
+def flag_overdue_maintenance():
+    # Notifies the managers of each tool's location (and company-wide managers) once per overdue
+    # maintenance record that no later maintenance has superseded; returns the records flagged
+    later = ToolMaintenance.objects.filter(farm_tool=OuterRef('farm_tool'), maintenance_date__gt=OuterRef('maintenance_date'))
+    overdue = list(ToolMaintenance.objects.filter(next_maintenance__lt=timezone.now(), overdue_flagged_at__isnull=True)
+                   .exclude(Exists(later)).select_related('farm_tool'))
+    if not overdue:
+        return 0
+    managers = list(Management.objects.filter(is_active=True).values_list('user_id', 'location_id'))
+    notifications = []
+    for record in overdue:
+        tool = record.farm_tool
+        for user_id, location_id in managers:
+            if location_id is None or location_id == tool.location_id:
+                notifications.append(Notification(user_id=user_id, type='system', message=(
+                    f"Maintenance overdue: {tool.name} was due on {timezone.localtime(record.next_maintenance):%Y-%m-%d}."
+                )))
+    Notification.objects.bulk_create(notifications)
+    # Bulk inserts skip the signals that refresh each recipient's cached pages
+    for user_id in {notification.user_id for notification in notifications}:
+        bump_user_version(user_id)
+    ToolMaintenance.objects.filter(pk__in=[record.pk for record in overdue]).update(overdue_flagged_at=timezone.now())
+    return len(overdue)
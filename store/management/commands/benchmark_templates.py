@@ -0,0 +1,82 @@
+import time
+from copy import deepcopy
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+from store.models import Product
+from store.views import ProductDetailView, ProductListView, UserDashboardView
+
+class Command(BaseCommand):
+    help = "Compare storefront render times without caching against the cached loader with warm fragments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        product = Product.objects.filter(is_active=True).order_by('id').first()
+        if product is None:
+            raise CommandError("Benchmarking needs at least one active product.")
+
+        pages = [
+            (UserDashboardView, '/', {}),
+            (ProductListView, '/products/', {}),
+            (ProductDetailView, f'/products/{product.pk}/', {'pk': product.pk}),
+        ]
+        uncached = self.backend(cached=False)
+        cached = self.backend(cached=True)
+        fragments = caches['fragments']
+        iterations = options['iterations']
+
+        self.stdout.write(f"{'template':<28}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+        for view_class, path, kwargs in pages:
+            request = RequestFactory().get(path)
+            request.user = AnonymousUser()
+            view = view_class()
+            view.setup(request, **kwargs)
+            # Evaluate the querysets once so only template rendering is measured
+            context = self.context(view)
+            template_name = view.get_template_names()[0]
+
+            def cold():
+                fragments.clear()
+                uncached.get_template(template_name).render(context, request)
+
+            def warm():
+                cached.get_template(template_name).render(context, request)
+
+            before = self.measure(cold, iterations)
+            warm()
+            after = self.measure(warm, iterations)
+            self.stdout.write(f"{template_name:<28}{before:>12.2f}{after:>12.2f}{before / after:>9.1f}x")
+
+    def backend(self, cached):
+        config = deepcopy(settings.TEMPLATES[0])
+        loaders = ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader']
+        if cached:
+            loaders = [('django.template.loaders.cached.Loader', loaders)]
+        config['OPTIONS']['loaders'] = loaders
+        config.pop('BACKEND')
+        config.setdefault('NAME', 'benchmark-cached' if cached else 'benchmark-uncached')
+        config['APP_DIRS'] = False
+        return DjangoTemplates(config)
+
+    def context(self, view):
+        if hasattr(view, 'get_object'):
+            view.object = view.get_object()
+            context = view.get_context_data(object=view.object)
+        else:
+            view.object_list = view.get_queryset()
+            context = view.get_context_data()
+        for value in context.values():
+            if hasattr(value, '_fetch_all'):
+                value._fetch_all()
+        return context
+
+    def measure(self, render, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            render()
+        return (time.perf_counter() - start) * 1000 / iterations
@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from store.outbox import drain_outbox
+
+class Command(BaseCommand):
+    help = "Apply pending outbox events (order notifications, delivery tracking, loyalty points)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new events instead of exiting.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = drain_outbox(options['batch_size'])
+            if processed or failed or not options['loop']:
+                self.stdout.write(f"Applied {processed} outbox event(s); {failed} failed and will be retried.")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
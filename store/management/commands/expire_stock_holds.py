@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.stock import expire_holds
+
+class Command(BaseCommand):
+    help = "Delete checkout stock holds whose TTL has passed. Run periodically, e.g. every few minutes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        removed = expire_holds(options['batch_size'])
+        self.stdout.write(f"Expired {removed} stock hold(s).")
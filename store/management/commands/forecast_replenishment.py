@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from store.forecast import forecast_replenishment
+
+class Command(BaseCommand):
+    help = "Forecast daily demand per product and location from order history and rewrite the replenishment suggestions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=730, help="Days of order history to read.")
+        parser.add_argument('--method', choices=['smoothing', 'moving-average'], default='smoothing')
+        parser.add_argument('--alpha', type=float, default=0.2, help="Smoothing factor for --method smoothing.")
+        parser.add_argument('--window', type=int, help="Days averaged by --method moving-average; defaults to REORDER_WINDOW_DAYS.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = forecast_replenishment(options['days'], options['method'], options['alpha'], options['window'])
+        self.stdout.write(f"Wrote {written} replenishment suggestion(s) in {time.monotonic() - started:.1f}s.")
@@ -0,0 +1,117 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from store.images import DERIVATIVE_SIZES, derivative_names, derivative_storage
+from store.models import MediaBlob
+from store.signals import MEDIA_FIELDS
+from store.storage import CONTENT_ADDRESSED_NAME, media_storage
+
+class Command(BaseCommand):
+    help = "Garbage-collect unreferenced media blobs, optionally recounting references and adopting legacy files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--grace-hours', type=int, default=24,
+                            help="Keep orphaned blobs younger than this, so in-flight uploads survive.")
+        parser.add_argument('--recount', action='store_true',
+                            help="Recompute every blob's ref_count from the referencing tables.")
+        parser.add_argument('--adopt', action='store_true',
+                            help="Move files saved before content addressing into deduplicated blobs.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['adopt']:
+            self.adopt_legacy_files(batch_size, options['dry_run'])
+        if options['recount'] or options['adopt']:
+            self.recount(batch_size, options['dry_run'])
+        self.sweep(batch_size, timedelta(hours=options['grace_hours']), options['dry_run'])
+
+    def referenced_names(self, batch_size):
+        counts = Counter()
+        for model, fields in MEDIA_FIELDS.items():
+            for field in fields:
+                names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                counts.update(names.values_list(field, flat=True).iterator(chunk_size=batch_size))
+        return counts
+
+    def adopt_legacy_files(self, batch_size, dry_run):
+        adopted, legacy_names = 0, set()
+        for model, fields in MEDIA_FIELDS.items():
+            for field in fields:
+                pending = []
+                rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).only('pk', field)
+                for obj in rows.iterator(chunk_size=batch_size):
+                    name = getattr(obj, field).name
+                    if CONTENT_ADDRESSED_NAME.search(name) or not media_storage.exists(name):
+                        continue
+                    legacy_names.add(name)
+                    if not dry_run:
+                        with media_storage.open(name, 'rb') as legacy:
+                            new_name = media_storage.save(name, File(legacy, name))
+                        setattr(obj, field, new_name)
+                        pending.append(obj)
+                    adopted += 1
+                    if len(pending) >= batch_size:
+                        model.objects.bulk_update(pending, [field])
+                        pending = []
+                if pending:
+                    model.objects.bulk_update(pending, [field])
+
+        if not dry_run:
+            for name in legacy_names:
+                media_storage.delete(name)
+        self.stdout.write(f"Adopted {adopted} legacy file reference(s) from {len(legacy_names)} file(s).")
+
+    def recount(self, batch_size, dry_run):
+        counts = self.referenced_names(batch_size)
+        changed = []
+        for blob in MediaBlob.objects.only('pk', 'name', 'ref_count').iterator(chunk_size=batch_size):
+            ref_count = counts.get(blob.name, 0)
+            if blob.ref_count != ref_count:
+                blob.ref_count = ref_count
+                changed.append(blob)
+        if not dry_run:
+            MediaBlob.objects.bulk_update(changed, ['ref_count'], batch_size=batch_size)
+        self.stdout.write(f"Recounted references, {len(changed)} blob(s) corrected.")
+
+    def sweep(self, batch_size, grace, dry_run):
+        cutoff = timezone.now() - grace
+        orphans = MediaBlob.objects.filter(ref_count__lte=0, created_at__lt=cutoff).order_by('created_at')
+        deleted, freed, offset = 0, 0, 0
+        while True:
+            batch = list(orphans.values_list('pk', 'name', 'size')[offset:offset + batch_size])
+            if not batch:
+                break
+            if dry_run:
+                offset += batch_size
+            else:
+                with transaction.atomic():
+                    # Re-check under the row locks, which an upload of the same content takes
+                    # before reusing the file, so a blob referenced or re-uploaded since the scan
+                    # keeps its file
+                    kept = set(MediaBlob.objects.select_for_update().filter(
+                        pk__in=[pk for pk, _, _ in batch], ref_count__lte=0, created_at__lt=cutoff
+                    ).values_list('pk', flat=True))
+                    batch = [row for row in batch if row[0] in kept]
+                    for _, name, _ in batch:
+                        media_storage.delete(name)
+                        for size in DERIVATIVE_SIZES:
+                            for derivative in derivative_names(name, size).values():
+                                derivative_storage.delete(derivative)
+                    MediaBlob.objects.filter(pk__in=kept).delete()
+            deleted += len(batch)
+            freed += sum(size for _, _, size in batch)
+
+        stale_before = time.time() - grace.total_seconds()
+        tmp_dir = media_storage.path('tmp')
+        if not dry_run and os.path.isdir(tmp_dir):
+            for entry in os.scandir(tmp_dir):
+                if entry.is_file() and entry.stat().st_mtime < stale_before:
+                    os.remove(entry.path)
+        self.stdout.write(f"{'Would delete' if dry_run else 'Deleted'} {deleted} orphaned blob(s), {freed} bytes.")
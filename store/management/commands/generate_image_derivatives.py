@@ -0,0 +1,39 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from store.images import generate_derivatives, mark_derivatives_ready
+from store.models import Product
+
+def _render(source_name, force):
+    # Runs in a worker process; uses the storage configured on Product.image
+    return source_name, generate_derivatives(source_name, Product._meta.get_field('image').storage, force=force)
+
+class Command(BaseCommand):
+    help = "Generate grid/detail WebP and JPEG derivatives for existing product images in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives that already exist.")
+
+    def handle(self, *args, **options):
+        storage = Product._meta.get_field('image').storage
+        names = (
+            Product.objects.exclude(image='').exclude(image__isnull=True)
+            .values_list('image', flat=True).distinct().order_by()
+        )
+        names = [name for name in names.iterator() if storage.exists(name)]
+        written = failed = 0
+        updated = []
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(_render, name, options['force']): name for name in names}
+            for future in as_completed(futures):
+                try:
+                    name, count = future.result()
+                    written += count
+                    if count:
+                        updated.append(name)
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {exc}")
+        for start in range(0, len(updated), 500):
+            mark_derivatives_ready(updated[start:start + 500])
+        self.stdout.write(f"Processed {len(names)} image(s): {written} derivative(s) written, {failed} failed.")
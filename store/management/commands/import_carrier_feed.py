@@ -0,0 +1,34 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from store.carriers import CHUNK_SIZE, ingest, read_csv, read_jsonl
+
+class Command(BaseCommand):
+    help = ("Apply a carrier status feed to DeliveryTracking. CSV columns (or JSON keys): tracking_number, "
+            "status, occurred_at, and optionally estimated_delivery, carrier and note.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', help="Path of the feed file, or - to read standard input.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Feed format; guessed from the file extension by default.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Events matched and written per transaction.")
+
+    def handle(self, *args, **options):
+        path = options['feed']
+        feed_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        reader = read_csv if feed_format == 'csv' else read_jsonl
+        started = time.monotonic()
+        try:
+            if path == '-':
+                counts = ingest(reader(sys.stdin), options['chunk_size'])
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as stream:
+                    counts = ingest(reader(stream), options['chunk_size'])
+        except OSError as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{counts['events']} events in {elapsed:.1f}s ({counts['events'] / max(elapsed, 1e-9):.0f}/s): "
+            f"{counts['updated']} parcels updated, {counts['notified']} notifications, {counts['unchanged']} unchanged, "
+            f"{counts['stale']} older than the current status, {counts['unknown']} unknown tracking numbers, "
+            f"{counts['invalid']} unreadable lines."
+        )
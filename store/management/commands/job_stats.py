@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store.jobs import job_metrics
+
+class Command(BaseCommand):
+    help = "Show throughput and latency per background job type over a recent window."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=60)
+
+    def handle(self, *args, **options):
+        metrics = job_metrics(timezone.now() - timedelta(minutes=options['minutes']))
+        if not metrics:
+            self.stdout.write("No jobs in the window.")
+            return
+
+        def seconds(pair):
+            return f"{pair[0]:.2f}s / {pair[1]:.2f}s" if pair else "-"
+
+        self.stdout.write(f"{'job':<24} {'done':>6} {'failed':>6} {'queued':>6} {'per min':>8}  {'wait mean / p95':<20} run mean / p95")
+        for name, entry in metrics.items():
+            self.stdout.write(
+                f"{name:<24} {entry['done']:>6} {entry['failed']:>6} {entry['queued']:>6} {entry['per_minute']:>8.1f}  "
+                f"{seconds(entry['wait']):<20} {seconds(entry['run'])}"
+            )
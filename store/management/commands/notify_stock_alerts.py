@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.alerts import notify_stock_alerts
+
+class Command(BaseCommand):
+    help = "Send pending low-stock alerts to managers, batched into one notification per manager."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        sent = notify_stock_alerts(options['batch_size'])
+        self.stdout.write(f"Sent {sent} low-stock alert(s).")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.alerts import recompute_reorder_points
+
+class Command(BaseCommand):
+    help = "Derive each product's reorder point from recent sales velocity and refresh low-stock alerts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        changed = recompute_reorder_points(options['batch_size'])
+        self.stdout.write(f"Updated the reorder point of {changed} product(s).")
@@ -0,0 +1,54 @@
+import csv
+import time
+from django.core.management.base import BaseCommand, CommandError
+from store.reconciliation import read_camt, read_csv, reconcile
+
+class Command(BaseCommand):
+    help = ("Settle pending bank transfer and SEPA Direct Debit payments from a bank statement "
+            "(CSV, or CAMT.053/054 XML).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help="Path of the statement file.")
+        parser.add_argument('--format', choices=['csv', 'camt'], help="Statement format; guessed from the file extension by default.")
+        parser.add_argument('--encoding', default='utf-8-sig', help="Encoding of a CSV statement.")
+        parser.add_argument('--delimiter', default=',', help="Field delimiter of a CSV statement.")
+        parser.add_argument('--reference-column', default='reference')
+        parser.add_argument('--amount-column', default='amount')
+        parser.add_argument('--currency-column', default='currency')
+        parser.add_argument('--entry-column', default='entry_id', help="Column with the bank's id for the entry.")
+        parser.add_argument('--text-column', default='description', help="Column with the remittance text.")
+        parser.add_argument('--unmatched', help="Write the lines that settled nothing to this CSV file.")
+        parser.add_argument('--dry-run', action='store_true', help="Match without settling anything.")
+
+    def handle(self, *args, **options):
+        path = options['statement']
+        statement_format = options['format'] or ('camt' if path.lower().endswith('.xml') else 'csv')
+        started = time.monotonic()
+        report = open(options['unmatched'], 'w', newline='') if options['unmatched'] else None
+        try:
+            unmatched = None
+            if report:
+                writer = csv.writer(report)
+                writer.writerow(['line', 'reason', 'reference', 'amount', 'currency', 'entry_id', 'text'])
+                unmatched = lambda line, reason: writer.writerow([line.line, reason, line.reference, line.amount, line.currency, line.entry_id, line.text])
+            if statement_format == 'camt':
+                with open(path, 'rb') as stream:
+                    counts = reconcile(read_camt(stream), options['dry_run'], unmatched)
+            else:
+                with open(path, newline='', encoding=options['encoding']) as stream:
+                    lines = read_csv(
+                        stream, options['reference_column'], options['amount_column'], options['currency_column'],
+                        options['entry_column'], options['text_column'], options['delimiter'],
+                    )
+                    counts = reconcile(lines, options['dry_run'], unmatched)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        finally:
+            if report:
+                report.close()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{counts['lines']} lines in {elapsed:.1f}s: {counts['matched']} matched, {counts['settled']} settled"
+            f"{' (dry run)' if options['dry_run'] else ''}, {counts['amount_mismatch']} amount mismatches, "
+            f"{counts['duplicate']} duplicates, {counts['unknown']} unknown references, {counts['skipped']} skipped."
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.ledger import stock_drift
+from store.models import BusinessLocation, Product
+
+class Command(BaseCommand):
+    help = "Report where Product.stock or Inventory quantities differ from the stock ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-drift', action='store_true', help="Exit with an error if any drift is found.")
+
+    def handle(self, *args, **options):
+        drift = stock_drift()
+        products = Product.objects.in_bulk({row[0] for row in drift})
+        locations = BusinessLocation.objects.in_bulk({row[1] for row in drift if row[1] is not None})
+        for product_id, location_id, ledger, recorded in drift:
+            product = products.get(product_id, f"product #{product_id}")
+            where = locations.get(location_id, f"location #{location_id}") if location_id is not None else "all locations"
+            self.stdout.write(f"{product} at {where}: ledger {ledger}, recorded {recorded} ({recorded - ledger:+d})")
+        self.stdout.write(f"{len(drift)} drifting balance(s).")
+        if drift and options['fail_on_drift']:
+            raise CommandError("Stock balances drift from the ledger.")
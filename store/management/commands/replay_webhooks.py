@@ -0,0 +1,99 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from store.gateways import post
+from store.jobs import percentile
+from store.models import PaymentTransaction, WebhookEvent
+from store.webhooks import sign
+
+class Command(BaseCommand):
+    help = ("Fire a recorded stream of payment webhook events (one JSON event per line) at a webhook "
+            "endpoint and report its throughput. --record and --synthesize write such streams.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('stream', help="JSON lines file of events to send, or to write with --record/--synthesize.")
+        parser.add_argument('--url', default='http://127.0.0.1:8000/webhooks/payments/{gateway}/')
+        parser.add_argument('--gateway', default='stripe', help="Gateway name (as in PaymentTransaction.gateway); its secret comes from PAYMENT_WEBHOOK_SECRETS.")
+        parser.add_argument('--secret', help="Signing secret, instead of the configured one.")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight.")
+        parser.add_argument('--shuffle', action='store_true', help="Send the events out of order.")
+        parser.add_argument('--duplicate-rate', type=float, default=0.0, help="Fraction of events sent twice.")
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--record', action='store_true', help="Write the gateway's stored events to the stream file instead of sending.")
+        parser.add_argument('--synthesize', type=int, metavar='N',
+                            help="Write events settling up to N of the gateway's authorizing or pending payments to the stream file instead of sending.")
+
+    def handle(self, *args, **options):
+        if options['record']:
+            return self.write(options['stream'], (
+                payload for payload in WebhookEvent.objects.filter(gateway=options['gateway'])
+                .order_by('id').values_list('payload', flat=True).iterator()
+            ))
+        if options['synthesize']:
+            return self.write(options['stream'], self.synthesize(options['gateway'], options['synthesize']))
+        secret = options['secret'] or settings.PAYMENT_WEBHOOK_SECRETS.get(options['gateway'])
+        if not secret:
+            raise CommandError(f"No webhook secret for {options['gateway']!r}; pass --secret.")
+        try:
+            with open(options['stream'], 'rb') as stream:
+                bodies = [line.strip() for line in stream if line.strip()]
+        except OSError as e:
+            raise CommandError(str(e))
+        shuffler = random.Random(options['seed'])
+        bodies += [body for body in bodies if shuffler.random() < options['duplicate_rate']]
+        if options['shuffle']:
+            shuffler.shuffle(bodies)
+        url = options['url'].format(gateway=options['gateway'])
+        started = time.monotonic()
+        results = asyncio.run(self.send(url, secret, bodies, options['concurrency']))
+        elapsed = time.monotonic() - started
+        statuses = Counter(status for status, latency in results)
+        latencies = [latency for status, latency in results]
+        self.stdout.write(
+            f"Sent {len(bodies)} event(s) in {elapsed:.1f}s ({len(bodies) / max(elapsed, 1e-9):.0f}/s); "
+            f"responses {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items(), key=str))}; "
+            f"latency mean {sum(latencies) / max(len(latencies), 1) * 1000:.0f}ms, p95 {(percentile(latencies, 0.95) or 0) * 1000:.0f}ms."
+        )
+
+    async def send(self, url, secret, bodies, concurrency):
+        # (HTTP status or the connection error's name, seconds) per body
+        limit = asyncio.Semaphore(concurrency)
+
+        async def deliver(body):
+            async with limit:
+                started = time.monotonic()
+                try:
+                    status, content = await post(url, body, {'X-Signature': sign(secret, body)})
+                except (OSError, ValueError) as e:
+                    status = type(e).__name__
+                return status, time.monotonic() - started
+
+        return await asyncio.gather(*(deliver(body) for body in bodies))
+
+    def synthesize(self, gateway, count):
+        # Bank payments get a pending then a completed event, card payments a completed one
+        now = time.time()
+        payments = PaymentTransaction.objects.filter(gateway=gateway, status__in=['authorizing', 'pending']).order_by('pk')[:count]
+        types = ['payment.pending', 'payment.completed'] if gateway == 'bank_transfer' else ['payment.completed']
+        for index, transaction_id in enumerate(payments.values_list('transaction_id', flat=True)):
+            for step, event_type in enumerate(types):
+                yield {
+                    'id': f"evt_{uuid.uuid4().hex}",
+                    'type': event_type,
+                    'transaction_id': transaction_id,
+                    'created': round(now + index * 0.001 + step, 3),
+                    'reference': f"replay_{index}",
+                }
+
+    def write(self, path, payloads):
+        written = 0
+        with open(path, 'w') as stream:
+            for payload in payloads:
+                stream.write(json.dumps(payload) + '\n')
+                written += 1
+        self.stdout.write(f"Wrote {written} event(s) to {path}.")
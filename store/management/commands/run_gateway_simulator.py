@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from store.gateways import SimulatorServer
+
+class Command(BaseCommand):
+    help = ("Serve a local payment gateway for development and tests. Point PAYMENT_GATEWAY_URL at it "
+            "to send payments to it from run_workers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds every authorization takes.")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many extra seconds per authorization.")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 503.")
+        parser.add_argument('--decline-rate', type=float, default=0.0, help="Fraction of authorizations declined.")
+        parser.add_argument('--seed', type=int, help="Seed for repeatable failures and declines.")
+        parser.add_argument('--chunked', action='store_true', help="Reply with Transfer-Encoding: chunked.")
+
+    def handle(self, *args, **options):
+        server = SimulatorServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            jitter=options['jitter'],
+            failure_rate=options['failure_rate'],
+            decline_rate=options['decline_rate'],
+            seed=options['seed'],
+            chunked=options['chunked'],
+        )
+        self.stdout.write(f"Gateway simulator on http://{options['host']}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
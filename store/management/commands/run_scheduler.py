@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from store.scheduler import TASKS, tick
+
+class Command(BaseCommand):
+    help = ("Start due periodic tasks on the job queue. run_workers already does this; use this command "
+            "to schedule from a separate process, or --once from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run a single tick and exit.")
+        parser.add_argument('--list', action='store_true', help="List the registered tasks and their next tick.")
+        parser.add_argument('--interval', type=float, default=15.0, help="Seconds between ticks.")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            now = timezone.now()
+            for name, task in sorted(TASKS.items()):
+                upcoming = task.cron.next(now)
+                self.stdout.write(f"{name:<24} {task.cron.expression:<16} next {timezone.localtime(upcoming):%Y-%m-%d %H:%M}" if upcoming
+                                  else f"{name:<24} {task.cron.expression:<16} never")
+            return
+        while True:
+            for run in tick():
+                self.stdout.write(f"{run.task}: {run.status} for {timezone.localtime(run.scheduled_for):%Y-%m-%d %H:%M}")
+            if options['once']:
+                return
+            connection.close()
+            time.sleep(options['interval'])
@@ -0,0 +1,52 @@
+import multiprocessing
+import signal
+from django.core.management.base import BaseCommand
+from django.db import connections
+from store.jobs import JOBS, run_pool
+from store.scheduler import tick
+
+class Command(BaseCommand):
+    help = "Run background job workers: --processes worker processes with --threads threads each."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--threads', type=int, default=2, help="Worker threads per process.")
+        parser.add_argument('--queue', action='append', dest='names', choices=sorted(JOBS),
+                            help="Only run jobs of this name; repeat for several. Defaults to all jobs.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds an idle worker waits before polling again.")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due instead of polling.")
+        parser.add_argument('--no-scheduler', action='store_true',
+                            help="Do not start periodic tasks from these workers (e.g. when run_scheduler runs separately).")
+
+    def handle(self, *args, **options):
+        pool_options = {
+            'threads': options['threads'],
+            'names': options['names'],
+            'poll_interval': options['poll_interval'],
+            'burst': options['burst'],
+            'periodic': None if options['no_scheduler'] or options['burst'] else tick,
+        }
+        self.stdout.write(f"Starting {options['processes']} worker process(es) with {options['threads']} thread(s) each.")
+        if options['processes'] == 1:
+            run_pool(**pool_options)
+        else:
+            # Forked children must open their own database connections
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            processes = [
+                context.Process(target=run_pool, kwargs={**pool_options, 'housekeeping': index == 0}, name=f"job-worker-process-{index}")
+                for index in range(options['processes'])
+            ]
+            for process in processes:
+                process.start()
+            # Children finish their current jobs on SIGTERM; the parent passes shutdown requests on
+            def stop(signum, frame):
+                for process in processes:
+                    if process.is_alive():
+                        process.terminate()
+
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, stop)
+            for process in processes:
+                process.join()
+        self.stdout.write("Workers stopped.")
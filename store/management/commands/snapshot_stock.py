@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.ledger import take_baseline, take_snapshot
+
+class Command(BaseCommand):
+    help = "Snapshot on-hand stock from the ledger. Run periodically so on-hand reads only replay a short ledger tail."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', action='store_true',
+                            help="Open an empty ledger from the current Product.stock and Inventory quantities.")
+        parser.add_argument('--keep', type=int, default=7, help="Snapshot runs to keep; older runs are deleted.")
+
+    def handle(self, *args, **options):
+        if options['baseline']:
+            try:
+                movements = take_baseline()
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f"Recorded {len(movements)} opening ledger row(s).")
+        written = take_snapshot(keep=options['keep'])
+        self.stdout.write(f"Wrote {written} snapshot row(s).")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.ledger import transfer_stock
+from store.models import BusinessLocation, Product
+
+class Command(BaseCommand):
+    help = "Move product stock between locations, or between a location and unassigned stock, through the ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product', type=int, help="Product id.")
+        parser.add_argument('quantity', type=int)
+        parser.add_argument('--from', dest='source', type=int, help="Source location id; omit for unassigned stock.")
+        parser.add_argument('--to', dest='destination', type=int, help="Destination location id; omit for unassigned stock.")
+        parser.add_argument('--reference', default='')
+
+    def handle(self, *args, **options):
+        if options['quantity'] <= 0 or options['source'] == options['destination']:
+            raise CommandError("Give a positive quantity and two different locations.")
+        try:
+            product = Product.objects.get(pk=options['product'])
+            source = BusinessLocation.objects.get(pk=options['source']) if options['source'] else None
+            destination = BusinessLocation.objects.get(pk=options['destination']) if options['destination'] else None
+        except (Product.DoesNotExist, BusinessLocation.DoesNotExist) as exc:
+            raise CommandError(str(exc))
+        try:
+            transfer_stock(product, options['quantity'], source, destination, reference=options['reference'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(f"Moved {options['quantity']} x {product} from {source or 'unassigned'} to {destination or 'unassigned'}.")
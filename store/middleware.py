@@ -0,0 +1,99 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date, urlencode
+from .caching import catalog_version, make_etag
+
+# Full-page cache for anonymous GETs of pages that render the same for every logged-out visitor.
+# It sits in front of the session, auth and message middleware and decides from cookies alone,
+# so a hit costs two cache reads and no database query. Keys include the catalog version, which
+# store.signals bumps on every relevant model change. Concurrent misses for the same key are
+# coalesced: one request renders while the others wait briefly for its result.
+class AnonymousPageCacheMiddleware:
+    cached_url_names = {'user_dashboard', 'product_list', 'product_detail', 'static_page'}
+    cached_static_pages = {
+        'about', 'faq', 'farming_experience', 'types_of_farming',
+        'annual_report', 'harvest_report', 'annual_cultivation',
+    }
+    cached_headers = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+    lock_timeout = 10
+    wait_timeout = 5
+    wait_interval = 0.05
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+
+    def __call__(self, request):
+        if not self.is_cacheable_request(request):
+            return self.get_response(request)
+
+        key = self.cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            lock_key = f'{key}:lock'
+            if cache.add(lock_key, 1, self.lock_timeout):
+                try:
+                    response = self.get_response(request)
+                    self.store(key, request, response)
+                finally:
+                    cache.delete(lock_key)
+                return response
+            entry = self.wait_for(key)
+            if entry is None:
+                return self.get_response(request)
+        return self.cached_response(request, entry)
+
+    def is_cacheable_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        # Any session or flash-message cookie may carry per-visitor state
+        if settings.SESSION_COOKIE_NAME in request.COOKIES or 'messages' in request.COOKIES:
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        if match.url_name not in self.cached_url_names:
+            return False
+        return match.url_name != 'static_page' or match.kwargs.get('page') in self.cached_static_pages
+
+    def cache_key(self, request):
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        return f'page:{make_etag(request.path, query, catalog_version())}'
+
+    def wait_for(self, key):
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.wait_interval)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def store(self, key, request, response):
+        # Pages that issued a CSRF token or set cookies are visitor specific
+        if (response.status_code != 200 or response.streaming or response.cookies
+                or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')):
+            return
+        headers = {name: response[name] for name in self.cached_headers if response.has_header(name)}
+        cache.set(key, {'content': response.content, 'headers': headers}, self.timeout)
+
+    def cached_response(self, request, entry):
+        headers = entry['headers']
+        last_modified = headers.get('Last-Modified')
+        response = get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=parse_http_date(last_modified) if last_modified else None,
+        )
+        if response is None:
+            response = HttpResponse(entry['content'])
+        for name, value in headers.items():
+            if response.status_code == 200 or name != 'Content-Type':
+                response[name] = value
+        response['X-Page-Cache'] = 'hit'
+        return response
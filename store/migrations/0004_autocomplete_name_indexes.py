@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-19 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='businesslocation',
+            index=models.Index(fields=['name'], name='store_busin_name_ed38e9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farmtool',
+            index=models.Index(fields=['name'], name='store_farmt_name_973d9b_idx'),
+        ),
+    ]
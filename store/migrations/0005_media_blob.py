@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-19 07:24
+
+import store.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_autocomplete_name_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=store.storage.ContentAddressedStorage(), upload_to='products/'),
+        ),
+        migrations.AlterField(
+            model_name='reportexport',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=store.storage.ContentAddressedStorage(), upload_to='reports/'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, storage=store.storage.ContentAddressedStorage(), upload_to='profiles/'),
+        ),
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('ref_count__lte', 0)), fields=['created_at'], name='mediablob_orphan_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-19 07:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_stock_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('location', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocations', to='store.businesslocation')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='store.order')),
+                ('order_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='store.orderitem')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['location', 'order'], name='store_order_locatio_a2229a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-19 07:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def raise_existing_alerts(apps, schema_editor):
+    # Products already low when the feature ships are listed on the dashboard without a notification
+    Product = apps.get_model('store', 'Product')
+    StockAlert = apps.get_model('store', 'StockAlert')
+    now = timezone.now()
+    low = Product.objects.filter(is_active=True, stock__lte=models.F('reorder_point'))
+    StockAlert.objects.bulk_create([
+        StockAlert(product_id=pk, stock=stock, reorder_point=point, notified_at=now)
+        for pk, stock, point in low.values_list('pk', 'stock', 'reorder_point').iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.PositiveIntegerField()),
+                ('reorder_point', models.PositiveIntegerField()),
+                ('raised_at', models.DateTimeField(auto_now_add=True)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reorder_point',
+            field=models.PositiveIntegerField(default=10),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('stock__lte', models.F('reorder_point'))), fields=['stock'], name='product_low_stock_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='product',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alert', to='store.product'),
+        ),
+        migrations.AddIndex(
+            model_name='stockalert',
+            index=models.Index(condition=models.Q(('notified_at__isnull', True)), fields=['raised_at'], name='stockalert_pending_idx'),
+        ),
+        migrations.RunPython(raise_existing_alerts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-19 07:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_reorder_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplenishmentSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('daily_demand', models.FloatField()),
+                ('on_hand', models.IntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('reorder_date', models.DateField()),
+                ('computed_at', models.DateTimeField()),
+                ('location', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replenishment_suggestions', to='store.businesslocation')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='replenishment_suggestions', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['reorder_date'], name='store_reple_reorder_b0bd33_idx')],
+                'unique_together': {('product', 'location')},
+            },
+        ),
+    ]
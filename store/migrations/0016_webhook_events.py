@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-19 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_payment_authorization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymenttransaction',
+            name='gateway_event_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway', models.CharField(max_length=50)),
+                ('event_id', models.CharField(max_length=100)),
+                ('event_type', models.CharField(max_length=50)),
+                ('transaction_id', models.CharField(max_length=100)),
+                ('occurred_at', models.DateTimeField()),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('outcome', models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='store_webho_process_b792f5_idx'), models.Index(fields=['transaction_id', 'occurred_at'], name='store_webho_transac_d0d77d_idx')],
+                'unique_together': {('gateway', 'event_id')},
+            },
+        ),
+    ]
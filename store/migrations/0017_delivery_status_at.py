@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_webhook_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliverytracking',
+            name='status_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
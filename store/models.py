@@ -4,6 +4,7 @@ from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from decimal import Decimal
+from .storage import media_storage
 
 # Category for organizing products
 class Category(models.Model):
@@ -25,7 +26,8 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     stock = models.PositiveIntegerField()
-    image = models.ImageField(upload_to='products/', null=True, blank=True)
+    reorder_point = models.PositiveIntegerField(default=10)
+    image = models.ImageField(upload_to='products/', storage=media_storage, null=True, blank=True)
     weight = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -34,6 +36,9 @@ class Product(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['name', 'category']),
+            models.Index(fields=['id'], condition=models.Q(is_active=True), name='product_active_id_idx'),
+            models.Index(fields=['stock'], condition=models.Q(is_active=True, stock__lte=models.F('reorder_point')),
+                         name='product_low_stock_idx'),
         ]
 
     def __str__(self):
@@ -64,6 +69,11 @@ class BusinessLocation(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name']),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.city}, {self.country}"
 
@@ -93,7 +103,7 @@ class UserProfile(models.Model):
     city = models.CharField(max_length=100, blank=True)
     country = models.CharField(max_length=100, blank=True)
     postal_code = models.CharField(max_length=20, blank=True)
-    profile_picture = models.ImageField(upload_to='profiles/', null=True, blank=True)
+    profile_picture = models.ImageField(upload_to='profiles/', storage=media_storage, null=True, blank=True)
     is_verified = models.BooleanField(default=False)
     preferred_currency = models.CharField(max_length=3, default='USD')
     bio = models.TextField(blank=True, null=True)
@@ -137,6 +147,7 @@ class Order(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['user', 'status', 'ordered_at']),
+            models.Index(fields=['status', 'ordered_at']),
         ]
 
     def __str__(self):
@@ -157,6 +168,22 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.quantity} x {self.product.name} (Order {self.order.id})"
 
+# Order Allocation (units of an order line shipped from one location; a split line has several)
+class OrderAllocation(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='allocations')
+    order_item = models.ForeignKey(OrderItem, on_delete=models.CASCADE, related_name='allocations')
+    location = models.ForeignKey(BusinessLocation, on_delete=models.SET_NULL, null=True, related_name='allocations')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['location', 'order']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.order_item.product.name} from {self.location} (Order {self.order_id})"
+
 # Delivery Tracking
 class DeliveryTracking(models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='delivery')
@@ -170,9 +197,16 @@ class DeliveryTracking(models.Model):
         ('failed', 'Failed'),
     ], default='preparing')
     estimated_delivery = models.DateTimeField(null=True, blank=True)
+    # Carrier time of the event that set status, so an older feed event cannot override it
+    status_at = models.DateTimeField(null=True, blank=True)
     last_updated = models.DateTimeField(auto_now=True)
     notes = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status']),
+        ]
+
     def __str__(self):
         return f"Tracking for Order {self.order.id}"
 
@@ -229,6 +263,7 @@ class ProfitLoss(models.Model):
 # Payment Transaction
 class PaymentTransaction(models.Model):
     PAYMENT_STATUS = [
+        ('authorizing', 'Authorizing'),
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -246,8 +281,15 @@ class PaymentTransaction(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     currency = models.CharField(max_length=3, default='USD')
     gateway = models.CharField(max_length=20, choices=GATEWAY_CHOICES)
+    payment_method = models.CharField(max_length=20, blank=True)
     transaction_id = models.CharField(max_length=100, unique=True)
     status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='pending')
+    # Set by the gateway's decision; attempts counts authorization requests that got no decision
+    gateway_reference = models.CharField(max_length=100, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Gateway time of the last webhook event applied, so an older one cannot override it
+    gateway_event_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -259,6 +301,47 @@ class PaymentTransaction(models.Model):
     def __str__(self):
         return f"Payment {self.transaction_id} for Order {self.order.id}"
 
+# Webhook Event (payment status change reported by a gateway, stored as received and applied later
+# by the payments.webhooks job; the unique key drops redelivered events)
+class WebhookEvent(models.Model):
+    gateway = models.CharField(max_length=50)
+    event_id = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=50)
+    transaction_id = models.CharField(max_length=100)
+    occurred_at = models.DateTimeField()
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        unique_together = ('gateway', 'event_id')
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+            models.Index(fields=['transaction_id', 'occurred_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.gateway} {self.event_type} {self.event_id}"
+
+# Idempotency Key (issued with a form, claimed by the request that submits it and stored with that
+# request's result, so a resubmission replays the result instead of repeating the work)
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=64)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'scope', 'key')
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} key {self.key} of {self.user}"
+
 # Product Review
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
@@ -270,6 +353,9 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ['product', 'user']
+        indexes = [
+            models.Index(fields=['product', '-created_at'], condition=models.Q(is_approved=True), name='review_approved_product_idx'),
+        ]
 
     def __str__(self):
         return f"{self.rating} stars for {self.product.name} by {self.user.username}"
@@ -316,6 +402,11 @@ class Notification(models.Model):
         ('system', 'System'),
     ])
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+
     def __str__(self):
         return f"Notification for {self.user.username}: {self.message[:50]}"
 
@@ -356,6 +447,7 @@ class FarmTool(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['serial_number', 'tool_type']),
+            models.Index(fields=['name']),
         ]
 
     def __str__(self):
@@ -369,6 +461,7 @@ class ToolMaintenance(models.Model):
     cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     performed_by = models.CharField(max_length=100, blank=True)
     next_maintenance = models.DateTimeField(null=True, blank=True)
+    overdue_flagged_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -622,7 +715,7 @@ class ReportExport(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='report_exports')
     export_format = models.CharField(max_length=10, choices=EXPORT_FORMAT_CHOICES)
     status = models.CharField(max_length=20, choices=EXPORT_STATUS_CHOICES, default='pending')
-    file = models.FileField(upload_to='reports/', null=True, blank=True)
+    file = models.FileField(upload_to='reports/', storage=media_storage, null=True, blank=True)
     title = models.CharField(max_length=200)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -645,4 +738,209 @@ class Cart(models.Model):
         unique_together = ['user', 'product']
 
     def __str__(self):
-        return f"{self.user.username}'s cart: {self.product.name} x {self.quantity}"
\ No newline at end of file
+        return f"{self.user.username}'s cart: {self.product.name} x {self.quantity}"
+
+# Stock Hold (soft reservation of a cart line while its checkout is in progress)
+class StockHold(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_holds')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['user', 'product']
+        indexes = [
+            models.Index(fields=['product', 'expires_at']),
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} holds {self.quantity} x {self.product.name} until {self.expires_at}"
+
+# Stock Movement (append-only ledger of every change to on-hand stock; location null means stock
+# not assigned to a location)
+class StockMovement(models.Model):
+    KIND_CHOICES = [
+        ('sale', 'Sale'),
+        ('restock', 'Restock'),
+        ('adjustment', 'Adjustment'),
+        ('transfer', 'Transfer'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    location = models.ForeignKey(BusinessLocation, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    reference = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'location', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} x {self.product.name} at {self.location or 'unassigned'}"
+
+# Stock Snapshot (on-hand stock per product and location as of ledger row last_movement_id)
+class StockSnapshot(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_snapshots')
+    location = models.ForeignKey(BusinessLocation, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_snapshots')
+    on_hand = models.IntegerField()
+    last_movement_id = models.BigIntegerField()
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_movement_id', 'product']),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} at {self.location or 'unassigned'}: {self.on_hand} ({self.taken_at})"
+
+# Stock Alert (one row per active product at or below its reorder point; unnotified rows are
+# pending threshold-crossing events)
+class StockAlert(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='stock_alert')
+    stock = models.PositiveIntegerField()
+    reorder_point = models.PositiveIntegerField()
+    raised_at = models.DateTimeField(auto_now_add=True)
+    notified_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['raised_at'], condition=models.Q(notified_at__isnull=True), name='stockalert_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name}: {self.stock} left (reorder at {self.reorder_point})"
+
+# Replenishment Suggestion (forecast daily demand and the order to place per product and location;
+# location null means stock not assigned to a location). Rewritten by each forecast run.
+class ReplenishmentSuggestion(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='replenishment_suggestions')
+    location = models.ForeignKey(BusinessLocation, on_delete=models.CASCADE, null=True, blank=True, related_name='replenishment_suggestions')
+    daily_demand = models.FloatField()
+    on_hand = models.IntegerField()
+    quantity = models.PositiveIntegerField()
+    reorder_date = models.DateField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['product', 'location']
+        indexes = [
+            models.Index(fields=['reorder_date']),
+        ]
+
+    def __str__(self):
+        return f"Reorder {self.quantity} x {self.product.name} for {self.location or 'unassigned'} by {self.reorder_date}"
+
+# Outbox Event (side effect recorded in the transaction that caused it and applied later by the
+# drain_outbox worker; processed_at is set in the transaction that applies it)
+class OutboxEvent(models.Model):
+    TOPIC_CHOICES = [
+        ('order.placed', 'Order Placed'),
+    ]
+
+    topic = models.CharField(max_length=50, choices=TOPIC_CHOICES)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'], condition=models.Q(processed_at__isnull=True), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk} ({'processed' if self.processed_at else f'{self.attempts} attempt(s)'})"
+
+# Job (deferred call of a registered background job, run by the run_workers command; higher
+# priority runs first, and failed attempts are requeued at a later run_at until max_attempts)
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-priority', 'run_at', 'id'], condition=models.Q(status='queued'), name='job_queued_idx'),
+            models.Index(fields=['started_at'], condition=models.Q(status='running'), name='job_running_idx'),
+            models.Index(fields=['finished_at', 'name']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+# Lease (named lock held by one process until expires_at unless renewed, e.g. the scheduler's)
+class Lease(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    owner = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.owner or 'nobody'} until {self.expires_at}"
+
+# Periodic Run (one tick of a scheduled task; the unique key lets each tick start only once)
+class PeriodicRun(models.Model):
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),
+    ]
+
+    task = models.CharField(max_length=100)
+    scheduled_for = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['task', 'scheduled_for']
+        indexes = [
+            models.Index(fields=['task', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.task} at {self.scheduled_for} ({self.status})"
+
+# Media Blob (one row per unique file kept by ContentAddressedStorage)
+class MediaBlob(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(ref_count__lte=0), name='mediablob_orphan_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
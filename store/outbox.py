@@ -0,0 +1,88 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .jobs import enqueue, job
+from .models import Customer, DeliveryTracking, Notification, Order, OutboxEvent
+
+# Transactional outbox. publish() adds one row inside the caller's transaction, so an event exists
+# exactly when the change that caused it commits, and its side effects run later in drain_outbox,
+# outside the caller's locks. Each event is applied in a savepoint together with setting its
+# processed_at, so a retry never applies it twice; a failing event is retried with exponential
+# backoff from OUTBOX_RETRY_DELAY until it has made OUTBOX_MAX_ATTEMPTS attempts.
+
+HANDLERS = {}
+
+def handles(topic):
+    # Registers the decorated function as the handler of topic; it receives the event payload
+    def register(func):
+        HANDLERS[topic] = func
+        return func
+    return register
+
+def publish(topic, **payload):
+    # Workers drain the event once the caller commits; retries are picked up by the drain_outbox command
+    event = OutboxEvent.objects.create(topic=topic, payload=payload)
+    enqueue('outbox.drain', unique=True)
+    return event
+
+@handles('order.placed')
+def apply_order_placed(payload):
+    order = Order.objects.get(pk=payload['order_id'])
+    Notification.objects.create(
+        user_id=order.user_id,
+        message=f"Order #{order.id} placed successfully!",
+        type='order_update',
+        order=order
+    )
+    DeliveryTracking.objects.get_or_create(order=order, defaults={
+        'tracking_number': f"TRK{order.id}{int(order.ordered_at.timestamp())}",
+        'carrier': "Default Carrier",
+        'status': 'preparing',
+    })
+    # 1 loyalty point per $10
+    customer, created = Customer.objects.get_or_create(user_id=order.user_id)
+    updates = {'loyalty_points': F('loyalty_points') + int(order.total_price // 10), 'last_purchase': order.ordered_at}
+    if payload.get('payment_method') is not None:
+        updates['preferred_payment_method'] = payload['payment_method']
+    Customer.objects.filter(pk=customer.pk).update(**updates)
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+def pending_events():
+    return OutboxEvent.objects.filter(processed_at__isnull=True, attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+
+def drain_batch(batch_size=100):
+    # Applies up to batch_size due events; returns (processed, failed). Rows another worker has
+    # locked are skipped on databases that support it.
+    processed = failed = 0
+    with transaction.atomic():
+        events = list(pending_events().select_for_update(skip_locked=True)
+                      .filter(available_at__lte=timezone.now()).order_by('available_at', 'id')[:batch_size])
+        for event in events:
+            try:
+                with transaction.atomic():
+                    HANDLERS[event.topic](event.payload)
+                    event.processed_at = timezone.now()
+                    event.save(update_fields=['processed_at'])
+                processed += 1
+            except Exception as e:
+                event.attempts += 1
+                event.last_error = f"{type(e).__name__}: {e}"
+                event.available_at = timezone.now() + retry_delay(event.attempts)
+                event.save(update_fields=['attempts', 'last_error', 'available_at'])
+                failed += 1
+    return processed, failed
+
+@job('outbox.drain', priority=10)
+def drain_outbox(batch_size=100):
+    # Drains every due event; failed events are rescheduled into the future, so this terminates
+    processed = failed = 0
+    while True:
+        done, errors = drain_batch(batch_size)
+        processed += done
+        failed += errors
+        if done + errors < batch_size:
+            return processed, failed
@@ -0,0 +1,78 @@
+import asyncio
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .gateways import GatewayError, authorize_all
+from .jobs import job
+from .models import Notification, Order, PaymentTransaction
+
+# Payment authorization. PaymentView records a payment as 'authorizing' and queues
+# 'payments.authorize', which sends every authorizing payment to its gateway concurrently, outside
+# any database transaction, and applies each decision in a short transaction of its own. Decisions
+# the gateway sends later (a bank confirming a transfer) go through apply_authorization as well.
+# A request that got no decision is retried by the next run, at the latest the scheduler's a
+# minute later, until the payment has made PAYMENT_MAX_ATTEMPTS attempts.
+
+# Payment statuses only move up this order, so a late or repeated decision cannot undo a newer one
+STATUS_RANK = {'authorizing': 0, 'pending': 1, 'completed': 2, 'failed': 2, 'refunded': 3}
+
+def status_message(order_id, status, message=''):
+    # The customer notification for a payment of order_id reaching status
+    if status == 'completed':
+        return f"Payment for Order #{order_id} was confirmed."
+    if status == 'pending':
+        return f"Payment for Order #{order_id} is awaiting confirmation from the bank."
+    if status == 'refunded':
+        return f"Payment for Order #{order_id} was refunded."
+    return f"Payment for Order #{order_id} failed: {message or 'declined by the gateway.'} Please try again."
+
+def authorization_request(payment):
+    return {
+        'transaction_id': payment.transaction_id,
+        'amount': str(payment.amount),
+        'currency': payment.currency,
+        'method': payment.payment_method or payment.gateway,
+    }
+
+@job('payments.authorize', priority=8)
+def authorize_payments(batch_size=50):
+    # Returns (decided, undecided)
+    decided = undecided = last_id = 0
+    while True:
+        payments = list(PaymentTransaction.objects.filter(status='authorizing', pk__gt=last_id).order_by('pk')[:batch_size])
+        if not payments:
+            return decided, undecided
+        last_id = payments[-1].pk
+        outcomes = asyncio.run(authorize_all([authorization_request(payment) for payment in payments]))
+        for payment, outcome in zip(payments, outcomes):
+            if isinstance(outcome, GatewayError):
+                record_gateway_error(payment, str(outcome))
+                undecided += 1
+            else:
+                apply_authorization(payment.transaction_id, outcome.status, outcome.reference, outcome.message)
+                decided += 1
+
+def record_gateway_error(payment, error):
+    PaymentTransaction.objects.filter(pk=payment.pk, status='authorizing').update(attempts=F('attempts') + 1, last_error=error)
+    if payment.attempts + 1 >= settings.PAYMENT_MAX_ATTEMPTS:
+        apply_authorization(payment.transaction_id, 'failed', message=f"The payment gateway is unavailable ({error}).")
+
+def apply_authorization(transaction_id, status, reference='', message=''):
+    # Moves an authorizing or pending payment to the gateway's decision and tells the customer;
+    # returns whether anything changed, so a repeated decision is applied once
+    with transaction.atomic():
+        payment = (PaymentTransaction.objects.select_for_update()
+                   .filter(transaction_id=transaction_id, status__in=['authorizing', 'pending']).first())
+        if payment is None or payment.status == status:
+            return False
+        payment.status = status
+        payment.gateway_reference = reference or payment.gateway_reference
+        payment.last_error = message if status == 'failed' else ''
+        payment.save(update_fields=['status', 'gateway_reference', 'last_error', 'updated_at'])
+        if status == 'completed':
+            Order.objects.filter(pk=payment.order_id, status='pending').update(status='processing')
+        Notification.objects.create(
+            user_id=payment.user_id, message=status_message(payment.order_id, status, message),
+            type='order_update', order_id=payment.order_id,
+        )
+    return True
@@ -0,0 +1,182 @@
+import csv
+import re
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from django.db import connection, transaction
+from django.utils import timezone
+from .caching import bump_user_version
+from .models import Notification, Order, PaymentTransaction
+
+# Bank statement reconciliation. A statement (CSV, or CAMT.053/054 XML) is read one entry at a
+# time and matched against an index of every pending bank transfer and SEPA Direct Debit payment,
+# loaded in one query and keyed by transaction id. An entry matches when its reference, or a
+# transaction id quoted in its remittance text, names a pending payment and the amounts (and
+# currencies, when the statement gives one) agree. Matched payments are completed and their orders
+# moved to processing with bulk updates, CHUNK_SIZE payments per transaction.
+
+StatementLine = namedtuple('StatementLine', ['line', 'reference', 'amount', 'currency', 'entry_id', 'text'])
+
+CHUNK_SIZE = 2000
+
+SETTLE_SQL = "UPDATE {table} SET status = 'completed', gateway_reference = %s, updated_at = %s WHERE id = %s AND status = 'pending'"
+
+TRANSACTION_ID = re.compile(r'txn_(?:sct|sdd)_\d+_[0-9a-f]{32}', re.IGNORECASE)
+
+def parse_amount(value):
+    # Amounts have at most two decimals, so the last separator is the decimal point unless three
+    # digits follow it or it occurs more than once: "1,234.50", "1.234,50", "1234,50" and "1,000"
+    # read as expected. Returns None when unreadable.
+    value = re.sub(r'[^\d,.\-]', '', value or '')
+    last = max(value.rfind(','), value.rfind('.'))
+    if last >= 0:
+        grouped = len(value) - last - 1 == 3 or value.count(value[last]) > 1
+        digits = re.sub(r'[,.]', '', value[:last])
+        value = digits + value[last + 1:] if grouped else f"{digits}.{value[last + 1:]}"
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+def read_csv(stream, reference_column='reference', amount_column='amount', currency_column='currency',
+             entry_column='entry_id', text_column='description', delimiter=','):
+    reader = csv.DictReader(stream, delimiter=delimiter)
+    missing = {reference_column, amount_column} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"The statement has no {', '.join(sorted(missing))} column.")
+    for number, row in enumerate(reader, start=2):
+        yield StatementLine(
+            number,
+            (row[reference_column] or '').strip(),
+            parse_amount(row[amount_column]),
+            (row.get(currency_column) or '').strip().upper(),
+            (row.get(entry_column) or '').strip(),
+            row.get(text_column) or '',
+        )
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def read_camt(stream):
+    # Credit entries of a CAMT.053/054 statement; a batch-booked entry yields one line per
+    # transaction detail, with the detail's own amount when it has one. Entries are dropped from
+    # the tree once read, so memory does not grow with the statement.
+    number = 0
+    parents = []
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if local_name(element.tag) != 'Ntry':
+            continue
+        number += 1
+        fields = {}
+        details = []
+        for child in element.iter():
+            name = local_name(child.tag)
+            if name == 'TxDtls':
+                details.append(child)
+            elif name in ('Amt', 'CdtDbtInd', 'NtryRef', 'AcctSvcrRef') and name not in fields:
+                fields[name] = child
+        credit = fields.get('CdtDbtInd') is None or fields['CdtDbtInd'].text == 'CRDT'
+        entry_id = next((fields[name].text for name in ('AcctSvcrRef', 'NtryRef') if name in fields), '') or ''
+        for detail in (details or [element]) if credit else []:
+            amount = None if details else fields.get('Amt')
+            reference = ''
+            texts = []
+            for child in detail.iter():
+                name = local_name(child.tag)
+                if name == 'Amt' and amount is None:
+                    amount = child
+                elif name == 'EndToEndId' and child.text and child.text != 'NOTPROVIDED':
+                    reference = child.text.strip()
+                elif name in ('Ustrd', 'Ref') and child.text:
+                    texts.append(child.text.strip())
+            amount = fields.get('Amt') if amount is None else amount
+            yield StatementLine(
+                number,
+                reference,
+                parse_amount(amount.text) if amount is not None else None,
+                (amount.get('Ccy') or '').upper() if amount is not None else '',
+                entry_id,
+                ' '.join(texts),
+            )
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+def pending_index():
+    # Pending bank payments by upper-cased transaction id: (pk, amount, currency, order_id, user_id)
+    rows = (PaymentTransaction.objects.filter(status='pending', gateway='bank_transfer')
+            .values_list('transaction_id', 'pk', 'amount', 'currency', 'order_id', 'user_id'))
+    return {transaction_id.upper(): rest for transaction_id, *rest in rows.iterator(chunk_size=10000)}
+
+def candidate_references(line):
+    references = [line.reference] if line.reference else []
+    references.extend(TRANSACTION_ID.findall(f"{line.reference} {line.text}"))
+    return {reference.upper() for reference in references}
+
+def settle(matches):
+    # Completes the matched payments still pending; matches is a list of (pk, order_id, user_id,
+    # entry_id). Returns the number of payments completed.
+    now = timezone.now()
+    with transaction.atomic():
+        pending = set(PaymentTransaction.objects.select_for_update()
+                      .filter(pk__in=[pk for pk, *rest in matches], status='pending').values_list('pk', flat=True))
+        settled = [match for match in matches if match[0] in pending]
+        # One prepared statement for the chunk; bulk_update's per-row CASE expressions cost more to
+        # build than the update itself
+        with connection.cursor() as cursor:
+            cursor.executemany(SETTLE_SQL.format(table=PaymentTransaction._meta.db_table), [
+                (entry_id[:100], now, pk) for pk, order_id, user_id, entry_id in settled
+            ])
+        Order.objects.filter(pk__in=[order_id for pk, order_id, user_id, entry_id in settled], status='pending').update(
+            status='processing', updated_at=now,
+        )
+        Notification.objects.bulk_create([
+            Notification(user_id=user_id, order_id=order_id, type='order_update',
+                         message=f"Payment for Order #{order_id} was received.")
+            for pk, order_id, user_id, entry_id in settled
+        ], batch_size=500)
+    # Bulk writes skip the signals that refresh each customer's cached pages
+    for user_id in {match[2] for match in settled}:
+        bump_user_version(user_id)
+    return len(settled)
+
+def reconcile(lines, dry_run=False, unmatched=None):
+    # Matches statement lines against pending payments and settles them; unmatched, if given, is
+    # called with (line, reason) for every line that settled nothing. Returns counts by outcome.
+    index = pending_index()
+    counts = {'lines': 0, 'matched': 0, 'settled': 0, 'amount_mismatch': 0, 'duplicate': 0, 'unknown': 0, 'skipped': 0}
+    seen = set()
+    chunk = []
+    for line in lines:
+        counts['lines'] += 1
+        if line.amount is None or line.amount <= 0:
+            outcome = 'skipped'
+        else:
+            outcome = 'unknown'
+            for reference in candidate_references(line):
+                payment = index.get(reference)
+                if payment is None:
+                    continue
+                pk, amount, currency, order_id, user_id = payment
+                if pk in seen:
+                    outcome = 'duplicate'
+                elif amount != line.amount or (line.currency and line.currency != currency):
+                    outcome = 'amount_mismatch'
+                else:
+                    outcome = 'matched'
+                    seen.add(pk)
+                    chunk.append((pk, order_id, user_id, line.entry_id))
+                    break
+        counts[outcome] += 1
+        if outcome != 'matched' and unmatched:
+            unmatched(line, outcome)
+        if len(chunk) >= CHUNK_SIZE:
+            counts['settled'] += 0 if dry_run else settle(chunk)
+            chunk = []
+    if chunk and not dry_run:
+        counts['settled'] += settle(chunk)
+    return counts
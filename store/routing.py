@@ -0,0 +1,153 @@
+from collections import defaultdict
+from django.db.models import Case, F, When
+from django.utils import timezone
+from .caching import bump_catalog_version
+from .alerts import refresh_stock_alerts
+from .ledger import record_movements
+from .models import BusinessLocation, Inventory, OrderAllocation, Product, StockMovement
+
+class AllocationError(Exception):
+    pass
+
+# In-memory view of per-location stock for the products of one order, plus each product's
+# unassigned stock: the part of Product.stock that no location holds (the ledger's location-less
+# bucket). It is loaded (and row locked) with one query for inventory and one for stock, and every
+# routing decision reads and reserves against it, so planning costs no query per line.
+class InventorySnapshot:
+    def __init__(self, product_ids):
+        rows = (Inventory.objects.select_for_update(of=('self',)).select_related('location')
+                .filter(product_id__in=product_ids).order_by('pk'))
+        self.rows = defaultdict(lambda: defaultdict(list))
+        self.locations = {}
+        located = defaultdict(int)
+        for row in rows:
+            if row.location_id is not None:
+                located[row.product_id] += row.quantity
+            if row.location is not None and row.location.is_active and row.quantity > 0:
+                self.rows[row.product_id][row.location_id].append(row)
+                self.locations[row.location_id] = row.location
+        stock = Product.objects.filter(pk__in=product_ids).values_list('pk', 'stock')
+        self.unassigned = {product_id: max(units - located[product_id], 0) for product_id, units in stock}
+
+    def available(self, product_id, location_id):
+        return sum(row.quantity for row in self.rows[product_id][location_id])
+
+    def take(self, product_id, location_id, quantity):
+        # Reserves quantity at the location; returns {inventory id: units taken}
+        taken = {}
+        for row in self.rows[product_id][location_id]:
+            units = min(row.quantity, quantity - sum(taken.values()))
+            if units:
+                row.quantity -= units
+                taken[row.pk] = units
+        return taken
+
+    def take_unassigned(self, product_id, quantity):
+        # Reserves up to quantity of the product's unassigned stock; returns the units taken
+        units = min(self.unassigned.get(product_id, 0), quantity)
+        self.unassigned[product_id] = self.unassigned.get(product_id, 0) - units
+        return units
+
+def distance(location, city, country):
+    # Coarse proximity rank: same city, same country, elsewhere
+    if location.country.strip().casefold() != country.strip().casefold():
+        return 2
+    return 0 if location.city.strip().casefold() == city.strip().casefold() else 1
+
+def plan_allocation(snapshot, demand, city, country):
+    # demand maps a line key to (product id, quantity, name); returns
+    # {line key: [(location id, inventory decrements, units)]}. A single location that can ship the
+    # whole order is preferred, nearest first; otherwise the location covering the most outstanding
+    # units is used until done. What no location holds comes from unassigned stock, planned with
+    # location id None.
+    locations = sorted(snapshot.locations.values(), key=lambda location: (distance(location, city, country), location.pk))
+    remaining = {key: quantity for key, (product_id, quantity, name) in demand.items()}
+    plan = defaultdict(list)
+
+    def covered(location):
+        return sum(min(snapshot.available(demand[key][0], location.pk), quantity) for key, quantity in remaining.items())
+
+    full = next((location for location in locations if covered(location) == sum(remaining.values())), None)
+    while remaining:
+        location = full or max(locations, key=lambda location: covered(location), default=None)
+        if location is None or covered(location) == 0:
+            for key, quantity in list(remaining.items()):
+                units = snapshot.take_unassigned(demand[key][0], quantity)
+                if units:
+                    plan[key].append((None, {}, units))
+                    remaining[key] -= units
+                    if not remaining[key]:
+                        del remaining[key]
+            if remaining:
+                names = ', '.join(demand[key][2] for key in remaining)
+                raise AllocationError(f"Not enough stock at our locations for: {names}.")
+            break
+        for key, quantity in list(remaining.items()):
+            product_id = demand[key][0]
+            units = min(snapshot.available(product_id, location.pk), quantity)
+            if units:
+                plan[key].append((location.pk, snapshot.take(product_id, location.pk, units), units))
+                remaining[key] -= units
+                if not remaining[key]:
+                    del remaining[key]
+    return plan
+
+def allocate_order(order, items):
+    # Routes the saved OrderItems of order to fulfilling locations, records OrderAllocation rows and
+    # sale ledger rows, and decrements Inventory and Product stock in one bulk UPDATE each. Must run inside the order's
+    # transaction; the stock columns' non-negative CHECK constraints reject any oversell.
+    snapshot = InventorySnapshot({item.product_id for item in items})
+    demand = {item.pk: (item.product_id, item.quantity, item.product.name) for item in items}
+    plan = plan_allocation(snapshot, demand, order.shipping_city, order.shipping_country)
+
+    units_by_location = defaultdict(int)
+    inventory_decrements = defaultdict(int)
+    allocations = []
+    movements = []
+    unassigned = []
+    for item in items:
+        for location_id, taken, units in plan[item.pk]:
+            if location_id is None:
+                unassigned.append((item, units))
+                continue
+            allocations.append(OrderAllocation(order=order, order_item=item, location_id=location_id, quantity=units))
+            movements.append(StockMovement(product_id=item.product_id, location_id=location_id, kind='sale',
+                                           quantity=-units, order=order))
+            units_by_location[location_id] += units
+            for inventory_id, count in taken.items():
+                inventory_decrements[inventory_id] += count
+
+    if unassigned:
+        # Unassigned stock ships from the order's main location, or the nearest one
+        fallback = max(units_by_location, key=units_by_location.get, default=None)
+        if fallback is None:
+            active = BusinessLocation.objects.filter(is_active=True)
+            nearest = min(active, key=lambda location: (distance(location, order.shipping_city, order.shipping_country), location.pk), default=None)
+            fallback = nearest.pk if nearest else None
+        for item, units in unassigned:
+            allocations.append(OrderAllocation(order=order, order_item=item, location_id=fallback, quantity=units))
+            # The units come out of the product's unassigned stock, not a location's inventory
+            movements.append(StockMovement(product_id=item.product_id, kind='sale', quantity=-units, order=order))
+            if fallback is not None:
+                units_by_location[fallback] += units
+
+    OrderAllocation.objects.bulk_create(allocations)
+    record_movements(movements)
+    if inventory_decrements:
+        Inventory.objects.filter(pk__in=inventory_decrements).update(quantity=Case(
+            *[When(pk=pk, then=F('quantity') - count) for pk, count in inventory_decrements.items()]
+        ))
+    product_decrements = defaultdict(int)
+    for item in items:
+        product_decrements[item.product_id] += item.quantity
+    # updated_at keys the cached product card fragments, which show the stock
+    Product.objects.filter(pk__in=product_decrements).update(stock=Case(
+        *[When(pk=pk, then=F('stock') - count) for pk, count in product_decrements.items()]
+    ), updated_at=timezone.now())
+    # Bulk updates bypass the model signals that refresh cached catalog pages
+    bump_catalog_version()
+    refresh_stock_alerts(product_decrements)
+
+    order.location_id = max(units_by_location, key=units_by_location.get, default=None)
+    order.save(update_fields=['location', 'updated_at'])
+    return allocations
@@ -0,0 +1,163 @@
+import os
+import socket
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .jobs import enqueue, job
+from .models import Lease, PeriodicRun
+
+# Periodic task scheduler. Tasks are registered in code with a five-field cron expression
+# (minute hour day-of-month month day-of-week, in TIME_ZONE) and started by tick(), which any
+# number of processes may call: only the holder of the 'scheduler' lease schedules, and the unique
+# (task, scheduled_for) key of PeriodicRun lets each tick start once even if two holders overlap
+# while a lease changes hands. A started run is handed to the job queue, which records its
+# duration and outcome; a task whose previous run is still going records the tick as skipped.
+
+PeriodicTask = namedtuple('PeriodicTask', ['func', 'cron'])
+
+TASKS = {}
+
+# Missed ticks older than this are not caught up; the next one is waited for instead
+CATCH_UP = timedelta(days=7)
+
+class Cron:
+    # Ranges of minute, hour, day of month, month and day of week (0 is Sunday; 7 is accepted too)
+    BOUNDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression {expression!r} must have five fields.")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self.parse(field, low, high) for field, (low, high) in zip(fields, self.BOUNDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        # As in cron, a restricted day of month and day of week match when either does
+        self.any_day = fields[2] != '*' and fields[4] != '*'
+
+    @staticmethod
+    def parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = (int(bound) for bound in span.split('-'))
+            else:
+                start = end = int(span)
+                if step:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError(f"Cron field {field!r} is outside {low}-{high}.")
+            if step and int(step) < 1:
+                raise ValueError(f"Cron field {field!r} has a step below 1.")
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    def matches(self, moment):
+        moment = timezone.localtime(moment)
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        return (
+            moment.minute in self.minutes and moment.hour in self.hours and moment.month in self.months
+            and ((day or weekday) if self.any_day else (day and weekday))
+        )
+
+    def latest(self, after, until):
+        # The latest matching minute in (after, until], or None
+        moment = until.replace(second=0, microsecond=0)
+        after = max(after, until - CATCH_UP)
+        while moment > after:
+            if self.matches(moment):
+                return moment
+            moment -= timedelta(minutes=1)
+        return None
+
+    def next(self, after):
+        # The first matching minute after after within a year, or None
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for _ in range(366 * 24 * 60):
+            if self.matches(moment):
+                return moment
+            moment += timedelta(minutes=1)
+        return None
+
+def periodic(name, cron):
+    # Registers the decorated function as the task name, run at every tick of cron
+    def register(func):
+        TASKS[name] = PeriodicTask(func, Cron(cron))
+        return func
+    return register
+
+def acquire_lease(name, owner, seconds):
+    # Takes or renews the named lease; returns whether owner holds it
+    now = timezone.now()
+    Lease.objects.get_or_create(name=name, defaults={'expires_at': now})
+    held = Q(owner=owner) | Q(expires_at__lte=now)
+    return Lease.objects.filter(held, name=name).update(owner=owner, expires_at=now + timedelta(seconds=seconds)) == 1
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def fail_lost_runs():
+    # Runs that never reported back (their job was lost or timed out) stop blocking their task
+    cutoff = timezone.now() - timedelta(seconds=settings.SCHEDULER_RUN_TIMEOUT)
+    return PeriodicRun.objects.filter(status='running', created_at__lt=cutoff).update(
+        status='failed', finished_at=timezone.now(), error=f"No result within {settings.SCHEDULER_RUN_TIMEOUT}s.",
+    )
+
+def tick(owner=None):
+    # Starts every task with a tick due since its last run; returns the runs recorded
+    if not acquire_lease('scheduler', owner or default_owner(), settings.SCHEDULER_LEASE_SECONDS):
+        return []
+    fail_lost_runs()
+    now = timezone.now()
+    runs = []
+    for name, task in sorted(TASKS.items()):
+        latest = PeriodicRun.objects.filter(task=name).order_by('-scheduled_for').values_list('scheduled_for', flat=True).first()
+        # A task never run before waits for its first tick from now on
+        due = task.cron.latest(latest or now.replace(second=0, microsecond=0) - timedelta(minutes=1), now)
+        if due is None:
+            continue
+        overlapping = PeriodicRun.objects.filter(task=name, status='running').exists()
+        try:
+            with transaction.atomic():
+                run = PeriodicRun.objects.create(
+                    task=name,
+                    scheduled_for=due,
+                    status='skipped' if overlapping else 'running',
+                    error="The previous run was still in progress." if overlapping else '',
+                )
+                if not overlapping:
+                    enqueue('scheduler.run', run_id=run.pk)
+        except IntegrityError:
+            continue
+        runs.append(run)
+    return runs
+
+@job('scheduler.run', priority=3, max_attempts=1)
+def run_periodic_task(run_id):
+    run = PeriodicRun.objects.get(pk=run_id)
+    started = timezone.now()
+    PeriodicRun.objects.filter(pk=run.pk).update(started_at=started)
+    try:
+        TASKS[run.task].func()
+    except Exception as e:
+        finished = timezone.now()
+        PeriodicRun.objects.filter(pk=run.pk, status='running').update(
+            status='failed', finished_at=finished, duration=(finished - started).total_seconds(), error=f"{type(e).__name__}: {e}",
+        )
+        raise
+    finished = timezone.now()
+    PeriodicRun.objects.filter(pk=run.pk, status='running').update(
+        status='done', finished_at=finished, duration=(finished - started).total_seconds(),
+    )
+
+def prune_runs():
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    return PeriodicRun.objects.filter(scheduled_for__lt=cutoff).exclude(status='running').delete()[0]
@@ -0,0 +1,75 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete
+from .caching import bump_catalog_version, bump_user_version
+from .models import (
+    Product, UserProfile, ReportExport, MediaBlob, Category, Review, FarmingProduct, Cart, Notification,
+    Report, AnnualProduction, Farm
+)
+
+# File fields stored through ContentAddressedStorage, whose blobs are reference counted
+MEDIA_FIELDS = {
+    Product: ['image'],
+    UserProfile: ['profile_picture'],
+    ReportExport: ['file'],
+}
+
+def _file_name(instance, field):
+    # None means the field was deferred and its previous value is unknown
+    if field not in instance.__dict__:
+        return None
+    value = instance.__dict__[field]
+    return getattr(value, 'name', value) or ''
+
+def _adjust_ref_count(name, delta):
+    if name:
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + delta)
+
+def remember_media_names(sender, instance, **kwargs):
+    instance._media_names = {field: _file_name(instance, field) for field in MEDIA_FIELDS[sender]}
+
+def update_media_references(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_media_names', {})
+    for field in MEDIA_FIELDS[sender]:
+        name = _file_name(instance, field)
+        old_name = '' if created else previous.get(field)
+        if name is None or old_name is None or name == old_name:
+            continue
+        _adjust_ref_count(name, 1)
+        _adjust_ref_count(old_name, -1)
+    remember_media_names(sender, instance)
+
+def release_media_references(sender, instance, **kwargs):
+    for field in MEDIA_FIELDS[sender]:
+        _adjust_ref_count(getattr(instance, '_media_names', {}).get(field), -1)
+
+for model in MEDIA_FIELDS:
+    post_init.connect(remember_media_names, sender=model, dispatch_uid=f'media_names_{model.__name__}')
+    post_save.connect(update_media_references, sender=model, dispatch_uid=f'media_refs_{model.__name__}')
+    post_delete.connect(release_media_references, sender=model, dispatch_uid=f'media_release_{model.__name__}')
+
+# Models rendered on catalog and static report pages, and per-user models rendered in the page
+# chrome (cart count, notifications, avatar); saving or deleting any of them bumps a version stamp
+CATALOG_MODELS = [Product, Category, Review, FarmingProduct, Report, AnnualProduction, Farm]
+USER_MODELS = [Cart, Notification, UserProfile]
+
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+def user_data_changed(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
+
+def session_changed(sender, user, **kwargs):
+    if user is not None:
+        bump_user_version(user.pk)
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
+for model in USER_MODELS:
+    post_save.connect(user_data_changed, sender=model, dispatch_uid=f'user_save_{model.__name__}')
+    post_delete.connect(user_data_changed, sender=model, dispatch_uid=f'user_delete_{model.__name__}')
+user_logged_in.connect(session_changed, dispatch_uid='user_logged_in_version')
+user_logged_out.connect(session_changed, dispatch_uid='user_logged_out_version')
@@ -0,0 +1,60 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Sum
+from django.utils import timezone
+from .models import Product, StockHold
+
+# Starting checkout reserves every cart line as a StockHold that lapses after STOCK_HOLD_TTL
+# seconds. The stock available to a buyer is the product's stock minus the other buyers' active
+# holds, read from the (product, expires_at) index. Expired rows are ignored by every query here
+# and removed in bulk by the expire_stock_holds command.
+
+def active_holds(product_ids, exclude_user=None):
+    holds = StockHold.objects.filter(product_id__in=product_ids, expires_at__gt=timezone.now())
+    if exclude_user is not None:
+        holds = holds.exclude(user=exclude_user)
+    return dict(holds.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+
+def available_stock(products, exclude_user=None):
+    products = list(products)
+    held = active_holds([product.pk for product in products], exclude_user)
+    return {product.pk: max(product.stock - held.get(product.pk, 0), 0) for product in products}
+
+def lock_products(product_ids):
+    # Rows are locked in primary key order so concurrent checkouts cannot deadlock
+    return Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').in_bulk()
+
+def reserve_cart(user, lines):
+    # Replaces the user's holds with one per cart line. If any line cannot be covered nothing is
+    # held and the short lines are returned with their available quantity.
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+    with transaction.atomic():
+        products = lock_products([line.product_id for line in lines])
+        available = available_stock(products.values(), exclude_user=user)
+        short = [(line, available.get(line.product_id, 0)) for line in lines
+                 if line.quantity > available.get(line.product_id, 0)]
+        StockHold.objects.filter(user=user).delete()
+        if not short:
+            StockHold.objects.bulk_create([
+                StockHold(user=user, product_id=line.product_id, quantity=line.quantity, expires_at=expires_at)
+                for line in lines
+            ])
+    return short
+
+def release_holds(user):
+    StockHold.objects.filter(user=user).delete()
+
+def hold_expiry(user):
+    # When the user's current checkout reservation lapses, or None if nothing is held
+    holds = StockHold.objects.filter(user=user, expires_at__gt=timezone.now())
+    return holds.aggregate(expires_at=Min('expires_at'))['expires_at']
+
+def expire_holds(batch_size=1000):
+    # Deletes lapsed holds in primary key batches; returns the number removed
+    removed = 0
+    while True:
+        batch = list(StockHold.objects.filter(expires_at__lte=timezone.now()).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return removed
+        removed += StockHold.objects.filter(pk__in=batch).delete()[0]
@@ -0,0 +1,68 @@
+import hashlib
+import os
+import re
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+# Names produced by ContentAddressedStorage: <upload dir>/<2 hex chars>/<sha256>.<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+# Stores each unique upload once under its SHA-256, hashing while the upload is streamed to disk.
+# Identical bytes always map to the same immutable name, so duplicates share one file and the
+# URLs can be cached forever by a CDN. Every stored file is tracked as a MediaBlob row whose
+# ref_count is maintained by store.signals and swept by the gc_media command.
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content has been hashed in _save
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        tmp_dir = self.path('tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(content, 'seek') and getattr(content, 'seekable', lambda: True)():
+            content.seek(0)
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        final_name = '/'.join(part for part in (directory, sha256[:2], sha256 + extension) if part)
+        final_path = self.path(final_name)
+        with transaction.atomic():
+            # The blob's row stays locked while the file is checked and moved, so gc_media cannot
+            # unlink it in between
+            self.lock_blob(final_name, size)
+            if os.path.exists(final_path):
+                os.remove(tmp.name)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp.name, final_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(final_path, self.file_permissions_mode)
+        return final_name
+
+    def lock_blob(self, name, size):
+        from .models import MediaBlob
+        while True:
+            MediaBlob.objects.get_or_create(name=name, defaults={'size': size})
+            # gc_media may have deleted the row in between; it is then registered again
+            if MediaBlob.objects.select_for_update().filter(name=name).values_list('pk', flat=True).first():
+                break
+        # Reusing an orphaned blob restarts its grace period, so gc_media keeps it until the
+        # saving model's post_save counts the new reference
+        MediaBlob.objects.filter(name=name, ref_count__lte=0).update(created_at=timezone.now())
+
+media_storage = ContentAddressedStorage()
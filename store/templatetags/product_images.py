@@ -0,0 +1,35 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+from store.images import DERIVATIVE_SIZES, derivative_names, derivative_storage
+
+register = template.Library()
+
+def _srcset(names, extension):
+    return ', '.join(
+        f"{derivative_storage.url(name)} {density}x"
+        for (density, ext), name in sorted(names.items())
+        if ext == extension
+    )
+
+# Responsive <picture> for a product image: WebP and JPEG srcsets when derivatives exist,
+# the original upload while they are still being generated, and the placeholder otherwise
+@register.simple_tag
+def product_picture(product, size, css_class=''):
+    if size not in DERIVATIVE_SIZES:
+        raise template.TemplateSyntaxError(f"Unknown product image size '{size}'.")
+    width, height = DERIVATIVE_SIZES[size]
+    if not product.image:
+        return format_html('<img src="{}" alt="Placeholder" class="{}" width="{}" height="{}">',
+                           static('images/placeholder.jpg'), css_class, width, height)
+
+    names = derivative_names(product.image.name, size)
+    if not derivative_storage.exists(names[(1, 'jpg')]):
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">',
+                           product.image.url, product.name, css_class)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}">'
+        '<img src="{}" srcset="{}" alt="{}" class="{}" width="{}" height="{}" loading="lazy"></picture>',
+        _srcset(names, 'webp'), derivative_storage.url(names[(1, 'jpg')]), _srcset(names, 'jpg'),
+        product.name, css_class, width, height,
+    )
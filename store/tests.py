@@ -1,3 +1,822 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.apps import apps
+from django.contrib import admin
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Count
+from django.contrib.auth.models import User
+from .models import (Category, Product, Order, Notification, Cart, Review, DeliveryTracking, PaymentTransaction, WebhookEvent,
+                     Lease, PeriodicRun, BusinessLocation, Inventory, OrderItem, OrderAllocation, UserProfile, StockHold,
+                     MediaBlob)
+from .routing import AllocationError, InventorySnapshot, allocate_order, plan_allocation
+from .ledger import adjust_inventory, adjust_product_stock, ledger_on_hand, stock_drift, take_snapshot, transfer_stock
+from . import scheduler
+from .caching import bump_catalog_version, catalog_version
+from .gateways import Authorization, Gateway, SimulatorServer, _gateways
+from .payments import authorize_payments
+from .webhooks import apply_batch, sign
+from .storage import media_storage
+from .cart import GuestCart, add_line, add_lines
+from .stock import available_stock, hold_expiry, reserve_cart
+from .carriers import feed_event, ingest, parse_time
+from .reconciliation import StatementLine, parse_amount, read_camt, reconcile
 
-# Create your tests here.
+# Query plan regression tests for the hot queries behind the storefront and staff dashboard.
+# Each test seeds enough skewed data for the planner to prefer an index, captures EXPLAIN
+# and fails if the table is read with a full sequential scan.
+class QueryPlanTests(TestCase):
+    SEED_USERS = 200
+    SEED_PRODUCTS = 500
+    SEED_ORDERS = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Grains', slug='grains')
+        User.objects.bulk_create([User(username=f'seed{i}') for i in range(cls.SEED_USERS)])
+        users = list(User.objects.order_by('id'))
+        cls.user = users[0]
+
+        Product.objects.bulk_create([
+            Product(category=category, name=f'Product {i}', description='', price=Decimal('1.00'),
+                    stock=100, is_active=i % 10 == 0)
+            for i in range(cls.SEED_PRODUCTS)
+        ])
+        products = list(Product.objects.order_by('id'))
+        cls.product = products[0]
+
+        Notification.objects.bulk_create([
+            Notification(user=users[i % len(users)], message='Seed', type='system')
+            for i in range(cls.SEED_ORDERS)
+        ])
+        Cart.objects.bulk_create([
+            Cart(user=user, product=products[j], quantity=1)
+            for user in users for j in range(3)
+        ])
+        Review.objects.bulk_create([
+            Review(product=products[i % len(products)], user=user, rating=5, is_approved=i % 4 == 0)
+            for i, user in enumerate(users)
+        ])
+        Order.objects.bulk_create([
+            Order(user=users[i % len(users)], status='pending' if i % 50 == 0 else 'delivered',
+                  shipping_address='Seed', shipping_city='Lagos', shipping_country='Nigeria')
+            for i in range(cls.SEED_ORDERS)
+        ])
+        orders = list(Order.objects.order_by('id'))
+        DeliveryTracking.objects.bulk_create([
+            DeliveryTracking(order=order, tracking_number=f'TRK{order.id}',
+                             status='in_transit' if i % 50 == 0 else 'delivered')
+            for i, order in enumerate(orders)
+        ])
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertNoSequentialScan(self, queryset, table):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            pattern = rf'Seq Scan on {table}\b'
+        elif connection.vendor == 'sqlite':
+            pattern = rf'SCAN {table}\b(?! USING (COVERING )?INDEX)'
+        else:
+            self.skipTest(f"No plan parser for {connection.vendor}")
+        self.assertIsNone(re.search(pattern, plan), f"Sequential scan on {table}:\n{plan}")
+
+    def test_notifications_for_user(self):
+        queryset = Notification.objects.filter(user=self.user).order_by('-created_at')[:5]
+        self.assertNoSequentialScan(queryset, 'store_notification')
+
+    def test_cart_count_for_user(self):
+        queryset = Cart.objects.filter(user=self.user).values('user').annotate(total=Count('id'))
+        self.assertNoSequentialScan(queryset, 'store_cart')
+
+    def test_approved_reviews_for_product(self):
+        queryset = Review.objects.filter(product=self.product, is_approved=True)
+        self.assertNoSequentialScan(queryset, 'store_review')
+
+    def test_active_product_list(self):
+        queryset = Product.objects.filter(is_active=True).order_by('id')[:20]
+        self.assertNoSequentialScan(queryset, 'store_product')
+
+    def test_order_status_count(self):
+        queryset = Order.objects.filter(status='pending').values('status').annotate(total=Count('id'))
+        self.assertNoSequentialScan(queryset, 'store_order')
+
+    def test_delivery_tracking_by_status(self):
+        queryset = DeliveryTracking.objects.filter(status='in_transit')
+        self.assertNoSequentialScan(queryset, 'store_deliverytracking')
+
+# Webhook receiver: only events signed with the gateway's secret within the tolerance are stored,
+# and a stored event only reaches payments made through the gateway that sent it.
+@override_settings(PAYMENT_WEBHOOK_SECRETS={'stripe': 'stripe-secret', 'paypal': 'paypal-secret'})
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='buyer')
+        order = Order.objects.create(user=user, total_price=Decimal('10.00'))
+        self.payment = PaymentTransaction.objects.create(
+            order=order, user=user, amount=Decimal('10.00'), gateway='stripe', transaction_id='TXN-1', status='authorizing',
+        )
+
+    def event(self, event_id='evt_1'):
+        return json.dumps({'id': event_id, 'type': 'payment.completed', 'transaction_id': 'TXN-1', 'created': time.time()}).encode()
+
+    def deliver(self, gateway, body, signature):
+        return self.client.post(reverse('payment_webhook', args=[gateway]), body,
+                                content_type='application/json', HTTP_X_SIGNATURE=signature)
+
+    def test_valid_signature_is_stored(self):
+        body = self.event()
+        self.assertEqual(self.deliver('stripe', body, sign('stripe-secret', body)).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.filter(gateway='stripe', event_id='evt_1').count(), 1)
+
+    def test_bad_signatures_are_refused(self):
+        body = self.event()
+        for signature in ['', 'garbage', sign('wrong-secret', body), f"t={int(time.time())},v1=\u00e9"]:
+            self.assertEqual(self.deliver('stripe', body, signature).status_code, 400, signature)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_old_signature_is_refused(self):
+        body = self.event()
+        self.assertEqual(self.deliver('stripe', body, sign('stripe-secret', body, time.time() - 3600)).status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_event_applies_to_its_gateway(self):
+        body = self.event()
+        self.deliver('stripe', body, sign('stripe-secret', body))
+        apply_batch()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+    def test_completed_payment_only_moves_to_refunded(self):
+        created = time.time()
+        for event_id, event_type in [('evt_1', 'payment.completed'), ('evt_2', 'payment.failed')]:
+            created += 1
+            body = json.dumps({'id': event_id, 'type': event_type, 'transaction_id': 'TXN-1', 'created': created}).encode()
+            self.deliver('stripe', body, sign('stripe-secret', body))
+        apply_batch()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertEqual(WebhookEvent.objects.get(event_id='evt_2').outcome, 'ignored')
+        self.assertEqual(Order.objects.get(pk=self.payment.order_id).status, 'processing')
+        body = json.dumps({'id': 'evt_3', 'type': 'payment.refunded', 'transaction_id': 'TXN-1', 'created': created + 1}).encode()
+        self.deliver('stripe', body, sign('stripe-secret', body))
+        apply_batch()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'refunded')
+
+    def test_event_from_another_gateway_is_unknown(self):
+        body = self.event()
+        self.deliver('paypal', body, sign('paypal-secret', body))
+        apply_batch()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'authorizing')
+        self.assertEqual(WebhookEvent.objects.get().outcome, 'unknown')
+
+# Adapters for the authorization tests below; OPTIONS pick the misbehaviour
+class MisbehavingGateway(Gateway):
+    def __init__(self, status=None, error=None):
+        self.status, self.error = status, error
+
+    async def authorize(self, request):
+        if self.error:
+            raise self.error
+        return Authorization(self.status, 'ref', '')
+
+# Payment authorization end to end against the gateway simulator over HTTP
+class GatewaySimulatorTests(TestCase):
+    def start_simulator(self, **options):
+        server = SimulatorServer(('127.0.0.1', 0), latency=0, seed=1, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}"
+        gateways = {'default': {'BACKEND': 'store.gateways.HTTPGateway', 'OPTIONS': {'url': url, 'timeout': 5}}}
+        settings_override = override_settings(PAYMENT_GATEWAYS=gateways, PAYMENT_MAX_ATTEMPTS=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Adapters are built once per process from the settings
+        _gateways.clear()
+        self.addCleanup(_gateways.clear)
+        return server
+
+    def create_payment(self, transaction_id, method):
+        user = User.objects.create(username=transaction_id)
+        order = Order.objects.create(user=user, total_price=Decimal('10.00'))
+        gateway = 'bank_transfer' if method == 'sdd' else method
+        return PaymentTransaction.objects.create(order=order, user=user, amount=Decimal('10.00'), gateway=gateway,
+                                                 payment_method=method, transaction_id=transaction_id, status='authorizing')
+
+    def assertStatuses(self, expected):
+        self.assertEqual(dict(PaymentTransaction.objects.values_list('transaction_id', 'status')), expected)
+
+    def test_card_payments_complete_and_bank_payments_wait(self):
+        self.start_simulator()
+        self.create_payment('txn_card', 'stripe')
+        self.create_payment('txn_bank', 'bank_transfer')
+        self.assertEqual(authorize_payments(), (2, 0))
+        self.assertStatuses({'txn_card': 'completed', 'txn_bank': 'pending'})
+        self.assertEqual(Order.objects.get(payments__transaction_id='txn_card').status, 'processing')
+
+    def test_chunked_replies_are_decoded(self):
+        self.start_simulator(chunked=True)
+        self.create_payment('txn_card', 'paypal')
+        self.assertEqual(authorize_payments(), (1, 0))
+        self.assertStatuses({'txn_card': 'completed'})
+
+    def test_declines_fail_the_payment(self):
+        self.start_simulator(decline_rate=1.0)
+        self.create_payment('txn_card', 'stripe')
+        authorize_payments()
+        self.assertStatuses({'txn_card': 'failed'})
+
+    def use_gateway(self, backend, **options):
+        gateways = {'default': {'BACKEND': backend, 'OPTIONS': options}}
+        settings_override = override_settings(PAYMENT_GATEWAYS=gateways, PAYMENT_MAX_ATTEMPTS=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        _gateways.clear()
+        self.addCleanup(_gateways.clear)
+
+    def test_unexpected_replies_count_as_gateway_errors(self):
+        # Neither an unknown status nor an adapter exception is stored or aborts the batch
+        for transaction_id, options in [('txn_status', {'status': 'approved'}), ('txn_error', {'error': KeyError('status')})]:
+            PaymentTransaction.objects.all().delete()
+            self.use_gateway('store.tests.MisbehavingGateway', **options)
+            self.create_payment(transaction_id, 'stripe')
+            self.assertEqual(authorize_payments(), (0, 1))
+            self.assertEqual(PaymentTransaction.objects.get().status, 'authorizing')
+            self.assertEqual(PaymentTransaction.objects.get().attempts, 1)
+
+    def test_outages_are_retried_then_fail(self):
+        self.start_simulator(failure_rate=1.0)
+        self.create_payment('txn_card', 'stripe')
+        self.assertEqual(authorize_payments(), (0, 1))
+        self.assertStatuses({'txn_card': 'authorizing'})
+        authorize_payments()
+        self.assertStatuses({'txn_card': 'failed'})
+
+def local(*args):
+    # An aware datetime in TIME_ZONE, which cron expressions are read in
+    return timezone.make_aware(datetime(*args))
+
+# Cron expressions: fields, steps and ranges, and cron's day-of-month/day-of-week rule
+class CronTests(TestCase):
+    def test_steps_ranges_and_lists(self):
+        cron = scheduler.Cron('*/15 9-17 * * 1-5')
+        self.assertTrue(cron.matches(local(2026, 10, 19, 9, 45)))   # Monday
+        self.assertFalse(cron.matches(local(2026, 10, 19, 9, 50)))
+        self.assertFalse(cron.matches(local(2026, 10, 19, 18, 0)))
+        self.assertFalse(cron.matches(local(2026, 10, 18, 9, 45)))  # Sunday
+        self.assertEqual(scheduler.Cron('5/20 0 * * *').minutes, {5, 25, 45})
+        self.assertEqual(scheduler.Cron('1,30-32 0 * * *').minutes, {1, 30, 31, 32})
+
+    def test_sunday_is_zero_or_seven(self):
+        sunday = local(2026, 10, 18, 0, 0)
+        self.assertTrue(scheduler.Cron('0 0 * * 0').matches(sunday))
+        self.assertTrue(scheduler.Cron('0 0 * * 7').matches(sunday))
+
+    def test_day_of_month_or_day_of_week(self):
+        # Both restricted: either matches. One restricted: only that one counts.
+        friday, thirteenth, neither = local(2026, 10, 16), local(2026, 10, 13), local(2026, 10, 14)
+        either = scheduler.Cron('0 0 13 * 5')
+        self.assertTrue(either.matches(friday))
+        self.assertTrue(either.matches(thirteenth))
+        self.assertFalse(either.matches(neither))
+        self.assertFalse(scheduler.Cron('0 0 * * 5').matches(thirteenth))
+        self.assertFalse(scheduler.Cron('0 0 13 * *').matches(friday))
+
+    def test_invalid_expressions(self):
+        for expression in ['* * * *', '60 * * * *', '* 5-2 * * *', '*/0 * * * *', '* * 0 * *']:
+            with self.assertRaises(ValueError, msg=expression):
+                scheduler.Cron(expression)
+
+    def test_latest(self):
+        cron = scheduler.Cron('0 * * * *')
+        self.assertEqual(cron.latest(local(2026, 10, 19, 9, 0), local(2026, 10, 19, 12, 30)), local(2026, 10, 19, 12, 0))
+        self.assertIsNone(cron.latest(local(2026, 10, 19, 12, 0), local(2026, 10, 19, 12, 59)))
+        # Catch-up reaches back at most CATCH_UP
+        yearly = scheduler.Cron('0 0 1 1 *')
+        self.assertIsNone(yearly.latest(local(2025, 12, 1), local(2026, 10, 19)))
+        self.assertEqual(yearly.latest(local(2025, 12, 1), local(2026, 1, 3)), local(2026, 1, 1))
+
+# tick(): the lease picks one scheduling process, and each tick of a task starts once
+class TickTests(TestCase):
+    def setUp(self):
+        tasks = mock.patch.object(scheduler, 'TASKS', {'test.hourly': scheduler.PeriodicTask(lambda: None, scheduler.Cron('0 * * * *'))})
+        tasks.start()
+        self.addCleanup(tasks.stop)
+
+    def tick_at(self, moment, owner):
+        with mock.patch('django.utils.timezone.now', return_value=moment):
+            return scheduler.tick(owner)
+
+    def scheduled(self):
+        return list(PeriodicRun.objects.order_by('scheduled_for').values_list('scheduled_for', 'status'))
+
+    def test_two_owners_start_a_tick_once(self):
+        eleven = local(2026, 10, 19, 11, 0)
+        self.assertEqual(len(self.tick_at(eleven, 'a')), 1)
+        # b waits while a holds the lease
+        self.assertEqual(self.tick_at(eleven, 'b'), [])
+        # Once the lease lapses b takes over, but the tick a started is not started again
+        Lease.objects.filter(name='scheduler').update(expires_at=eleven - timedelta(seconds=1))
+        self.assertEqual(self.tick_at(eleven, 'b'), [])
+        self.assertEqual(Lease.objects.get(name='scheduler').owner, 'b')
+        self.assertEqual(self.scheduled(), [(eleven, 'running')])
+
+    def test_new_task_waits_then_catches_up_once(self):
+        self.assertEqual(self.tick_at(local(2026, 10, 19, 10, 30), 'a'), [])
+        self.tick_at(local(2026, 10, 19, 11, 0), 'a')
+        PeriodicRun.objects.update(status='done')
+        # 12:00 and 13:00 were missed; only the latest tick runs
+        self.tick_at(local(2026, 10, 19, 13, 20), 'a')
+        self.assertEqual(self.scheduled(), [(local(2026, 10, 19, 11, 0), 'done'), (local(2026, 10, 19, 13, 0), 'running')])
+
+    def test_overlapping_tick_is_skipped(self):
+        self.tick_at(local(2026, 10, 19, 11, 0), 'a')
+        self.tick_at(local(2026, 10, 19, 12, 0), 'a')
+        self.assertEqual([status for _, status in self.scheduled()], ['running', 'skipped'])
+
+# Stock ledger: the latest snapshot run plus the movements after its watermark must equal the
+# running totals, and stock_drift reports any bucket where they differ
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Seeds', slug='seeds')
+        self.product = Product.objects.create(category=category, name='Maize seed', description='', price=Decimal('2.00'), stock=0)
+        self.location = BusinessLocation.objects.create(name='Depot', address='1 Road', city='Lagos', country='Nigeria')
+
+    def set_stock(self, stock):
+        with transaction.atomic():
+            adjust_product_stock(self.product, stock)
+            Product.objects.filter(pk=self.product.pk).update(stock=stock)
+
+    def assertLedgerMatchesTotals(self):
+        on_hand = ledger_on_hand([self.product.pk])
+        inventory = Inventory.objects.get(product=self.product, location=self.location)
+        self.assertEqual(on_hand.get((self.product.pk, self.location.pk), 0), inventory.quantity)
+        self.assertEqual(sum(on_hand.values()), Product.objects.get(pk=self.product.pk).stock)
+        self.assertEqual(stock_drift(), [])
+
+    def test_snapshot_plus_tail_equals_running_totals(self):
+        self.set_stock(10)
+        transfer_stock(self.product, 4, None, self.location)
+        self.assertGreater(take_snapshot(), 0)
+        self.assertLedgerMatchesTotals()
+        # Movements after the snapshot are read from the ledger tail
+        transfer_stock(self.product, 1, self.location, None)
+        self.set_stock(12)
+        with transaction.atomic():
+            inventory = Inventory.objects.get(product=self.product, location=self.location)
+            previous = (inventory.product_id, inventory.location_id, inventory.quantity)
+            inventory.quantity = 5
+            inventory.save()
+            adjust_inventory(previous, inventory)
+        self.assertLedgerMatchesTotals()
+        self.assertEqual(take_snapshot(), 2)
+        self.assertEqual(take_snapshot(), 0)
+        self.assertLedgerMatchesTotals()
+
+    def test_stock_drift_reports_running_totals_off_the_ledger(self):
+        self.set_stock(10)
+        transfer_stock(self.product, 4, None, self.location)
+        take_snapshot()
+        Product.objects.filter(pk=self.product.pk).update(stock=11)
+        Inventory.objects.filter(product=self.product, location=self.location).update(quantity=3)
+        # NULL sorts first on SQLite and last on PostgreSQL
+        self.assertCountEqual(stock_drift(), [
+            (self.product.pk, None, 10, 11),
+            (self.product.pk, self.location.pk, 4, 3),
+        ])
+
+    def test_transfer_cannot_exceed_the_source(self):
+        self.set_stock(3)
+        with self.assertRaises(ValueError):
+            transfer_stock(self.product, 4, None, self.location)
+        transfer_stock(self.product, 3, None, self.location)
+        with self.assertRaises(ValueError):
+            transfer_stock(self.product, 4, self.location, None)
+
+# Version stamps move only once the writes they announce are committed
+class VersionStampTests(TestCase):
+    def test_bump_waits_for_commit(self):
+        before = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                bump_catalog_version()
+                self.assertEqual(catalog_version(), before)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(catalog_version(), before)
+
+# Order routing: whole orders from one location where possible, nearest first, then split across
+# locations, with what no location holds taken from unassigned stock
+class AllocationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Tools', slug='tools')
+        self.hoe = Product.objects.create(category=category, name='Hoe', description='', price=Decimal('5.00'), stock=10)
+        self.rake = Product.objects.create(category=category, name='Rake', description='', price=Decimal('5.00'), stock=10)
+        self.lagos = BusinessLocation.objects.create(name='Lagos', address='1 Road', city='Lagos', country='Nigeria')
+        self.abuja = BusinessLocation.objects.create(name='Abuja', address='2 Road', city='Abuja', country='Nigeria')
+
+    def stock(self, product, location, quantity):
+        Inventory.objects.create(product=product, location=location, quantity=quantity)
+
+    def plan(self, *lines, city='Lagos'):
+        demand = {index: (product.pk, quantity, product.name) for index, (product, quantity) in enumerate(lines)}
+        snapshot = InventorySnapshot({product.pk for product, quantity in lines})
+        plan = plan_allocation(snapshot, demand, city, 'Nigeria')
+        return {key: [(location_id, units) for location_id, taken, units in parts] for key, parts in plan.items()}
+
+    def test_nearest_location_holding_the_whole_order(self):
+        for location in (self.lagos, self.abuja):
+            self.stock(self.hoe, location, 5)
+            self.stock(self.rake, location, 5)
+        self.assertEqual(self.plan((self.hoe, 2), (self.rake, 3), city='Abuja'), {0: [(self.abuja.pk, 2)], 1: [(self.abuja.pk, 3)]})
+
+    def test_split_across_locations(self):
+        self.stock(self.hoe, self.lagos, 5)
+        self.stock(self.rake, self.abuja, 5)
+        self.assertEqual(self.plan((self.hoe, 2), (self.rake, 3)), {0: [(self.lagos.pk, 2)], 1: [(self.abuja.pk, 3)]})
+
+    def test_unassigned_stock_covers_the_rest(self):
+        # 4 of the hoe's 10 units are at Lagos; the other 6 belong to no location
+        self.stock(self.hoe, self.lagos, 4)
+        self.assertEqual(self.plan((self.hoe, 7)), {0: [(self.lagos.pk, 4), (None, 3)]})
+        # A product without inventory records is sold from unassigned stock alone
+        self.assertEqual(self.plan((self.rake, 10)), {0: [(None, 10)]})
+
+    def test_shortage_raises(self):
+        self.stock(self.hoe, self.lagos, 4)
+        with self.assertRaisesMessage(AllocationError, 'Hoe'):
+            self.plan((self.hoe, 11))
+
+    def test_allocate_order_decrements_inventory_and_unassigned_stock(self):
+        self.stock(self.hoe, self.lagos, 4)
+        order = Order.objects.create(user=User.objects.create(username='buyer'), shipping_city='Lagos', shipping_country='Nigeria')
+        item = OrderItem.objects.create(order=order, product=self.hoe, quantity=7)
+        allocate_order(order, [item])
+        self.assertEqual(Inventory.objects.get(product=self.hoe).quantity, 0)
+        self.assertEqual(Product.objects.get(pk=self.hoe.pk).stock, 3)
+        self.assertEqual(sorted(OrderAllocation.objects.values_list('location_id', 'quantity')), [(self.lagos.pk, 3), (self.lagos.pk, 4)])
+        self.assertEqual(Order.objects.get(pk=order.pk).location_id, self.lagos.pk)
+
+# Idempotent payment submission: a form's key pays one order once, whatever is resubmitted
+class PaymentSubmissionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='payer')
+        UserProfile.objects.get_or_create(user=self.user)
+        self.order = Order.objects.create(user=self.user, total_price=Decimal('10.00'))
+        self.client.force_login(self.user)
+
+    def submit(self, order, key):
+        response = self.client.post(reverse('payment', args=[order.pk]), {
+            'payment_method': 'stripe', 'card_number': '4242424242424242', 'card_expiry': '12/30', 'card_cvc': '123',
+            'idempotency_key': key,
+        }, follow=True)
+        return [str(message) for message in response.context['messages']]
+
+    def test_duplicate_key_replays_the_stored_result(self):
+        first = self.submit(self.order, 'key-1')
+        self.assertEqual(self.submit(self.order, 'key-1'), first)
+        self.assertEqual(PaymentTransaction.objects.filter(order=self.order).count(), 1)
+
+    def test_key_reused_for_another_order_is_refused(self):
+        other = Order.objects.create(user=self.user, total_price=Decimal('5.00'))
+        self.submit(self.order, 'key-1')
+        messages = self.submit(other, 'key-1')
+        self.assertIn(f"This payment form was already submitted for Order #{self.order.pk}.", messages)
+        self.assertFalse(PaymentTransaction.objects.filter(order=other).exists())
+
+    def test_second_key_for_a_paid_order_is_refused(self):
+        self.submit(self.order, 'key-1')
+        self.assertIn(f"Payment failed: Order #{self.order.pk} already has a payment.", self.submit(self.order, 'key-2'))
+        self.assertEqual(PaymentTransaction.objects.filter(order=self.order).count(), 1)
+
+# Two tabs submitting different keys at once; the order row lock lets only one pay. SQLite
+# serializes writers anyway, so this needs a database with row locks.
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentPaymentSubmissionTests(TransactionTestCase):
+    def test_concurrent_keys_pay_once(self):
+        user = User.objects.create(username='payer')
+        UserProfile.objects.get_or_create(user=user)
+        order = Order.objects.create(user=user, total_price=Decimal('10.00'))
+        start = threading.Barrier(2)
+
+        def submit(key):
+            client = self.client_class()
+            client.force_login(user)
+            start.wait()
+            client.post(reverse('payment', args=[order.pk]), {
+                'payment_method': 'stripe', 'card_number': '4242424242424242', 'card_expiry': '12/30', 'card_cvc': '123',
+                'idempotency_key': key,
+            })
+            connection.close()
+
+        threads = [threading.Thread(target=submit, args=(key,)) for key in ('key-1', 'key-2')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(PaymentTransaction.objects.filter(order=order).count(), 1)
+
+# Bank statements: amounts in either separator convention, CAMT credit entries (one line per
+# detail of a batch-booked entry), and the outcome of matching each line to a pending payment
+class ReconciliationTests(TestCase):
+    CAMT = b"""<?xml version="1.0"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02"><BkToCstmrStmt><Stmt>
+<Ntry><Amt Ccy="EUR">30.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><AcctSvcrRef>E1</AcctSvcrRef><NtryDtls>
+<TxDtls><Refs><EndToEndId>REF-A</EndToEndId></Refs><AmtDtls><TxAmt><Amt Ccy="EUR">10.00</Amt></TxAmt></AmtDtls></TxDtls>
+<TxDtls><Refs><EndToEndId>NOTPROVIDED</EndToEndId></Refs><AmtDtls><TxAmt><Amt Ccy="EUR">20.00</Amt></TxAmt></AmtDtls>
+<RmtInf><Ustrd>Order payment</Ustrd></RmtInf></TxDtls>
+</NtryDtls></Ntry>
+<Ntry><Amt Ccy="EUR">5.00</Amt><CdtDbtInd>DBIT</CdtDbtInd><AcctSvcrRef>E2</AcctSvcrRef><NtryDtls>
+<TxDtls><Refs><EndToEndId>REF-B</EndToEndId></Refs></TxDtls></NtryDtls></Ntry>
+<Ntry><Amt Ccy="EUR">7.50</Amt><CdtDbtInd>CRDT</CdtDbtInd><NtryRef>E3</NtryRef></Ntry>
+</Stmt></BkToCstmrStmt></Document>"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='payer')
+        self.order = Order.objects.create(user=self.user, total_price=Decimal('10.00'))
+        self.payment = PaymentTransaction.objects.create(
+            order=self.order, user=self.user, amount=Decimal('10.00'), currency='EUR', gateway='bank_transfer',
+            transaction_id='REF-A',
+        )
+
+    def line(self, number, reference, amount, currency='EUR'):
+        return StatementLine(number, reference, Decimal(amount), currency, f"E{number}", '')
+
+    def test_parse_amount(self):
+        self.assertEqual(parse_amount('1,000'), Decimal('1000'))
+        self.assertEqual(parse_amount('1,00'), Decimal('1.00'))
+        self.assertEqual(parse_amount('1.234,50'), Decimal('1234.50'))
+        self.assertEqual(parse_amount('1,234.50'), Decimal('1234.50'))
+        self.assertEqual(parse_amount('EUR 1.000.000'), Decimal('1000000'))
+        self.assertIsNone(parse_amount('n/a'))
+
+    def test_camt_batch_entries_split_and_debits_are_skipped(self):
+        lines = list(read_camt(io.BytesIO(self.CAMT)))
+        self.assertEqual([(line.line, line.reference, line.amount, line.currency, line.entry_id, line.text) for line in lines], [
+            (1, 'REF-A', Decimal('10.00'), 'EUR', 'E1', ''),
+            (1, '', Decimal('20.00'), 'EUR', 'E1', 'Order payment'),
+            (3, '', Decimal('7.50'), 'EUR', 'E3', ''),
+        ])
+
+    def test_matched_duplicate_and_amount_mismatch(self):
+        unmatched = []
+        counts = reconcile([
+            self.line(2, 'ref-a', '9.00'),
+            self.line(3, 'REF-A', '10.00', 'USD'),
+            self.line(4, 'REF-A', '10.00'),
+            self.line(5, 'REF-A', '10.00'),
+            self.line(6, 'REF-Z', '10.00'),
+        ], unmatched=lambda line, reason: unmatched.append((line.line, reason)))
+        self.assertEqual(unmatched, [(2, 'amount_mismatch'), (3, 'amount_mismatch'), (5, 'duplicate'), (6, 'unknown')])
+        self.assertEqual((counts['matched'], counts['settled'], counts['amount_mismatch'], counts['duplicate'], counts['unknown']),
+                         (1, 1, 2, 1, 1))
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.gateway_reference), ('completed', 'E4'))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'processing')
+
+    def test_dry_run_settles_nothing(self):
+        counts = reconcile([self.line(2, 'REF-A', '10.00')], dry_run=True)
+        self.assertEqual((counts['matched'], counts['settled']), (1, 0))
+        self.assertEqual(PaymentTransaction.objects.get(pk=self.payment.pk).status, 'pending')
+
+# Carrier feeds: an event applies only if newer than the one behind the parcel's status, a
+# delivered parcel stays delivered, and orders follow their parcels forward only
+class CarrierFeedTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.order = Order.objects.create(user=self.user, status='processing')
+        self.parcel = DeliveryTracking.objects.create(order=self.order, tracking_number='TRK1')
+        self.start = timezone.now() - timedelta(days=1)
+
+    def event(self, status, hours, **fields):
+        return feed_event({'tracking_number': 'TRK1', 'status': status,
+                           'occurred_at': (self.start + timedelta(hours=hours)).isoformat(), **fields})
+
+    def state(self):
+        self.parcel.refresh_from_db()
+        self.order.refresh_from_db()
+        return self.parcel.status, self.order.status
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time(1700000000), datetime(2023, 11, 14, 22, 13, 20, tzinfo=dt_timezone.utc))
+        self.assertEqual(parse_time('1700000000.5'), datetime(2023, 11, 14, 22, 13, 20, 500000, tzinfo=dt_timezone.utc))
+        self.assertEqual(parse_time('2024-05-01T10:00:00+00:00'), datetime(2024, 5, 1, 10, tzinfo=dt_timezone.utc))
+        # Millisecond epochs are out of datetime's range
+        self.assertIsNone(parse_time('1700000000000000'))
+        self.assertIsNone(parse_time('yesterday'))
+        self.assertIsNone(feed_event({'tracking_number': 'TRK1', 'status': 'delivered', 'timestamp': '1700000000000000'}))
+
+    def test_stale_event_is_ignored(self):
+        ingest([self.event('out_for_delivery', 2)])
+        counts = ingest([self.event('in_transit', 1)])
+        self.assertEqual((counts['stale'], counts['updated']), (1, 0))
+        self.assertEqual(self.state(), ('out_for_delivery', 'shipped'))
+
+    def test_latest_event_in_a_chunk_wins(self):
+        counts = ingest([self.event('delivered', 3), self.event('in_transit', 1)])
+        self.assertEqual((counts['events'], counts['updated'], counts['notified']), (2, 1, 1))
+        self.assertEqual(self.state(), ('delivered', 'delivered'))
+
+    def test_delivered_is_terminal(self):
+        ingest([self.event('delivered', 1)])
+        counts = ingest([self.event('failed', 2)])
+        self.assertEqual((counts['unchanged'], counts['notified']), (1, 0))
+        self.assertEqual(self.state(), ('delivered', 'delivered'))
+
+    def test_estimate_only_update(self):
+        ingest([self.event('in_transit', 1)])
+        estimate = (self.start + timedelta(days=3)).replace(microsecond=0)
+        counts = ingest([self.event('in_transit', 2, estimated_delivery=estimate.isoformat())])
+        self.assertEqual((counts['updated'], counts['notified']), (1, 0))
+        self.parcel.refresh_from_db()
+        self.assertEqual(self.parcel.estimated_delivery, estimate)
+        self.assertEqual(self.parcel.status_at, self.start + timedelta(hours=1))
+
+    def test_orders_only_move_forward(self):
+        self.order.status = 'delivered'
+        self.order.save()
+        ingest([self.event('in_transit', 1)])
+        self.assertEqual(self.state(), ('in_transit', 'delivered'))
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        ingest([self.event('delivered', 2)])
+        self.assertEqual(self.state(), ('delivered', 'cancelled'))
+
+    def test_unknown_and_invalid_lines_are_counted(self):
+        counts = ingest([None, feed_event({'tracking_number': 'TRK9', 'status': 'delivered', 'timestamp': 1700000000})])
+        self.assertEqual((counts['invalid'], counts['unknown'], counts['updated']), (1, 1, 0))
+
+# Cart lines: upserts increment the existing row within the product's stock, a guest cart merged
+# on login is clamped to the stock, and checkout holds stock against other buyers
+class CartTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Seeds', slug='seeds')
+        self.maize = Product.objects.create(category=category, name='Maize', description='', price=Decimal('2.00'), stock=5)
+        self.beans = Product.objects.create(category=category, name='Beans', description='', price=Decimal('3.00'), stock=4)
+        self.user = User.objects.create(username='shopper')
+        self.other = User.objects.create(username='rival')
+
+    def quantities(self, user):
+        return dict(Cart.objects.filter(user=user).values_list('product_id', 'quantity'))
+
+    def test_adds_increment_the_line(self):
+        self.assertEqual(add_line(self.user, self.maize, 2), 2)
+        self.assertEqual(add_lines(self.user, {self.maize.pk: 1, self.beans.pk: 1}), {self.maize.pk: 3, self.beans.pk: 1})
+        self.assertEqual(self.quantities(self.user), {self.maize.pk: 3, self.beans.pk: 1})
+
+    def test_adds_beyond_stock_are_rejected(self):
+        add_line(self.user, self.maize, 4)
+        self.assertIsNone(add_line(self.user, self.maize, 2))
+        self.assertIsNone(add_line(self.user, self.beans, 5))
+        self.assertEqual(self.quantities(self.user), {self.maize.pk: 4})
+        Product.objects.filter(pk=self.beans.pk).update(is_active=False)
+        self.assertEqual(add_lines(self.user, {self.beans.pk: 1}), {})
+
+    def test_guest_cart_merge_is_clamped_to_stock(self):
+        guest = GuestCart(RequestFactory().get('/'))
+        self.assertEqual(guest.add_lines({self.maize.pk: 3, self.beans.pk: 2}), {self.maize.pk: 3, self.beans.pk: 2})
+        self.assertIsNone(guest.add_line(self.beans, 3))
+        add_line(self.user, self.maize, 4)
+        self.assertEqual(guest.merge_into(self.user), [self.maize.pk])
+        self.assertEqual(self.quantities(self.user), {self.maize.pk: 5, self.beans.pk: 2})
+        self.assertEqual(len(guest), 0)
+
+    def test_holds_reserve_stock_from_other_buyers(self):
+        add_line(self.user, self.maize, 3)
+        add_line(self.other, self.maize, 3)
+        self.assertEqual(reserve_cart(self.user, list(Cart.objects.filter(user=self.user))), [])
+        self.assertIsNotNone(hold_expiry(self.user))
+        self.assertEqual(available_stock([self.maize], exclude_user=self.other), {self.maize.pk: 2})
+        self.assertEqual(available_stock([self.maize], exclude_user=self.user), {self.maize.pk: 5})
+        short = reserve_cart(self.other, list(Cart.objects.filter(user=self.other)))
+        self.assertEqual([(line.product_id, available) for line, available in short], [(self.maize.pk, 2)])
+        self.assertFalse(StockHold.objects.filter(user=self.other).exists())
+
+    def test_editing_the_cart_releases_holds(self):
+        add_line(self.user, self.maize, 3)
+        reserve_cart(self.user, list(Cart.objects.filter(user=self.user)))
+        add_line(self.user, self.beans, 1)
+        self.assertIsNone(hold_expiry(self.user))
+
+    def test_expired_holds_do_not_count(self):
+        StockHold.objects.create(user=self.other, product=self.maize, quantity=5, expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(available_stock([self.maize], exclude_user=self.user), {self.maize.pk: 5})
+
+# Simultaneous adds to one line from several requests; each upsert increments the row, so none
+# is lost. SQLite serializes writers anyway, so this needs a database with row locks.
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCartTests(TransactionTestCase):
+    def test_concurrent_adds_all_count(self):
+        category = Category.objects.create(name='Seeds', slug='seeds')
+        maize = Product.objects.create(category=category, name='Maize', description='', price=Decimal('2.00'), stock=100)
+        user = User.objects.create(username='shopper')
+        start = threading.Barrier(8)
+
+        def add():
+            start.wait()
+            add_line(user, maize, 1)
+            connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Cart.objects.get(user=user, product=maize).quantity, 8)
+
+# Content-addressed media: identical uploads share a blob, and gc_media only unlinks blobs that
+# are still orphaned past the grace period when it holds their row locks
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def age(self, name, hours):
+        MediaBlob.objects.filter(name=name).update(created_at=timezone.now() - timedelta(hours=hours))
+
+    def sweep(self):
+        call_command('gc_media', stdout=io.StringIO())
+
+    def test_duplicate_uploads_share_a_blob(self):
+        first = media_storage.save('products/a.jpg', ContentFile(b'maize'))
+        second = media_storage.save('products/b.JPG', ContentFile(b'maize'))
+        self.assertEqual(first, second)
+        self.assertEqual(MediaBlob.objects.get().size, 5)
+
+    def test_old_orphans_are_swept(self):
+        orphan = media_storage.save('products/a.jpg', ContentFile(b'maize'))
+        recent = media_storage.save('products/b.jpg', ContentFile(b'beans'))
+        referenced = media_storage.save('products/c.jpg', ContentFile(b'yams'))
+        self.age(orphan, 48)
+        self.age(referenced, 48)
+        MediaBlob.objects.filter(name=referenced).update(ref_count=1)
+        self.sweep()
+        self.assertCountEqual(MediaBlob.objects.values_list('name', flat=True), [recent, referenced])
+        self.assertFalse(media_storage.exists(orphan))
+        self.assertTrue(media_storage.exists(recent) and media_storage.exists(referenced))
+
+    def test_reupload_restarts_the_grace_period(self):
+        name = media_storage.save('products/a.jpg', ContentFile(b'maize'))
+        self.age(name, 48)
+        self.assertEqual(media_storage.save('products/b.jpg', ContentFile(b'maize')), name)
+        self.sweep()
+        self.assertTrue(MediaBlob.objects.filter(name=name).exists())
+        self.assertTrue(media_storage.exists(name))
+        self.assertEqual(os.listdir(media_storage.path('tmp')), [])
+
+# Admin changelists: every list renders, and a page costs the same queries however many rows it
+# shows, since each admin selects the relations its columns render
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(self.admin_user)
+        category = Category.objects.create(name='Tools', slug='tools')
+        self.hoe = Product.objects.create(category=category, name='Hoe', description='', price=Decimal('5.00'), stock=10)
+        self.lagos = BusinessLocation.objects.create(name='Lagos', address='1 Road', city='Lagos', country='Nigeria')
+
+    def changelist(self, model):
+        return self.client.get(reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist'))
+
+    def add_allocation(self):
+        user = User.objects.create(username=f'buyer{OrderAllocation.objects.count()}')
+        order = Order.objects.create(user=user, total_price=Decimal('5.00'))
+        item = OrderItem.objects.create(order=order, product=self.hoe, quantity=1, unit_price=Decimal('5.00'))
+        OrderAllocation.objects.create(order=order, order_item=item, location=self.lagos, quantity=1)
+        PaymentTransaction.objects.create(order=order, user=user, amount=Decimal('5.00'), gateway='stripe',
+                                          transaction_id=f'txn_{order.pk}')
+
+    def test_every_changelist_renders(self):
+        self.add_allocation()
+        for model in apps.get_app_config('store').get_models():
+            if not admin.site.is_registered(model):
+                continue
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.changelist(model).status_code, 200)
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.add_allocation()
+        for model in (OrderAllocation, PaymentTransaction, OrderItem):
+            with self.subTest(model=model.__name__):
+                with CaptureQueriesContext(connection) as one_row:
+                    self.changelist(model)
+                for _ in range(3):
+                    self.add_allocation()
+                with self.assertNumQueries(len(one_row)):
+                    self.changelist(model)
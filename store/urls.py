@@ -3,7 +3,8 @@ from .views import (
     UserDashboardView, ProductDetailView, StaticPageView, AddToCartView,
     CartView, RemoveFromCartView, PlaceOrderView, PaymentView, OrderHistoryView,
     SubmitReviewView, UserProfileView, NotificationView, CustomLoginView,
-    CustomLogoutView, RegisterView, OrderCreateView, ProductListView
+    CustomLogoutView, RegisterView, OrderCreateView, ProductListView, BulkCartView,
+    GuestAddToCartView, StartCheckoutView, PaymentWebhookView, CSRFTokenView
 )
 
 urlpatterns = [
@@ -14,9 +15,15 @@ urlpatterns = [
     path('cart/add/<int:pk>/', AddToCartView.as_view(), name='add_to_cart'),
     path('cart/', CartView.as_view(), name='cart'),
     path('cart/remove/<int:pk>/', RemoveFromCartView.as_view(), name='remove_from_cart'),
+    path('cart/guest/add/<int:pk>/', GuestAddToCartView.as_view(), name='guest_add_to_cart'),
+    path('csrf/', CSRFTokenView.as_view(), name='csrf_token'),
+    path('cart/bulk/', BulkCartView.as_view(), name='bulk_cart'),
     path('order/', OrderCreateView.as_view(), name='order_create'),
+    path('checkout/start/', StartCheckoutView.as_view(), name='start_checkout'),
     path('order/place/', PlaceOrderView.as_view(), name='place_order'),
     path('payment/', PaymentView.as_view(), name='payment'),
+    path('payment/<int:order_id>/', PaymentView.as_view(), name='payment'),
+    path('webhooks/payments/<str:gateway>/', PaymentWebhookView.as_view(), name='payment_webhook'),
     path('order-history/', OrderHistoryView.as_view(), name='order_history'),
     path('products/<int:pk>/review/', SubmitReviewView.as_view(), name='submit_review'),
     path('profile/', UserProfileView.as_view(), name='user_profile'),
@@ -1,16 +1,31 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import Http404, HttpResponse, JsonResponse
+from django.conf import settings
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView, DetailView, FormView, CreateView, View
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from django.contrib import messages
-from django.db.models import Sum, F
+from django.db.models import OuterRef, Subquery
 from django.db import transaction
-from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
+from django.middleware.csrf import get_token
 from decimal import Decimal
+from .caching import catalog_version, user_version, version_datetime, make_etag
+from .cart import GuestCart, add_line, add_lines, remove_lines, cart_lines, cart_total
+from .stock import available_stock, hold_expiry, lock_products, release_holds, reserve_cart
+from .routing import AllocationError, allocate_order
+from .outbox import publish
+from .jobs import enqueue
+from .webhooks import parse_event, verify_signature
+from .idempotency import DuplicateRequest, claim_key, issue_key, record_result, stored_result
 from .models import (
-    Product, FarmingProduct, Order, OrderItem, PaymentTransaction, Notification, DeliveryTracking,
-    Report, AnnualProduction, Category, UserProfile, Review, Customer, Cart, BusinessLocation
+    Product, FarmingProduct, Order, OrderItem, PaymentTransaction, Notification,
+    Report, AnnualProduction, Category, UserProfile, Review, Customer, Cart, WebhookEvent
 )
 from .forms import (UserProfileForm, UserInfoForm, UserPasswordChangeForm, ReviewForm,
     ProductFilterForm, PaymentForm, OrderForm, RegisterForm, AddToCartForm, ContactForm
@@ -34,7 +49,7 @@ class StaticPageView(View):
         if page == 'types_of_farming':
             context['categories'] = Category.objects.all()
         elif page == 'annual_report':
-            context['reports'] = Report.objects.filter(report_type__in=['sales', 'production', 'profit_loss'])[:5]
+            context['reports'] = Report.objects.filter(report_type__in=['sales', 'production', 'profit_loss']).order_by('-period_start', 'report_type')[:5]
         elif page == 'annual_cultivation':
             context['productions'] = AnnualProduction.objects.select_related('product__product', 'farm').order_by('-year')[:10]
         elif page == 'harvest_report':
@@ -55,8 +70,43 @@ class StaticPageView(View):
                 return render(request, 'store/contact.html', {'form': form})
         return redirect('static_page', page=page)
 
+# Conditional GET: answers 304 from cheap validators before the view evaluates its queryset
+class ConditionalResponseMixin:
+    def get_validators(self, request, *args, **kwargs):
+        # Return (etag parts, last modified datetime), or None to always render. Views override
+        # this; the default never answers 304, so a view without validators behaves as before.
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        # Pending flash messages must be rendered, so those responses are never revalidated
+        if request.method not in ('GET', 'HEAD') or len(getattr(request, '_messages', ())):
+            return super().dispatch(request, *args, **kwargs)
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        parts, last_modified = validators
+        if request.user.is_authenticated:
+            # Cart count, notifications, avatar and CSRF token are part of the rendered page
+            version = user_version(request.user.pk)
+            parts = [*parts, request.user.pk, version, request.META.get('CSRF_COOKIE', '')]
+            last_modified = max(last_modified, version_datetime(version))
+        etag = make_etag(request.get_full_path(), *parts)
+        view = condition(etag_func=lambda *a, **kw: etag, last_modified_func=lambda *a, **kw: last_modified)
+        response = view(super().dispatch)(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            patch_cache_control(response, no_cache=True, private=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
+
+class CatalogConditionalMixin(ConditionalResponseMixin):
+    def get_validators(self, request, *args, **kwargs):
+        version = catalog_version()
+        return [version], version_datetime(version)
+
 # User Dashboard
-class UserDashboardView(ListView):
+class UserDashboardView(CatalogConditionalMixin, ListView):
     template_name = 'store/index.html'
     context_object_name = 'products'
     paginate_by = 12  # 4 rows x 3 columns
@@ -84,7 +134,7 @@ class UserDashboardView(ListView):
             context['cart_items'] = 0
         return context
 
-class ProductListView(ListView):
+class ProductListView(CatalogConditionalMixin, ListView):
     template_name = 'store/product_list.html'
     context_object_name = 'products'
     paginate_by = 20
@@ -93,11 +143,23 @@ class ProductListView(ListView):
         return Product.objects.filter(is_active=True).select_related('category').order_by('id')
 
 # Product Detail
-class ProductDetailView(DetailView):
+class ProductDetailView(ConditionalResponseMixin, DetailView):
     model = Product
     template_name = 'store/product_detail.html'
     context_object_name = 'product'
 
+    def get_validators(self, request, *args, **kwargs):
+        latest_review = Review.objects.filter(product=OuterRef('pk'), is_approved=True).order_by('-created_at')
+        row = Product.objects.filter(pk=kwargs['pk']).values_list(
+            'updated_at', Subquery(latest_review.values('created_at')[:1])
+        ).first()
+        if row is None:
+            return None
+        updated_at, reviewed_at = row
+        version = catalog_version()
+        last_modified = max(filter(None, [updated_at, reviewed_at, version_datetime(version)]))
+        return [updated_at, reviewed_at, version], last_modified
+
     def get_queryset(self):
         return Product.objects.select_related('category').prefetch_related('reviews')
 
@@ -120,47 +182,120 @@ class AddToCartView(LoginRequiredMixin, View):
         form = AddToCartForm(request.POST, product=product)
         if form.is_valid():
             quantity = form.cleaned_data['quantity']
-            cart_item, created = Cart.objects.get_or_create(
-                user=request.user,
-                product=product,
-                defaults={'quantity': quantity}
-            )
-            if not created:
-                new_quantity = cart_item.quantity + quantity
-                if new_quantity > product.stock:
-                    messages.error(request, f"Cannot add {quantity} more. Only {product.stock - cart_item.quantity} left in stock.")
-                    return redirect('product_detail', pk=pk)
-                cart_item.quantity = new_quantity
-                cart_item.save()
+            if add_line(request.user, product, quantity) is None:
+                in_cart = Cart.objects.filter(user=request.user, product=product).values_list('quantity', flat=True).first() or 0
+                product.refresh_from_db(fields=['stock'])
+                messages.error(request, f"Cannot add {quantity} more. Only {max(product.stock - in_cart, 0)} left in stock.")
+                return redirect('product_detail', pk=pk)
             messages.success(request, f"{product.name} added to cart.")
             return redirect('cart')
         messages.error(request, "Invalid quantity.")
         return redirect('product_detail', pk=pk)
 
-# Remove from Cart
-class RemoveFromCartView(LoginRequiredMixin, View):
+# CSRF token for forms on pages shared by every anonymous visitor (see AnonymousPageCacheMiddleware),
+# which cannot carry a token of their own; base.html fetches it when such a form is submitted
+@method_decorator(never_cache, name='dispatch')
+class CSRFTokenView(View):
+    def get(self, request):
+        return JsonResponse({'token': get_token(request)})
+
+# Add to Guest Cart
+class GuestAddToCartView(View):
     def post(self, request, pk):
-        cart_item = get_object_or_404(Cart, pk=pk, user=request.user)
-        product_name = cart_item.product.name
-        cart_item.delete()
-        messages.success(request, f"{product_name} removed from cart.")
-        return redirect('cart')
+        if request.user.is_authenticated:
+            return redirect('product_detail', pk=pk)
+        product = get_object_or_404(Product, pk=pk, is_active=True)
+        form = AddToCartForm(request.POST, product=product)
+        if not form.is_valid():
+            messages.error(request, "Invalid quantity.")
+            return redirect('product_detail', pk=pk)
+        guest_cart = GuestCart(request)
+        quantity = form.cleaned_data['quantity']
+        if guest_cart.add_line(product, quantity) is None:
+            in_cart = guest_cart.quantities.get(product.pk, 0)
+            messages.error(request, f"Cannot add {quantity} more. Only {max(product.stock - in_cart, 0)} left in stock.")
+            return redirect('product_detail', pk=pk)
+        messages.success(request, f"{product.name} added to cart.")
+        return guest_cart.save(redirect('cart'))
+
+# Add or remove several cart lines in one request
+class BulkCartView(View):
+    def post(self, request):
+        guest_cart = None if request.user.is_authenticated else GuestCart(request)
+        action = request.POST.get('action')
+        if action == 'add':
+            try:
+                quantities = {
+                    int(product_id): int(quantity)
+                    for product_id, quantity in zip(request.POST.getlist('product'), request.POST.getlist('quantity'))
+                }
+            except ValueError:
+                messages.error(request, "Invalid quantity.")
+                return redirect('cart')
+            if guest_cart is None:
+                written = add_lines(request.user, quantities)
+            else:
+                written = guest_cart.add_lines(quantities)
+            rejected = [product_id for product_id, quantity in quantities.items() if quantity > 0 and product_id not in written]
+            if written:
+                messages.success(request, f"{len(written)} item(s) added to cart.")
+            if rejected:
+                names = Product.objects.filter(pk__in=rejected).values_list('name', flat=True)
+                messages.error(request, f"Not enough stock for: {', '.join(names)}.")
+        elif action == 'remove':
+            lines = request.POST.getlist('line')
+            names = remove_lines(request.user, lines) if guest_cart is None else guest_cart.remove_lines(lines)
+            if names:
+                messages.success(request, f"{', '.join(names)} removed from cart.")
+        else:
+            messages.error(request, "Unknown cart action.")
+        response = redirect('cart')
+        return response if guest_cart is None else guest_cart.save(response)
+
+# Remove from Cart (a line id, or a product id for guest carts)
+class RemoveFromCartView(View):
+    def post(self, request, pk):
+        guest_cart = None if request.user.is_authenticated else GuestCart(request)
+        names = remove_lines(request.user, [pk]) if guest_cart is None else guest_cart.remove_lines([pk])
+        if not names:
+            raise Http404("No cart line matches the given query.")
+        messages.success(request, f"{names[0]} removed from cart.")
+        response = redirect('cart')
+        return response if guest_cart is None else guest_cart.save(response)
 
 # View Cart
-class CartView(LoginRequiredMixin, ListView):
+class CartView(ListView):
     template_name = 'store/cart.html'
     context_object_name = 'cart_items'
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user).select_related('product__category')
+        if self.request.user.is_authenticated:
+            return cart_lines(self.request.user)
+        return GuestCart(self.request).lines()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        cart_items = self.get_queryset()
-        context['total_price'] = cart_items.aggregate(total=Sum(F('product__price') * F('quantity')))['total'] or Decimal('0.00')
-        context['order_form'] = OrderForm(user=self.request.user)
+        context['total_price'] = cart_total(self.object_list)
+        if self.request.user.is_authenticated:
+            context['order_form'] = OrderForm(user=self.request.user)
+            context['hold_expires_at'] = hold_expiry(self.request.user)
         return context
 
+# Start Checkout (reserve the cart's stock for STOCK_HOLD_TTL seconds)
+class StartCheckoutView(LoginRequiredMixin, View):
+    def post(self, request):
+        lines = cart_lines(request.user)
+        if not lines:
+            messages.error(request, "Your cart is empty.")
+            return redirect('cart')
+        short = reserve_cart(request.user, lines)
+        for line, available in short:
+            messages.error(request, f"Insufficient stock for {line.product.name}. Only {available} available.")
+        if not short:
+            minutes = settings.STOCK_HOLD_TTL // 60
+            messages.success(request, f"Your items are reserved for {minutes} minutes. Enter your shipping details to place the order.")
+        return redirect('cart')
+
 # Place Order (Cart-based)
 class PlaceOrderView(LoginRequiredMixin, View):
     def post(self, request):
@@ -174,19 +309,21 @@ class PlaceOrderView(LoginRequiredMixin, View):
             messages.error(request, "Invalid shipping details.")
             return redirect('cart')
 
-        # Validate stock
-        for item in cart_items:
-            if item.quantity > item.product.stock:
-                messages.error(request, f"Insufficient stock for {item.product.name}. Only {item.product.stock} available.")
-                return redirect('cart')
-
         try:
             with transaction.atomic():
+                # Validate stock against locked rows; other buyers' active holds are not available
+                products = lock_products([item.product_id for item in cart_items])
+                available = available_stock(products.values(), exclude_user=self.request.user)
+                for item in cart_items:
+                    item.product = products[item.product_id]
+                    if item.quantity > available[item.product_id]:
+                        messages.error(request, f"Insufficient stock for {item.product.name}. Only {available[item.product_id]} available.")
+                        return redirect('cart')
+
                 # Create or get UserProfile
                 user_profile, created = UserProfile.objects.get_or_create(user=self.request.user)
                 order = Order.objects.create(
                     user=self.request.user,
-                    location=BusinessLocation.objects.first(),  # Placeholder, update with user-selected location
                     total_price=Decimal('0.00'),
                     status='pending',
                     shipping_address=order_form.cleaned_data['shipping_address'],
@@ -195,51 +332,35 @@ class PlaceOrderView(LoginRequiredMixin, View):
                     shipping_postal_code=order_form.cleaned_data['shipping_postal_code']
                 )
 
-                # Create OrderItems and update stock
+                # Create OrderItems, then route them to fulfilling locations and update stock
                 total_price = Decimal('0.00')
+                order_items = []
                 for item in cart_items:
                     subtotal = item.product.price * item.quantity
-                    OrderItem.objects.create(
+                    order_items.append(OrderItem.objects.create(
                         order=order,
                         product=item.product,
                         quantity=item.quantity,
                         unit_price=item.product.price,
                         subtotal=subtotal
-                    )
-                    item.product.stock -= item.quantity
-                    item.product.save()
+                    ))
                     total_price += subtotal
                 order.total_price = total_price
                 order.save()
+                allocate_order(order, order_items)
 
-                # Create Notification
-                Notification.objects.create(
-                    user=self.request.user,
-                    message=f"Order #{order.id} placed successfully!",
-                    type='order_update',
-                    order=order
-                )
+                # Notification, tracking and loyalty points are applied by drain_outbox
+                publish('order.placed', order_id=order.id, payment_method=order_form.data.get('payment_method'))
 
-                # Create DeliveryTracking
-                DeliveryTracking.objects.create(
-                    order=order,
-                    tracking_number=f"TRK{order.id}{int(timezone.now().timestamp())}",
-                    carrier="Default Carrier",
-                    status='preparing'
-                )
-
-                # Update Customer loyalty points
-                customer, created = Customer.objects.get_or_create(user=self.request.user)
-                customer.loyalty_points += int(total_price // 10)  # 1 point per $10
-                customer.last_purchase = timezone.now()
-                customer.preferred_payment_method = order_form.data.get('payment_method', customer.preferred_payment_method)
-                customer.save()
-
-                # Clear cart
+                # Clear cart and consume this checkout's holds
                 cart_items.delete()
+                release_holds(self.request.user)
 
                 messages.success(request, f"Order #{order.id} placed successfully! Proceed to payment.")
-                return redirect('payment')
+                return redirect('payment', order_id=order.id)
+        except AllocationError as e:
+            messages.error(request, str(e))
+            return redirect('cart')
         except Exception as e:
             messages.error(request, f"Failed to place order: {str(e)}")
             return redirect('cart')
@@ -249,7 +370,6 @@ class OrderCreateView(LoginRequiredMixin, FormView):
     login_url = '/login/'  # Add this
     template_name = 'store/order.html'
     form_class = OrderForm
-    success_url = reverse_lazy('payment')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -257,30 +377,35 @@ class OrderCreateView(LoginRequiredMixin, FormView):
         return context
 
     def form_valid(self, form):
-        selected_products = []
-        total_price = Decimal('0.00')
+        quantities = {}
         for key, value in self.request.POST.items():
             if key.startswith('quantity_') and int(value) > 0:
-                product_id = key.replace('quantity_', '')
-                product = get_object_or_404(Product, pk=product_id, is_active=True)
-                quantity = int(value)
-                if quantity > product.stock:
-                    messages.error(self.request, f"Insufficient stock for {product.name}. Only {product.stock} available.")
-                    return redirect('order_create')
-                selected_products.append((product, quantity))
-                total_price += product.price * quantity
-
-        if not selected_products:
+                product = get_object_or_404(Product, pk=key.replace('quantity_', ''), is_active=True)
+                quantities[product.pk] = int(value)
+
+        if not quantities:
             messages.error(self.request, "Please select at least one product.")
             return redirect('order_create')
 
         try:
             with transaction.atomic():
+                # Validate stock against locked rows; other buyers' active holds are not available
+                products = lock_products(list(quantities))
+                available = available_stock(products.values(), exclude_user=self.request.user)
+                selected_products = []
+                total_price = Decimal('0.00')
+                for product_id, quantity in quantities.items():
+                    product = products[product_id]
+                    if quantity > available[product_id]:
+                        messages.error(self.request, f"Insufficient stock for {product.name}. Only {available[product_id]} available.")
+                        return redirect('order_create')
+                    selected_products.append((product, quantity))
+                    total_price += product.price * quantity
+
                 # Create or get UserProfile
                 user_profile, created = UserProfile.objects.get_or_create(user=self.request.user)
                 order = Order.objects.create(
                     user=self.request.user,
-                    location=BusinessLocation.objects.first(),  # Placeholder, update with user-selected location
                     total_price=total_price,
                     status='pending',
                     shipping_address=form.cleaned_data['shipping_address'],
@@ -289,7 +414,7 @@ class OrderCreateView(LoginRequiredMixin, FormView):
                     shipping_postal_code=form.cleaned_data['shipping_postal_code']
                 )
 
-                for product, quantity in selected_products:
+                order_items = [
                     OrderItem.objects.create(
                         order=order,
                         product=product,
@@ -297,31 +422,16 @@ class OrderCreateView(LoginRequiredMixin, FormView):
                         unit_price=product.price,
                         subtotal=product.price * quantity
                     )
-                    product.stock -= quantity
-                    product.save()
-
-                Notification.objects.create(
-                    user=self.request.user,
-                    message=f"Order #{order.id} placed successfully!",
-                    type='order_update',
-                    order=order
-                )
-
-                DeliveryTracking.objects.create(
-                    order=order,
-                    tracking_number=f"TRK{order.id}{int(timezone.now().timestamp())}",
-                    carrier="Default Carrier",
-                    status='preparing'
-                )
-
-                customer, created = Customer.objects.get_or_create(user=self.request.user)
-                customer.loyalty_points += int(total_price // 10)  # 1 point per $10
-                customer.last_purchase = timezone.now()
-                customer.preferred_payment_method = form.data.get('payment_method', customer.preferred_payment_method)
-                customer.save()
+                    for product, quantity in selected_products
+                ]
+                allocate_order(order, order_items)
+                publish('order.placed', order_id=order.id, payment_method=form.data.get('payment_method'))
 
                 messages.success(self.request, f"Order #{order.id} placed successfully! Proceed to payment.")
-                return super().form_valid(form)
+                return redirect('payment', order_id=order.id)
+        except AllocationError as e:
+            messages.error(self.request, str(e))
+            return redirect('order_create')
         except Exception as e:
             messages.error(self.request, f"Failed to place order: {str(e)}")
             return redirect('order_create')
@@ -332,76 +442,129 @@ class PaymentView(LoginRequiredMixin, FormView):
     form_class = PaymentForm
     success_url = reverse_lazy('order_history')
 
+    # Transaction id prefix and gateway per payment method
+    GATEWAYS = {
+        'stripe': ('txn_stripe', 'stripe'),
+        'paypal': ('txn_paypal', 'paypal'),
+        'bank_transfer': ('txn_sct', 'bank_transfer'),
+        'sdd': ('txn_sdd', 'bank_transfer'),  # Map SDD to bank_transfer
+    }
+
+    def get_order(self):
+        # The order being paid comes from the URL; without one the page lists the unpaid orders
+        if 'order_id' not in self.kwargs:
+            return None
+        return get_object_or_404(Order, pk=self.kwargs['order_id'], user=self.request.user)
+
+    def get_initial(self):
+        return {'idempotency_key': issue_key()}
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['order'] = Order.objects.filter(user=self.request.user).order_by('-ordered_at').first()
-        context['products'] = Product.objects.filter(is_active=True).select_related('category')
-        context['form'] = PaymentForm(user=self.request.user)
+        context['order'] = self.get_order()
+        if context['order'] is None:
+            context['unpaid_orders'] = (Order.objects.filter(user=self.request.user, status='pending')
+                                        .exclude(payments__status__in=['authorizing', 'pending', 'completed']).order_by('-ordered_at'))
+            context['products'] = Product.objects.filter(is_active=True).select_related('category')
         return context
 
     def form_valid(self, form):
-        order = Order.objects.filter(user=self.request.user).order_by('-ordered_at').first()
+        order = self.get_order()
         if not order:
-            messages.error(self.request, "No recent order found. Please place an order first.")
-            return redirect('order_create')
+            messages.error(self.request, "Choose the order to pay first.")
+            return redirect('payment')
+
+        key = form.cleaned_data['idempotency_key']
+        result = stored_result(self.request.user.pk, 'payment', key)
+        if result is None:
+            try:
+                with transaction.atomic():
+                    entry = claim_key(self.request.user, 'payment', key)
+                    result = self.pay(order, form, key)
+                    record_result(entry, result)
+            except DuplicateRequest as e:
+                result = e.result
+            except Exception as e:
+                messages.error(self.request, f"Payment failed: {str(e)}")
+                return redirect('payment', order_id=order.id)
+        if result is None:
+            # The key is taken but its result is gone (purged) or unreadable; don't pay twice
+            messages.info(self.request, "This payment form was already submitted. Check your order history for its status.")
+            return redirect('order_history')
+        if result['order_id'] != order.id:
+            messages.error(self.request, f"This payment form was already submitted for Order #{result['order_id']}.")
+            return redirect('payment', order_id=order.id)
+        messages.success(self.request, result['message'])
+        return super().form_valid(form)
 
+    def pay(self, order, form, key):
+        # Records the payment of order for the gateway to authorize once this transaction commits, and
+        # returns the result stored with the idempotency key. The order row is locked so two forms
+        # submitted with different keys cannot both pass the check for an existing payment.
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.payments.filter(status__in=['authorizing', 'pending', 'completed']).exists():
+            raise ValueError(f"Order #{order.id} already has a payment.")
         payment_method = form.cleaned_data['payment_method']
         currency = self.request.user.userprofile.preferred_currency or 'USD'
+        prefix, gateway = self.GATEWAYS[payment_method]
+        if payment_method == 'sdd' and (not form.cleaned_data['iban'] or not form.cleaned_data['sdd_mandate']):
+            raise ValueError("IBAN and mandate authorization required for SEPA Direct Debit.")
+        payment = PaymentTransaction.objects.create(
+            order=order,
+            user=self.request.user,
+            amount=order.total_price,
+            currency=currency,
+            gateway=gateway,
+            payment_method=payment_method,
+            transaction_id=f"{prefix}_{order.id}_{key}",
+            status='authorizing'
+        )
+        enqueue('payments.authorize', unique=True)
 
-        try:
-            with transaction.atomic():
-                if payment_method == 'stripe':
-                    # Simulate Stripe card payment
-                    transaction_id = f"txn_stripe_{order.id}_{int(timezone.now().timestamp())}"
-                    gateway = 'stripe'
-                    status = 'completed'  # Simulate success
-                elif payment_method == 'paypal':
-                    # Simulate PayPal card payment
-                    transaction_id = f"txn_paypal_{order.id}_{int(timezone.now().timestamp())}"
-                    gateway = 'paypal'
-                    status = 'completed'  # Simulate success
-                elif payment_method == 'bank_transfer':
-                    # Simulate SEPA Credit Transfer
-                    transaction_id = f"txn_sct_{order.id}_{int(timezone.now().timestamp())}"
-                    gateway = 'bank_transfer'
-                    status = 'pending'  # Manual verification
-                elif payment_method == 'sdd':
-                    # Simulate SEPA Direct Debit
-                    if not form.cleaned_data['iban'] or not form.cleaned_data['sdd_mandate']:
-                        raise ValueError("IBAN and mandate authorization required for SEPA Direct Debit.")
-                    transaction_id = f"txn_sdd_{order.id}_{int(timezone.now().timestamp())}"
-                    gateway = 'bank_transfer'  # Map SDD to bank_transfer
-                    status = 'pending'  # Requires mandate verification
-
-                PaymentTransaction.objects.create(
-                    order=order,
-                    user=self.request.user,
-                    amount=order.total_price,
-                    currency=currency,
-                    transaction_id=transaction_id,
-                    status=status
-                )
-
-                # Update Customer preferred payment method
-                customer, created = Customer.objects.get_or_create(user=self.request.user)
-                customer.preferred_payment_method = payment_method
-                customer.save()
+        # Update Customer preferred payment method
+        customer, created = Customer.objects.get_or_create(user=self.request.user)
+        customer.preferred_payment_method = payment_method
+        customer.save()
 
-                order.status = 'processing' if payment_method in ['stripe', 'paypal'] else 'pending'
-                order.save()
-
-                Notification.objects.create(
-                    user=self.request.user,
-                    message=f"Payment for Order #{order.id} initiated via {payment_method}.",
-                    type='order_update',
-                    order=order
-                )
-
-                messages.success(self.request, f"Payment for Order #{order.id} initiated successfully!")
-                return super().form_valid(form)
-        except Exception as e:
-            messages.error(self.request, f"Payment failed: {str(e)}")
-            return redirect('payment')
+        Notification.objects.create(
+            user=self.request.user,
+            message=f"Payment for Order #{order.id} initiated via {payment_method}.",
+            type='order_update',
+            order=order
+        )
+        message = f"Payment for Order #{order.id} initiated successfully! You will be notified once it is confirmed."
+        if payment_method == 'bank_transfer':
+            # Statements are reconciled by this reference (see reconcile_statement)
+            message += f" Please quote {payment.transaction_id} as the transfer reference."
+        return {
+            'order_id': order.id,
+            'transaction_id': payment.transaction_id,
+            'status': payment.status,
+            'message': message,
+        }
+
+# Payment Webhooks (authenticated by the gateway's signature instead of a session or CSRF token)
+@method_decorator(csrf_exempt, name='dispatch')
+class PaymentWebhookView(View):
+    def post(self, request, gateway):
+        secret = settings.PAYMENT_WEBHOOK_SECRETS.get(gateway)
+        if not secret:
+            raise Http404("Unknown gateway.")
+        if not verify_signature(secret, request.headers.get('X-Signature', ''), request.body):
+            return HttpResponse("Invalid signature.", status=400)
+        try:
+            event = parse_event(gateway, request.body)
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        # A redelivered event id is dropped by the unique key; either way the gateway gets its 200
+        WebhookEvent.objects.bulk_create([event], ignore_conflicts=True)
+        enqueue('payments.webhooks', unique=True)
+        return HttpResponse(status=200)
 
 # Order History
 class OrderHistoryView(LoginRequiredMixin, ListView):
@@ -414,7 +577,7 @@ class OrderHistoryView(LoginRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['delivery_statuses'] = {order.id: order.delivery.first() for order in context['orders']}
+        context['delivery_statuses'] = {order.id: getattr(order, 'delivery', None) for order in context['orders']}
         return context
 
 # Submit Review
@@ -463,6 +626,8 @@ class UserProfileView(LoginRequiredMixin, View):
             if profile_form.is_valid():
                 profile_form.save()
                 messages.success(request, "Profile updated successfully.")
+                if profile_form.has_new_picture:
+                    messages.info(request, "Your new profile picture is being processed and will appear shortly.")
                 return redirect('user_profile')
             else:
                 messages.error(request, "Failed to update profile. Please check the form.")
@@ -506,13 +671,25 @@ class NotificationView(LoginRequiredMixin, ListView):
         return redirect('notifications')
 
 # Authentication Views
-class CustomLoginView(LoginView):
+# Carries a visitor's guest cart over to their account once they are known
+class GuestCartMergeMixin:
+    def merge_guest_cart(self, user, response):
+        guest_cart = GuestCart(self.request)
+        if len(guest_cart):
+            adjusted = guest_cart.merge_into(user)
+            if adjusted:
+                names = Product.objects.filter(pk__in=adjusted).values_list('name', flat=True)
+                messages.warning(self.request, f"Some cart items were limited by available stock: {', '.join(names)}.")
+            guest_cart.save(response)
+        return response
+
+class CustomLoginView(GuestCartMergeMixin, LoginView):
     template_name = 'store/login.html'
     redirect_authenticated_user = True
 
     def form_valid(self, form):
         messages.success(self.request, "Logged in successfully.")
-        return super().form_valid(form)
+        return self.merge_guest_cart(form.get_user(), super().form_valid(form))
 
 class CustomLogoutView(LogoutView):
     next_page = reverse_lazy('user_dashboard')
@@ -521,7 +698,7 @@ class CustomLogoutView(LogoutView):
         messages.success(request, "Logged out successfully.")
         return super().dispatch(request, *args, **kwargs)
 
-class RegisterView(CreateView):
+class RegisterView(GuestCartMergeMixin, CreateView):
     form_class = RegisterForm
     template_name = 'store/register.html'
     success_url = reverse_lazy('user_dashboard')
@@ -534,8 +711,7 @@ class RegisterView(CreateView):
 
     def form_valid(self, form):
         with transaction.atomic():
-            response = super().form_valid(form)
-            user = form.save()  # RegisterForm creates UserProfile
-            Customer.objects.get_or_create(user=user)
+            response = super().form_valid(form)  # RegisterForm creates UserProfile
+            Customer.objects.get_or_create(user=self.object)
             messages.success(self.request, "Registration successful! Please log in.")
-            return response
\ No newline at end of file
+            return self.merge_guest_cart(self.object, response)
\ No newline at end of file
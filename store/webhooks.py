@@ -0,0 +1,158 @@
+import hashlib
+import hmac
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .caching import bump_user_version
+from .jobs import job
+from .models import Notification, Order, PaymentTransaction, WebhookEvent
+from .payments import STATUS_RANK, status_message
+
+# Payment webhooks. A gateway (named as in PaymentTransaction.gateway) signs each event with its
+# secret from PAYMENT_WEBHOOK_SECRETS: the X-Signature header is
+# "t=<unix time>,v1=<hex HMAC-SHA256 of '<t>.<body>'>", and events signed more than
+# PAYMENT_WEBHOOK_TOLERANCE seconds away from now are refused. The receiver stores a verified event
+# with one insert that drops redeliveries of the same event id and acknowledges it;
+# 'payments.webhooks' applies stored events in batches, in gateway time order per transaction. An
+# event only reaches payments made through the gateway that signed it, and a transition only takes
+# effect if it moves the payment up STATUS_RANK (or from failed to completed, if it is the newer
+# event; a completed payment only moves to refunded), so duplicates and late arrivals are harmless.
+#
+# Events are JSON objects: {"id", "type", "transaction_id", "created" (unix time or ISO 8601),
+# "reference", "message"}, where type is one of EVENT_STATUSES; other types are stored and ignored.
+
+EVENT_STATUSES = {
+    'payment.pending': 'pending',
+    'payment.completed': 'completed',
+    'payment.failed': 'failed',
+    'payment.refunded': 'refunded',
+}
+
+UPDATE_SQL = (
+    "UPDATE {table} SET status = %s, gateway_reference = %s, last_error = %s, gateway_event_at = %s, "
+    "updated_at = %s WHERE id = %s"
+)
+
+def digest(secret, body, timestamp):
+    return hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+def sign(secret, body, timestamp=None):
+    # The X-Signature header value for body (bytes)
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    return f"t={timestamp},v1={digest(secret, body, timestamp)}"
+
+def verify_signature(secret, header, body, now=None):
+    try:
+        fields = dict(part.split('=', 1) for part in header.split(','))
+        timestamp = int(fields['t'])
+    except (KeyError, ValueError):
+        return False
+    if abs((time.time() if now is None else now) - timestamp) > settings.PAYMENT_WEBHOOK_TOLERANCE:
+        return False
+    # Compared as bytes: compare_digest refuses str with non-ASCII characters
+    return hmac.compare_digest(digest(secret, body, timestamp).encode(), fields.get('v1', '').encode('latin-1', 'replace'))
+
+def parse_event(gateway, body):
+    # An unsaved WebhookEvent for a request body; raises ValueError if it is not a valid event
+    payload = json.loads(body)
+    if not isinstance(payload, dict) or not payload.get('id') or not payload.get('transaction_id'):
+        raise ValueError("An event needs an id and a transaction_id.")
+    created = payload.get('created')
+    if isinstance(created, (int, float)):
+        occurred_at = datetime.fromtimestamp(created, tz=dt_timezone.utc)
+    else:
+        occurred_at = parse_datetime(str(created or ''))
+        if occurred_at is None:
+            raise ValueError("An event needs its created time.")
+        if timezone.is_naive(occurred_at):
+            occurred_at = timezone.make_aware(occurred_at, dt_timezone.utc)
+    return WebhookEvent(
+        gateway=gateway,
+        event_id=str(payload['id'])[:100],
+        event_type=str(payload.get('type', ''))[:50],
+        transaction_id=str(payload['transaction_id'])[:100],
+        occurred_at=occurred_at,
+        payload=payload,
+    )
+
+def advances(payment, status, occurred_at):
+    # Whether an event of the given status and time moves payment forward. A completed payment has
+    # paid for its order, so only a refund moves it on.
+    if payment.status == 'completed':
+        return status == 'refunded'
+    current, new = STATUS_RANK[payment.status], STATUS_RANK[status]
+    if new != current:
+        return new > current
+    return status != payment.status and (payment.gateway_event_at is None or occurred_at > payment.gateway_event_at)
+
+def apply_batch(batch_size=500):
+    # Applies up to batch_size stored events; returns their number. Rows another consumer has
+    # locked are skipped on databases that support it.
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(WebhookEvent.objects.select_for_update(skip_locked=True)
+                      .filter(processed_at__isnull=True).order_by('id')[:batch_size])
+        if not events:
+            return 0
+        payments = {
+            (payment.gateway, payment.transaction_id): payment
+            for payment in PaymentTransaction.objects.select_for_update().filter(transaction_id__in={event.transaction_id for event in events})
+        }
+        outcomes = defaultdict(list)
+        reached = {}
+        for event in sorted(events, key=lambda event: (event.transaction_id, event.occurred_at, event.pk)):
+            # A payment of another gateway counts as unknown to the one that sent the event
+            payment = payments.get((event.gateway, event.transaction_id))
+            status = EVENT_STATUSES.get(event.event_type)
+            if payment is None:
+                outcomes['unknown'].append(event.pk)
+            elif status is None or not advances(payment, status, event.occurred_at):
+                outcomes['ignored'].append(event.pk)
+            else:
+                reached.setdefault(payment.pk, payment.status)
+                payment.status = status
+                payment.gateway_event_at = event.occurred_at
+                payment.gateway_reference = str(event.payload.get('reference') or payment.gateway_reference)[:100]
+                payment.last_error = str(event.payload.get('message') or '') if status == 'failed' else ''
+                outcomes['applied'].append(event.pk)
+        # Only the status each payment ends the batch with is written and announced
+        changed = [payment for payment in payments.values() if payment.pk in reached and payment.status != reached[payment.pk]]
+        with connection.cursor() as cursor:
+            cursor.executemany(UPDATE_SQL.format(table=PaymentTransaction._meta.db_table), [
+                (payment.status, payment.gateway_reference, payment.last_error, payment.gateway_event_at, now, payment.pk)
+                for payment in changed
+            ])
+        Order.objects.filter(
+            pk__in=[payment.order_id for payment in changed if payment.status == 'completed'], status='pending',
+        ).update(status='processing', updated_at=now)
+        Notification.objects.bulk_create([
+            Notification(user_id=payment.user_id, order_id=payment.order_id, type='order_update',
+                         message=status_message(payment.order_id, payment.status, payment.last_error))
+            for payment in changed
+        ])
+        for outcome, ids in outcomes.items():
+            WebhookEvent.objects.filter(pk__in=ids).update(processed_at=now, outcome=outcome)
+    # Bulk writes skip the signals that refresh each customer's cached pages
+    for user_id in {payment.user_id for payment in changed}:
+        bump_user_version(user_id)
+    return len(events)
+
+@job('payments.webhooks', priority=9)
+def apply_webhook_events(batch_size=500):
+    # Applies every stored event; returns the number applied, ignored or unknown
+    handled = 0
+    while True:
+        done = apply_batch(batch_size)
+        handled += done
+        if done < batch_size:
+            return handled
+
+def prune_events():
+    # Deletes processed events older than JOB_RETENTION_DAYS; returns the number removed
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    return WebhookEvent.objects.filter(processed_at__lt=cutoff).delete()[0]